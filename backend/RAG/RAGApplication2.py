@@ -3,11 +3,10 @@ import os
 from typing import List, Tuple
 
 # RAG packages
-from PyPDF2 import PdfReader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.vectorstores import FAISS
 from langchain.schema import Document
 from langchain.embeddings import SentenceTransformerEmbeddings
+from RAG.pdf_text_stream import get_text_splitter, iter_pdf_chunks, build_faiss_from_documents
 
 class RAGSystem:
     def __init__(self, embedding_model):
@@ -20,24 +19,6 @@ class RAGSystem:
         #self.embedding_model = SentenceTransformerEmbeddings(model_name=model_name)
         self.embedding_model = embedding_model
 
-    def _get_pdf_text(self, pdf_path: str) -> str:
-        """
-        Extracts text from a PDF document.
-
-        Parameters:
-        pdf_path (str): Path to the PDF document.
-
-        Returns:
-        str: Extracted text.
-        """
-        text = ""
-        pdf_reader = PdfReader(pdf_path)
-        for page in pdf_reader.pages:
-            page_text = page.extract_text()
-            if page_text:
-                text += page_text
-        return text
-
     def _split_text(self, text: str) -> List[str]:
         """
         Splits the input text into chunks using RecursiveCharacterTextSplitter.
@@ -45,9 +26,7 @@ class RAGSystem:
         Returns:
         List[str]: A list of text chunks.
         """
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=500, chunk_overlap=100
-        )
+        text_splitter = get_text_splitter()
         chunks = text_splitter.split_text(text)
         return chunks
 
@@ -59,19 +38,12 @@ class RAGSystem:
         pdf_path (str): Path to the single PDF file.
         output_folder_path (str): Path to the output folder where the FAISS vector database will be saved.
         """
-        # Extract text from the PDF
-        text = self._get_pdf_text(pdf_path)
-        if not text:
+        # Stream the pages through the splitter and embed the chunks (with page provenance) in batches
+        documents = iter_pdf_chunks(pdf_path)
+        faiss_db = build_faiss_from_documents(documents, self.embedding_model)
+        if faiss_db is None:
             raise ValueError(f"No text could be extracted from the PDF: {pdf_path}")
 
-        # Split the text into chunks
-        chunks = self._split_text(text)
-        if not chunks:
-            raise ValueError(f"No text chunks were created from the PDF: {pdf_path}")
-
-        # Create a new FAISS vectorstore from the chunks
-        faiss_db = FAISS.from_texts(texts=chunks, embedding=self.embedding_model)
-
         # Ensure the output directory exists
         os.makedirs(output_folder_path, exist_ok=True)
 
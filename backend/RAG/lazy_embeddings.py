@@ -0,0 +1,38 @@
+# General packages
+import threading
+from typing import List
+
+# RAG packages
+from langchain.embeddings.base import Embeddings
+from langchain.embeddings import SentenceTransformerEmbeddings
+
+
+class LazySentenceTransformerEmbeddings(Embeddings):
+    def __init__(self, model_name: str):
+        """
+        SentenceTransformerEmbeddings that are only loaded with the first embedding request.
+
+        Parameters:
+        model_name (str): The name of the embedding model to use.
+        """
+        self.model_name = model_name
+        self._embedding_model = None
+        self._lock = threading.Lock()
+
+    def _get_embedding_model(self) -> SentenceTransformerEmbeddings:
+        if self._embedding_model is None:
+            with self._lock:
+                if self._embedding_model is None:
+                    print(f"Loading embedding model: {self.model_name}")
+                    self._embedding_model = SentenceTransformerEmbeddings(model_name=self.model_name)
+        return self._embedding_model
+
+    def warm_up(self):
+        """Loads the model (blocking), e.g. in an executor at startup instead of with the first request."""
+        self._get_embedding_model()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._get_embedding_model().embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._get_embedding_model().embed_query(text)
@@ -0,0 +1,109 @@
+# General packages
+from itertools import islice
+from typing import Iterator, List, Tuple
+
+# RAG packages
+from PyPDF2 import PdfReader
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain.vectorstores import FAISS
+from langchain.schema import Document
+
+
+def get_text_splitter() -> RecursiveCharacterTextSplitter:
+    """The splitter used for all reference and learning plan chunks."""
+    return RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=100)
+
+
+def iter_pdf_pages(pdf_path: str) -> Iterator[Tuple[int, str]]:
+    """
+    Lazily extracts the text of a PDF document, page by page.
+
+    Parameters:
+    pdf_path (str): Path to the PDF document.
+
+    Returns:
+    Iterator[Tuple[int, str]]: The page number (starting at 1) and the text of every page that contains text.
+    """
+    pdf_reader = PdfReader(pdf_path)
+    for page_number, page in enumerate(pdf_reader.pages, start=1):
+        page_text = page.extract_text()
+        if page_text:
+            yield page_number, page_text
+
+
+def iter_pdf_chunks(pdf_path: str, text_splitter: RecursiveCharacterTextSplitter = None) -> Iterator[Document]:
+    """
+    Streams the pages of a PDF document through the text splitter and yields the chunks as documents.
+
+    Only the unfinished last chunk of a page is carried over to the next page, so chunks may still
+    span page boundaries while the memory stays bounded by about one page, however large the PDF is.
+    Every chunk records its provenance in the metadata: 'source', 'page' (first page) and 'end_page'.
+
+    Parameters:
+    pdf_path (str): Path to the PDF document.
+    text_splitter (RecursiveCharacterTextSplitter): Splitter to use, default is `get_text_splitter()`.
+    """
+    text_splitter = text_splitter or get_text_splitter()
+    buffer = ""
+    page_offsets = []  # (offset in buffer, page number) of the pages in the buffer
+
+    def page_at(offset):
+        page_number = page_offsets[0][1]
+        for page_offset, number in page_offsets:
+            if page_offset > offset:
+                break
+            page_number = number
+        return page_number
+
+    def to_documents(chunks):
+        documents = []
+        search_from = 0
+        for chunk in chunks:
+            start = max(0, buffer.find(chunk, search_from))
+            documents.append(Document(page_content=chunk, metadata={
+                'source': pdf_path,
+                'page': page_at(start),
+                'end_page': page_at(start + len(chunk) - 1)
+            }))
+            search_from = start + 1
+        return documents, search_from
+
+    for page_number, page_text in iter_pdf_pages(pdf_path):
+        page_offsets.append((len(buffer), page_number))
+        buffer += page_text
+        chunks = text_splitter.split_text(buffer)
+        if len(chunks) < 2:
+            continue
+
+        # all chunks but the last one are complete, the last one may continue on the next page
+        documents, search_from = to_documents(chunks[:-1])
+        yield from documents
+
+        carry_start = max(0, buffer.find(chunks[-1], search_from))
+        carry_page = page_at(carry_start)
+        buffer = buffer[carry_start:]
+        page_offsets = [(max(0, offset - carry_start), number) for offset, number in page_offsets
+                        if number >= carry_page]
+
+    if buffer:
+        documents, _ = to_documents(text_splitter.split_text(buffer))
+        yield from documents
+
+
+def build_faiss_from_documents(documents: Iterator[Document], embedding_model, vectorstore: FAISS = None,
+                               batch_size: int = 64) -> FAISS:
+    """
+    Embeds the streamed documents in batches and adds them to the vectorstore (a new one is created if None).
+
+    Returns:
+    FAISS: The vectorstore, or None if no document was given and no vectorstore existed.
+    """
+    documents = iter(documents)
+    while True:
+        batch: List[Document] = list(islice(documents, batch_size))
+        if not batch:
+            return vectorstore
+        if vectorstore is None:
+            vectorstore = FAISS.from_documents(batch, embedding_model)
+        else:
+            vectorstore.add_documents(batch)
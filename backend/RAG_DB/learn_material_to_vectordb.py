@@ -1,12 +1,14 @@
 # General packages
 import os
-from typing import List
+import sys
 
 # PDF processing and FAISS integration
-from PyPDF2 import PdfReader
 from langchain.embeddings import SentenceTransformerEmbeddings
 from langchain.vectorstores import FAISS
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+# Add the backend directory to sys.path, so the shared PDF text extraction is found when running this script directly
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from RAG.pdf_text_stream import iter_pdf_chunks, build_faiss_from_documents
 
 class PDFVectorStore:
     def __init__(self, embedding_model, embeddings_path: str = None):
@@ -30,35 +32,6 @@ class PDFVectorStore:
             # Initialize empty vectorstore
             self.vectorstore = None  # Will be created when adding documents
 
-    def _get_pdf_text(self, pdf_path: str) -> str:
-        """
-        Extracts text from a PDF document.
-
-        Parameters:
-        pdf_path (str): Path to the PDF document.
-
-        Returns:
-        str: Extracted text.
-        """
-        text = ""
-        pdf_reader = PdfReader(pdf_path)
-        for page in pdf_reader.pages:
-            text += page.extract_text() if page.extract_text() else ""
-        return text
-
-    def _split_text(self, text: str) -> List[str]:
-        """
-        Splits the input text into chunks using RecursiveCharacterTextSplitter.
-
-        Returns:
-        List[str]: A list of text chunks.
-        """
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=500, chunk_overlap=100
-        )
-        chunks = text_splitter.split_text(text)
-        return chunks
-
     def add_pdf_folder_to_vectorstore(self, folder_path: str):
         """
         Adds all PDFs in a folder to the vectorstore.
@@ -78,19 +51,12 @@ class PDFVectorStore:
         Parameters:
         pdf_path (str): Path to the PDF document.
         """
-        # Extract text from PDF
-        text = self._get_pdf_text(pdf_path)
-        # Split text into chunks
-        chunks = self._split_text(text)
-        # Embed chunks
+        # Stream the pages through the splitter, the chunks keep their page in the metadata
+        documents = iter_pdf_chunks(pdf_path)
+        # Embed the chunks in batches, a new vectorstore is created for the first batch if necessary
+        self.vectorstore = build_faiss_from_documents(documents, self.embedding_model, vectorstore=self.vectorstore)
         if self.vectorstore is None:
-            # Create a new vectorstore
-            self.vectorstore = FAISS.from_texts(
-                texts=chunks, embedding=self.embedding_model
-            )
-        else:
-            # Add new documents to existing vectorstore
-            self.vectorstore.add_texts(chunks)
+            return
         # Save vectorstore
         if self.embeddings_path:
             self.vectorstore.save_local(self.embeddings_path)
@@ -0,0 +1,122 @@
+"""
+Conversation memory for the /simplify/ prompts.
+The last turns are kept verbatim within a token budget, older turns are folded into a rolling summary,
+which is generated in the background, so it never delays the answer of the current question.
+"""
+import asyncio
+import os
+
+from prompt_templates import PromptTemplate, SlotPolicy, TRUNCATE
+from token_counting import count_tokens
+
+# Maximum number of previous turns (user message + assistant answer) that are kept verbatim
+HISTORY_MAX_TURNS = int(os.environ.get('HISTORY_MAX_TURNS', 4))
+# Maximum number of ALLaM tokens of the verbatim turns
+HISTORY_TOKEN_BUDGET = int(os.environ.get('HISTORY_TOKEN_BUDGET', 1024))
+# Maximum length of the rolling summary
+SUMMARY_MAX_NEW_TOKENS = 256
+
+
+def format_chat_message(message):
+    """One message in ALLaM's chat format, user messages are instructions, assistant messages are answers."""
+    if message['role'] == 'user':
+        return f"<s> [INST] {message['content']} [/INST]"
+    return f" {message['content']} </s>"
+
+
+def format_chat_history(messages):
+    return ''.join(format_chat_message(message) for message in messages)
+
+
+# on overflow, the oldest part of the new turns is cut first
+SUMMARY_TEMPLATE = PromptTemplate('conversation_summary', """<s> [INST] You are summarizing a conversation between a student and an AI-powered teacher.
+Write a short summary in Arabic (at most 5 sentences) that keeps the topics, the questions of the student and the key points of the explanations.
+Summary of the earlier conversation:
+<<SUMMARY>>
+New part of the conversation:
+<<CONVERSATION>>
+Now, write the updated summary of the whole conversation. [/INST]""", slot_policies={
+    'CONVERSATION': SlotPolicy(TRUNCATE, keep='end'),
+    'SUMMARY': SlotPolicy(TRUNCATE),
+}, max_new_tokens=SUMMARY_MAX_NEW_TOKENS)
+
+
+def build_summary_prompt(summary, messages):
+    conversation = '\n'.join(f"{message['role']}: {message['content']}" for message in messages)
+    return SUMMARY_TEMPLATE.render(SUMMARY=summary or '-', CONVERSATION=conversation)
+
+
+class ConversationMemory:
+    def __init__(self, summarize, max_turns=HISTORY_MAX_TURNS, token_budget=HISTORY_TOKEN_BUDGET):
+        """
+        Parameters:
+        summarize: Async function `summarize(prompt) -> str`, e.g. an ALLaM call.
+        max_turns (int): Maximum number of previous turns kept verbatim.
+        token_budget (int): Maximum number of tokens of the verbatim turns.
+        """
+        self.summarize = summarize
+        self.max_turns = max_turns
+        self.token_budget = token_budget
+        self.summary = ''
+        self.summarized_count = 0  # number of history messages covered by the summary
+        self._summary_task = None
+        # incremented with every reset, a summary of an earlier conversation is discarded
+        self._generation = 0
+
+    def reset(self):
+        """Forgets the conversation, e.g. after a new upload; a running summary of it is cancelled."""
+        if self._summary_task is not None and not self._summary_task.done():
+            self._summary_task.cancel()
+        self._generation += 1
+        self.summary = ''
+        self.summarized_count = 0
+        self._summary_task = None
+
+    def _window_start(self, messages):
+        """Index of the first message that is kept verbatim."""
+        start = len(messages)
+        used_tokens = 0
+        while start > 0 and len(messages) - start < 2 * self.max_turns:
+            message_tokens = count_tokens(format_chat_message(messages[start - 1]))
+            if used_tokens + message_tokens > self.token_budget:
+                break
+            used_tokens += message_tokens
+            start -= 1
+        # never start the window with an answer whose question was dropped
+        if start < len(messages) and messages[start]['role'] == 'assistant':
+            start += 1
+        return start
+
+    async def _update_summary(self, messages, start, end, generation):
+        prompt = build_summary_prompt(self.summary, messages[start:end])
+        try:
+            summary = await self.summarize(prompt)
+        except Exception as e:
+            print(f"Conversation summary failed: {e}")
+            return
+        # the memory could have been reset meanwhile
+        if self._generation == generation and self.summarized_count == start:
+            self.summary = summary.strip()
+            self.summarized_count = end
+
+    def build_history(self, messages):
+        """
+        Returns the previous conversation (all messages before the current question) for the prompt:
+        the rolling summary followed by the last turns in ALLaM's chat format.
+        If turns fell out of the window, a background task folds them into the summary for the next requests.
+        """
+        if len(messages) < self.summarized_count:
+            # the client started a new conversation
+            self.reset()
+
+        window_start = self._window_start(messages)
+        summary_is_running = self._summary_task is not None and not self._summary_task.done()
+        if self.summarized_count < window_start and not summary_is_running:
+            self._summary_task = asyncio.create_task(
+                self._update_summary(list(messages), self.summarized_count, window_start, self._generation)
+            )
+
+        history = format_chat_history(messages[window_start:])
+        if self.summary:
+            history = f"<s> [INST] Summary of the earlier conversation: {self.summary} [/INST] </s>{history}"
+        return history
@@ -0,0 +1,103 @@
+import math
+import os
+import re
+import sys
+from collections import Counter
+
+# Add the backend directory to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from token_counting import count_tokens
+
+# Token budget of the document sample in the classifier prompt
+CLASSIFIER_TOKEN_BUDGET = int(os.environ.get('CLASSIFIER_TOKEN_BUDGET', 1024))
+
+_heading_pattern = re.compile(r'^\s{0,3}#{1,6}\s+\S')
+_sentence_pattern = re.compile(r'[^.!?؟\n]+[.!?؟]?')
+_word_pattern = re.compile(r'\w+')
+
+
+def split_sections(text):
+    """Splits markdown into sections: (heading or None, list of paragraphs)."""
+    sections = []
+    heading, paragraphs, lines = None, [], []
+
+    def close_paragraph():
+        if lines:
+            paragraphs.append('\n'.join(lines).strip())
+            lines.clear()
+
+    for line in text.splitlines():
+        if _heading_pattern.match(line):
+            close_paragraph()
+            if heading is not None or paragraphs:
+                sections.append((heading, paragraphs))
+            heading, paragraphs = line.strip(), []
+        elif not line.strip():
+            close_paragraph()
+        else:
+            lines.append(line)
+    close_paragraph()
+    if heading is not None or paragraphs:
+        sections.append((heading, paragraphs))
+    return sections
+
+
+def rank_sentences_by_tfidf(sentences):
+    """Returns the sentence indices, most salient first (mean TF-IDF of the sentence's words)."""
+    sentence_words = [_word_pattern.findall(sentence.lower()) for sentence in sentences]
+    document_frequency = Counter(word for words in sentence_words for word in set(words))
+    sentence_count = len(sentences)
+
+    def score(words):
+        if not words:
+            return 0.0
+        term_frequency = Counter(words)
+        return sum(count * math.log(sentence_count / document_frequency[word])
+                   for word, count in term_frequency.items()) / len(words)
+
+    scores = [score(words) for words in sentence_words]
+    return sorted(range(sentence_count), key=lambda i: scores[i], reverse=True)
+
+
+def sample_document(text, token_budget=CLASSIFIER_TOKEN_BUDGET):
+    """
+    Picks representative passages of the document that fit into `token_budget` ALLaM tokens:
+    first the headings, then the first paragraph of every section, then the most salient sentences (TF-IDF).
+    The passages are returned in document order, so the sample reads like a short version of the document.
+    Documents that already fit into the budget are returned unchanged.
+    """
+    if count_tokens(text) <= token_budget:
+        return text
+
+    # candidates in priority order, the position keeps the document order in the sample
+    headings = []
+    first_paragraphs = []
+    sentences = []
+    for section_index, (heading, paragraphs) in enumerate(split_sections(text)):
+        if heading:
+            headings.append(((section_index, 0, 0), heading))
+        if paragraphs:
+            first_paragraphs.append(((section_index, 1, 0), paragraphs[0]))
+        # sentences of all paragraphs, also of first paragraphs that are too long to be taken as a whole
+        for paragraph_index, paragraph in enumerate(paragraphs, start=1):
+            for sentence_index, sentence in enumerate(_sentence_pattern.findall(paragraph), start=1):
+                if sentence.strip():
+                    sentences.append(((section_index, paragraph_index, sentence_index), sentence.strip()))
+
+    salient_sentences = [sentences[i] for i in rank_sentences_by_tfidf([sentence for _, sentence in sentences])]
+
+    selected = []
+    selected_paragraphs = set()
+    used_tokens = 0
+    for position, passage in headings + first_paragraphs + salient_sentences:
+        if position[:2] in selected_paragraphs:
+            continue  # the whole paragraph is already in the sample
+        passage_tokens = count_tokens(passage) + 1  # + separator
+        if used_tokens + passage_tokens > token_budget:
+            continue
+        selected.append((position, passage))
+        used_tokens += passage_tokens
+        if position[1] > 0 and position[2] == 0:
+            selected_paragraphs.add(position[:2])
+
+    return '\n'.join(passage for _, passage in sorted(selected))
@@ -18,8 +18,10 @@ def extract_inputs_between_input_output(example_text):
     return [match.strip() for match in matches]
 
 
-# Function to build the classifier system prompt, taking 2 random examples from the list of examples
-def build_classifier_system_prompt(all_prompts_dict):
+# Function to build the classifier system prompt, taking 1 random example per topic from the list of examples,
+# `rng` (e.g. a seeded random.Random) makes the choice reproducible
+def build_classifier_system_prompt(all_prompts_dict, rng=None):
+    rng = rng or random
     # Start with the fixed instruction portion
     classifier_system_prompt = """
     <s>[INST] You are an AI-powered text classifier, your task is to classify the given text into only ONE of the following topics: 
@@ -41,7 +43,7 @@ def build_classifier_system_prompt(all_prompts_dict):
     for topic, definition_instructions_examples_prompt in all_prompts_dict.items():
         examples = extract_inputs_between_input_output(definition_instructions_examples_prompt[2])
         # Select 1 example
-        selected_example = random.choice(examples)
+        selected_example = rng.choice(examples)
 
         # Add the input portion, and then classify to the corresponding topic
         classifier_system_prompt += f"<<Example{example_count}>>:\n{selected_example.strip()}\nOutput: {topic}\n\n"
@@ -0,0 +1,155 @@
+import json
+import os
+import sys
+import threading
+
+import faiss
+import numpy as np
+
+# Add the directory to sys.path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from dynamic_classifier_prompt_builder import extract_inputs_between_input_output
+
+# multilingual-e5 is trained with prefixes: the classified document is the query, the topic sources are passages
+QUERY_PREFIX = 'query: '
+PASSAGE_PREFIX = 'passage: '
+
+# Thresholds chosen by `python testing/topic_classifier_benchmark.py --calibrate` on the topic examples and
+# off-topic documents, they depend on the embedding model and on the topics
+THRESHOLDS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'topic_classifier_thresholds.json')
+
+
+def load_thresholds(path=THRESHOLDS_PATH):
+    """The calibrated thresholds, the uncalibrated defaults as long as no calibration was recorded."""
+    thresholds = {'min_similarity': 0.75, 'min_confidence_margin': 0.02}
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            thresholds.update(json.load(f))
+    return thresholds
+
+
+_thresholds = load_thresholds()
+# A topic is only accepted if it is at least this much more similar than the second best topic
+MIN_CONFIDENCE_MARGIN = float(os.environ.get('TOPIC_CLASSIFIER_MIN_MARGIN', _thresholds['min_confidence_margin']))
+# Below this similarity, the document does not belong to any topic (General_Paraphrasing is decided by the LLM)
+MIN_SIMILARITY = float(os.environ.get('TOPIC_CLASSIFIER_MIN_SIMILARITY', _thresholds['min_similarity']))
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def embed_passages(embedding_model, texts):
+    """Embeds the sources of a topic (definition, examples)."""
+    return embedding_model.embed_documents([PASSAGE_PREFIX + text for text in texts])
+
+
+def embed_document(embedding_model, passages):
+    """Embeds the sampled passages of a classified document into one normalized vector."""
+    vectors = embedding_model.embed_documents([QUERY_PREFIX + passage for passage in passages])
+    return _normalize(_normalize(vectors).mean(axis=0))
+
+
+def build_topic_centroid(definition_vectors, example_vectors, reference_vectors):
+    """
+    Builds the centroid of a topic, each source (definition, examples, references) has the same weight,
+    no matter how many examples or reference chunks the topic has.
+    """
+    source_means = [_normalize(vectors).mean(axis=0)
+                    for vectors in (definition_vectors, example_vectors, reference_vectors) if len(vectors) > 0]
+    return _normalize(np.mean(source_means, axis=0))
+
+
+def load_reference_vectors(topic_folder):
+    """
+    Reads the already computed chunk vectors of the topic's References-VS, nothing is embedded again
+    (the RAG index stores them without passage prefix).
+    """
+    references_vs_dir = os.path.join(topic_folder, 'References-VS')
+    if not os.path.exists(os.path.join(references_vs_dir, 'index.faiss')):
+        return np.zeros((0, 0), dtype=np.float32)
+    index = faiss.read_index(os.path.join(references_vs_dir, 'index.faiss'))
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def sample_passages(text, max_passages=8, passage_length=500):
+    """Takes up to `max_passages` evenly spaced passages, so the classification cost does not depend on the document length."""
+    passages = [text[start:start + passage_length] for start in range(0, len(text), passage_length)]
+    passages = [passage for passage in passages if passage.strip()]
+    if len(passages) <= max_passages:
+        return passages
+    step = len(passages) / max_passages
+    return [passages[int(i * step)] for i in range(max_passages)]
+
+
+class EmbeddingTopicClassifier:
+    def __init__(self, embedding_model, topic_registry):
+        """
+        Classifies documents into the topics of the registry by embedding similarity to per-topic centroids.
+        The centroids are built from each topic's Definition.txt, the inputs of Examples.txt and the
+        reference chunks, with the first classification after creation or `invalidate()`.
+
+        Parameters:
+        embedding_model: The (shared) embedding model, e.g. multilingual-e5-large.
+        topic_registry (TopicRegistry): The registry of the topics.
+        """
+        self.embedding_model = embedding_model
+        self.topic_registry = topic_registry
+        self._centroids = None  # (topic names, centroid matrix)
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        """Forget the centroids, called by the topic registry after the topics changed."""
+        self._centroids = None
+
+    def _build_centroids(self):
+        topic_names = []
+        centroids = []
+        for topic, definition_instructions_examples_prompt in self.topic_registry.get_all_system_prompts().items():
+            definition = definition_instructions_examples_prompt[0]
+            examples = extract_inputs_between_input_output(definition_instructions_examples_prompt[2])
+            definition_vectors = embed_passages(self.embedding_model, [definition])
+            example_vectors = embed_passages(self.embedding_model, examples) if examples else []
+            reference_vectors = load_reference_vectors(os.path.join(self.topic_registry.base_folder, topic))
+            topic_names.append(topic)
+            centroids.append(build_topic_centroid(definition_vectors, example_vectors, reference_vectors))
+        return topic_names, np.stack(centroids) if centroids else np.zeros((0, 0), dtype=np.float32)
+
+    def get_centroids(self):
+        if self._centroids is None:
+            with self._lock:
+                if self._centroids is None:
+                    self._centroids = self._build_centroids()
+        return self._centroids
+
+    def score(self, text):
+        """
+        Returns the cosine similarity of the sampled document to every topic, best topic first.
+
+        Returns:
+        List[Tuple[str, float]]: (topic, similarity) pairs.
+        """
+        topic_names, centroids = self.get_centroids()
+        passages = sample_passages(text)
+        if not topic_names or not passages:
+            return []
+        document_vector = embed_document(self.embedding_model, passages)
+        similarities = centroids @ document_vector
+        return sorted(zip(topic_names, similarities.tolist()), key=lambda x: x[1], reverse=True)
+
+    def classify(self, text):
+        """
+        Returns:
+        Tuple[str, List[Tuple[str, float]]]: The topic, or None if the classifier is not confident enough
+        (the caller falls back to the LLM classifier), and the scores of all topics.
+        """
+        scores = self.score(text)
+        if not scores:
+            return None, scores
+        best_topic, best_similarity = scores[0]
+        margin = best_similarity - scores[1][1] if len(scores) > 1 else best_similarity
+        if best_similarity < MIN_SIMILARITY or margin < MIN_CONFIDENCE_MARGIN:
+            return None, scores
+        return best_topic, scores
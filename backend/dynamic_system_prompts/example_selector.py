@@ -0,0 +1,93 @@
+import os
+import sys
+import threading
+
+import numpy as np
+
+# Add the directory and the backend directory to sys.path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from dynamic_classifier_prompt_builder import extract_inputs_between_input_output
+from embedding_topic_classifier import _normalize, embed_document, embed_passages
+from token_counting import count_tokens
+
+# Set to 0 to always send all examples (the full prompt baseline)
+FEW_SHOT_SELECTION = os.environ.get('FEW_SHOT_SELECTION', '1') == '1'
+# Maximum number of examples per prompt
+FEW_SHOT_TOP_N = int(os.environ.get('FEW_SHOT_TOP_N', 2))
+# Maximum number of ALLaM tokens of the selected examples
+FEW_SHOT_TOKEN_BUDGET = int(os.environ.get('FEW_SHOT_TOKEN_BUDGET', 1024))
+
+
+def get_example_input(example):
+    """The input part of an example of Examples.txt, which is compared to the user input."""
+    inputs = extract_inputs_between_input_output(example)
+    return inputs[0] if inputs else example
+
+
+class ExampleSelector:
+    def __init__(self, embedding_model, get_examples, get_example_input=get_example_input,
+                 top_n=FEW_SHOT_TOP_N, token_budget=FEW_SHOT_TOKEN_BUDGET, enabled=FEW_SHOT_SELECTION):
+        """
+        Selects the few-shot examples of a prompt that are most similar to the user input.
+        The examples of a key (e.g. a topic) are embedded once, with the first selection after creation or `invalidate()`.
+
+        Parameters:
+        embedding_model: The (shared) embedding model, e.g. multilingual-e5-large.
+        get_examples: Function `get_examples(key) -> List[str]`, e.g. TopicRegistry.get_examples.
+        get_example_input: Function returning the part of an example that is embedded.
+        top_n (int): Maximum number of selected examples.
+        token_budget (int): Maximum number of tokens of the selected examples.
+        enabled (bool): If False, all examples are returned (baseline).
+        """
+        self.embedding_model = embedding_model
+        self.get_examples = get_examples
+        self.get_example_input = get_example_input
+        self.top_n = top_n
+        self.token_budget = token_budget
+        self.enabled = enabled
+        self._example_vectors = {}  # key -> (examples, normalized vectors, token counts)
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        """Forget the example vectors, called by the topic registry after the topics changed."""
+        self._example_vectors = {}
+
+    def _get_example_vectors(self, key):
+        example_vectors = self._example_vectors.get(key)
+        if example_vectors is None:
+            with self._lock:
+                example_vectors = self._example_vectors.get(key)
+                if example_vectors is None:
+                    examples = self.get_examples(key)
+                    # with the e5 prefixes, like the topic classifier: the examples are passages, the input the query
+                    vectors = _normalize(embed_passages(self.embedding_model,
+                                                        [self.get_example_input(example) for example in examples]))
+                    example_vectors = (examples, vectors, [count_tokens(example) for example in examples])
+                    self._example_vectors[key] = example_vectors
+        return example_vectors
+
+    def select(self, key, query):
+        """
+        Returns the examples of `key` most similar to `query`, most similar first: at most `top_n` examples
+        within the token budget. At least one example is returned, even if it exceeds the budget.
+        """
+        if not self.enabled:
+            return self.get_examples(key)
+        examples, vectors, example_tokens = self._get_example_vectors(key)
+        if len(examples) <= 1:
+            return list(examples)
+
+        query_vector = embed_document(self.embedding_model, [query])
+        ranking = np.argsort(-(vectors @ query_vector))
+
+        selected = []
+        used_tokens = 0
+        for index in ranking:
+            if len(selected) == self.top_n:
+                break
+            if selected and used_tokens + example_tokens[index] > self.token_budget:
+                continue
+            selected.append(examples[index])
+            used_tokens += example_tokens[index]
+        return selected
@@ -0,0 +1,131 @@
+import asyncio
+import os
+import random
+import re
+import sys
+import threading
+
+# Add the directory to sys.path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from dynamic_system_prompts_builder import build_all_system_prompts
+from dynamic_classifier_prompt_builder import build_classifier_system_prompt
+
+# Reference vectorstore of the General_Paraphrasing "topic", which has no topic folder
+GENERAL_REFERENCE_PATH = "./RAG_DB/General_Reference-VS"
+# Files of a topic folder that invalidate the registry when they change
+WATCHED_TOPIC_FILES = ('Definition.txt', 'Instructions.txt', 'Examples.txt', os.path.join('References-VS', 'index.faiss'))
+
+# Seed of the example choice of the classifier prompt: the same topics always give the same prompt, so
+# classifications of the same content are answered from the response cache and coalesced by single-flight
+CLASSIFIER_PROMPT_SEED = int(os.environ.get('CLASSIFIER_PROMPT_SEED', 0))
+
+# every example of Examples.txt starts with a line "Input..."
+_example_start_pattern = re.compile(r'^(?=Input)', re.MULTILINE)
+
+
+def split_examples(examples):
+    """Splits the content of Examples.txt into its examples, joining them with '' gives the original text."""
+    return [example for example in _example_start_pattern.split(examples) if example]
+
+
+class TopicRegistry:
+    def __init__(self, base_folder='./dynamic_system_prompts'):
+        """
+        In-memory registry of the topics in `base_folder`: prompts, definitions, the topic list and the reference paths.
+
+        The folder is read once and again only after `invalidate()` (e.g. by /add-topic/) or when the polling
+        task notices a changed modification time, so request hot paths never touch the filesystem.
+
+        Parameters:
+        base_folder (str): The folder with one sub folder per topic.
+        """
+        self.base_folder = base_folder
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._polling_task = None
+        self._signature = None
+        self._topic_dict = {}
+        self._ref_knowledge_paths = {}
+        self._examples = {}
+        self._classifier_prompt = None
+        self.invalidate()
+
+    def _get_signature(self):
+        """Modification times of the topic folders and their files, cheap to compute compared to a reload."""
+        signature = [os.stat(self.base_folder).st_mtime_ns]
+        for entry in sorted(os.scandir(self.base_folder), key=lambda e: e.name):
+            if entry.name == '__pycache__' or not entry.is_dir():
+                continue
+            signature.append((entry.name, entry.stat().st_mtime_ns))
+            for file_name in WATCHED_TOPIC_FILES:
+                file_path = os.path.join(entry.path, file_name)
+                signature.append(os.stat(file_path).st_mtime_ns if os.path.exists(file_path) else None)
+        return tuple(signature)
+
+    def invalidate(self):
+        """Reloads all topics from the folder and notifies the listeners (e.g. the topic classifier)."""
+        with self._lock:
+            signature = self._get_signature()
+            topic_dict = build_all_system_prompts(base_folder=self.base_folder)
+            ref_knowledge_paths = {topic: os.path.join(self.base_folder, topic, 'References-VS') for topic in topic_dict}
+            examples = {topic: split_examples(prompts[2]) for topic, prompts in topic_dict.items()}
+            classifier_prompt = build_classifier_system_prompt(topic_dict, rng=random.Random(CLASSIFIER_PROMPT_SEED))
+            # swap the complete snapshot at once, readers never see a half-loaded registry
+            self._topic_dict, self._ref_knowledge_paths, self._examples, self._classifier_prompt, self._signature = \
+                topic_dict, ref_knowledge_paths, examples, classifier_prompt, signature
+        print(f"Topic registry loaded: {list(topic_dict.keys())}")
+        for listener in self._listeners:
+            listener()
+
+    def add_listener(self, listener):
+        """`listener()` is called after every reload."""
+        self._listeners.append(listener)
+
+    async def _poll(self, interval):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if await loop.run_in_executor(None, self._get_signature) != self._signature:
+                    await loop.run_in_executor(None, self.invalidate)
+            except Exception as e:
+                print(f"Topic registry polling failed: {e}")
+
+    def start_polling(self, interval=5.0):
+        """Starts watching the folder for changes made outside of the API (mtime polling)."""
+        if self._polling_task is None:
+            self._polling_task = asyncio.create_task(self._poll(interval))
+
+    def stop_polling(self):
+        if self._polling_task is not None:
+            self._polling_task.cancel()
+            self._polling_task = None
+
+    def get_all_system_prompts(self):
+        """Same format as `build_all_system_prompts`: topic -> [definition, instructions, examples, system prompt]."""
+        return self._topic_dict
+
+    def get_topics(self):
+        return list(self._topic_dict.keys())
+
+    def get_system_prompt(self, topic):
+        return self._topic_dict[topic][3]
+
+    def get_definition(self, topic):
+        return self._topic_dict[topic][0]
+
+    def get_instructions(self, topic):
+        return self._topic_dict[topic][1]
+
+    def get_examples(self, topic):
+        """The examples of the topic as a list, in the order of Examples.txt."""
+        return self._examples[topic]
+
+    def get_classifier_prompt(self):
+        """The dynamic classifier prompt of the loaded topics, the same until the topics change."""
+        return self._classifier_prompt
+
+    def get_ref_knowledge_path(self, topic):
+        if topic == 'General_Paraphrasing':
+            return GENERAL_REFERENCE_PATH
+        return self._ref_knowledge_paths.get(topic)
@@ -0,0 +1,211 @@
+"""
+Shared outbound HTTP layer: pooled keep-alive async clients (httpx) for the external services (OpenAI, watsonx,
+image downloads), so connections and TLS sessions are reused across requests and nothing blocks the event loop.
+Every service has its own client and connection pool (per-host limits); DNS lookups are cached.
+"""
+import asyncio
+import importlib.util
+import ipaddress
+import os
+import socket
+import time
+
+import httpcore
+import httpx
+
+# Set to 0 to disable HTTP/2 (it needs the h2 package, without it the clients use HTTP/1.1)
+HTTP2 = os.environ.get('HTTP2', '1') == '1' and importlib.util.find_spec('h2') is not None
+# Connections per service: open at most, kept alive when idle, and seconds an idle connection is kept
+HTTP_MAX_CONNECTIONS = int(os.environ.get('HTTP_MAX_CONNECTIONS', 32))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get('HTTP_MAX_KEEPALIVE_CONNECTIONS', 16))
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get('HTTP_KEEPALIVE_EXPIRY', 60))
+# Timeouts in seconds; the read timeout is the longest gap between two received chunks (e.g. tokens of a stream)
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 5))
+HTTP_READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', 120))
+HTTP_WRITE_TIMEOUT = float(os.environ.get('HTTP_WRITE_TIMEOUT', 30))
+HTTP_POOL_TIMEOUT = float(os.environ.get('HTTP_POOL_TIMEOUT', 10))
+# Seconds a resolved host name is reused
+DNS_CACHE_TTL = float(os.environ.get('DNS_CACHE_TTL', 300))
+
+
+def _is_ip_address(host):
+    try:
+        ipaddress.ip_address(host)
+        return True
+    except ValueError:
+        return False
+
+
+class CachingDNSBackend(httpcore.AsyncNetworkBackend):
+    def __init__(self, backend=None, ttl=DNS_CACHE_TTL):
+        """
+        Network backend of httpcore that caches the resolved addresses of the host names for `ttl` seconds.
+        The connection is opened to the address, TLS still verifies the host name (SNI).
+
+        Parameters:
+        backend (httpcore.AsyncNetworkBackend): The backend that opens the connections.
+        ttl (float): Seconds a resolved host name is reused.
+        """
+        self.backend = backend or httpcore.AnyIOBackend()
+        self.ttl = ttl
+        self._cache = {}
+
+    async def _resolve(self, host, port):
+        entry = self._cache.get((host, port))
+        if entry is not None and entry[0] > time.monotonic():
+            return entry[1]
+        try:
+            infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        except OSError as e:
+            # like a failed connection of httpcore, so httpx raises its ConnectError
+            raise httpcore.ConnectError(str(e)) from e
+        addresses = list(dict.fromkeys(info[4][0] for info in infos))
+        self._cache[(host, port)] = (time.monotonic() + self.ttl, addresses)
+        return addresses
+
+    async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        if _is_ip_address(host):
+            return await self.backend.connect_tcp(host, port, timeout, local_address, socket_options)
+        error = None
+        for address in await self._resolve(host, port):
+            try:
+                return await self.backend.connect_tcp(address, port, timeout, local_address, socket_options)
+            except (httpcore.ConnectError, httpcore.ConnectTimeout) as e:
+                error = e
+        # the cached addresses may be outdated, the next connection resolves the host again
+        self._cache.pop((host, port), None)
+        raise error or httpcore.ConnectError(f'{host} has no address')
+
+    async def connect_unix_socket(self, path, timeout=None, socket_options=None):
+        return await self.backend.connect_unix_socket(path, timeout, socket_options)
+
+    async def sleep(self, seconds):
+        await self.backend.sleep(seconds)
+
+
+# the errors of httpcore that httpx raises as its own
+_HTTPCORE_ERRORS = (httpcore.TimeoutException, httpcore.NetworkError, httpcore.ProtocolError, httpcore.ProxyError,
+                    httpcore.UnsupportedProtocol)
+
+
+def _to_httpx_error(error, request):
+    """The httpx exception of an httpcore exception (e.g. httpcore.ConnectTimeout -> httpx.ConnectTimeout)."""
+    for error_type in type(error).__mro__:
+        httpx_error_type = getattr(httpx, error_type.__name__, None)
+        if isinstance(httpx_error_type, type) and issubclass(httpx_error_type, httpx.TransportError):
+            return httpx_error_type(str(error), request=request)
+    return httpx.TransportError(str(error), request=request)
+
+
+class _ResponseStream(httpx.AsyncByteStream):
+    def __init__(self, stream, request):
+        self.stream = stream
+        self.request = request
+
+    async def __aiter__(self):
+        try:
+            async for chunk in self.stream:
+                yield chunk
+        except _HTTPCORE_ERRORS as e:
+            raise _to_httpx_error(e, self.request) from e
+
+    async def aclose(self):
+        if hasattr(self.stream, 'aclose'):
+            await self.stream.aclose()
+
+
+class PooledTransport(httpx.AsyncBaseTransport):
+    def __init__(self, network_backend, http2=HTTP2, limits=None, retries=1):
+        """
+        Transport of an async httpx client on an httpcore connection pool with its own network backend (e.g. the
+        DNS cache), which httpx.AsyncHTTPTransport does not take.
+
+        Parameters:
+        network_backend (httpcore.AsyncNetworkBackend): The backend that opens the connections.
+        http2 (bool): Whether HTTP/2 is used where the server supports it.
+        limits (httpx.Limits): Connection limits of the pool.
+        retries (int): Retries of failed connection attempts (not of requests).
+        """
+        limits = limits or httpx.Limits()
+        self._pool = httpcore.AsyncConnectionPool(
+            ssl_context=httpx.create_ssl_context(),
+            max_connections=limits.max_connections,
+            max_keepalive_connections=limits.max_keepalive_connections,
+            keepalive_expiry=limits.keepalive_expiry,
+            http1=True,
+            http2=http2,
+            retries=retries,
+            network_backend=network_backend,
+        )
+
+    async def handle_async_request(self, request):
+        core_request = httpcore.Request(
+            method=request.method,
+            url=httpcore.URL(scheme=request.url.raw_scheme, host=request.url.raw_host, port=request.url.port,
+                             target=request.url.raw_path),
+            headers=request.headers.raw,
+            content=request.stream,
+            extensions=request.extensions,
+        )
+        try:
+            response = await self._pool.handle_async_request(core_request)
+        except _HTTPCORE_ERRORS as e:
+            raise _to_httpx_error(e, request) from e
+        return httpx.Response(status_code=response.status, headers=response.headers,
+                              stream=_ResponseStream(response.stream, request), extensions=response.extensions)
+
+    async def aclose(self):
+        await self._pool.aclose()
+
+
+class OutboundHTTP:
+    def __init__(self, http2=HTTP2, max_connections=HTTP_MAX_CONNECTIONS,
+                 max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS, keepalive_expiry=HTTP_KEEPALIVE_EXPIRY):
+        """
+        The HTTP clients of the outbound services, created with the first use and shared by all requests.
+
+        Parameters:
+        http2 (bool): Whether HTTP/2 is used where the server supports it.
+        max_connections (int): Maximum number of connections per service.
+        max_keepalive_connections (int): Maximum number of idle connections kept alive per service.
+        keepalive_expiry (float): Seconds an idle connection is kept alive.
+        """
+        self.http2 = http2
+        self.limits = httpx.Limits(max_connections=max_connections,
+                                   max_keepalive_connections=max_keepalive_connections,
+                                   keepalive_expiry=keepalive_expiry)
+        self.timeout = httpx.Timeout(connect=HTTP_CONNECT_TIMEOUT, read=HTTP_READ_TIMEOUT,
+                                     write=HTTP_WRITE_TIMEOUT, pool=HTTP_POOL_TIMEOUT)
+        # one DNS cache for all services
+        self._dns_backend = CachingDNSBackend()
+        self._clients = {}
+        self._sync_clients = {}
+
+    def _create_transport(self):
+        # one retry of failed connection attempts (not of requests)
+        return PooledTransport(self._dns_backend, http2=self.http2, limits=self.limits, retries=1)
+
+    def get_client(self, service):
+        """The async client of the service (e.g. 'openai', 'watsonx', 'downloads')."""
+        client = self._clients.get(service)
+        if client is None:
+            client = httpx.AsyncClient(transport=self._create_transport(), timeout=self.timeout,
+                                       follow_redirects=True)
+            self._clients[service] = client
+        return client
+
+    def get_sync_client(self, service):
+        """Blocking client of the service, only for SDKs that also need one (e.g. the watsonx authentication)."""
+        client = self._sync_clients.get(service)
+        if client is None:
+            client = httpx.Client(http2=self.http2, limits=self.limits, timeout=self.timeout, follow_redirects=True)
+            self._sync_clients[service] = client
+        return client
+
+    async def aclose(self):
+        for client in self._clients.values():
+            await client.aclose()
+        for client in self._sync_clients.values():
+            client.close()
+        self._clients.clear()
+        self._sync_clients.clear()
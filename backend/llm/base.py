@@ -0,0 +1,74 @@
+# General packages
+import asyncio
+from typing import AsyncIterator, Callable, Dict, List, Optional, Union
+
+# A prompt is either a complete prompt string (ALLaM) or a list of chat messages {'role': ..., 'content': ...} (OpenAI)
+Prompt = Union[str, List[Dict[str, str]]]
+
+# Maximum number of parallel requests of the default batch implementation
+DEFAULT_BATCH_CONCURRENCY = 4
+
+
+def to_messages(prompt: Prompt) -> List[Dict[str, str]]:
+    """Chat messages of the prompt, a prompt string becomes one user message."""
+    if isinstance(prompt, str):
+        return [{'role': 'user', 'content': prompt}]
+    return prompt
+
+
+def to_prompt_text(prompt: Prompt) -> str:
+    """Prompt string of the prompt, chat messages are joined in order."""
+    if isinstance(prompt, str):
+        return prompt
+    return '\n\n'.join(message['content'] for message in prompt)
+
+
+class LLMClient:
+    """
+    Provider independent, async interface of the language models.
+    The endpoints only use this interface; the backend (watsonx, OpenAI, local mock) is chosen at startup.
+
+    `params` follow the watsonx names ('max_new_tokens', 'stop_sequences', 'temperature', ...),
+    every backend translates the ones it supports. They override the default parameters of the client.
+    The clients of the API are wrapped by a ScheduledLLMClient, whose methods also take the user and the priority.
+    """
+
+    async def generate(self, prompt: Prompt, params: Optional[dict] = None,
+                       is_complete: Optional[Callable[[str], bool]] = None) -> str:
+        """
+        Returns the complete generated text.
+        With `is_complete`, the text is streamed and the generation ends as soon as is_complete(text so far) is True.
+        """
+        raise NotImplementedError
+
+    async def _generate_until_complete(self, prompt: Prompt, params: Optional[dict],
+                                       is_complete: Callable[[str], bool]) -> str:
+        """Streams the text and closes the stream (and the upstream request) once the text is complete."""
+        text = ''
+        stream = self.stream(prompt, params=params)
+        try:
+            async for chunk in stream:
+                text += chunk
+                if is_complete(text):
+                    break
+        finally:
+            await stream.aclose()
+        return text
+
+    def stream(self, prompt: Prompt, params: Optional[dict] = None) -> AsyncIterator[str]:
+        """Returns an async iterator over the generated text chunks."""
+        raise NotImplementedError
+
+    async def batch(self, prompts: List[Prompt], params: Optional[dict] = None,
+                    concurrency: int = DEFAULT_BATCH_CONCURRENCY) -> List[str]:
+        """Generates the texts of all prompts, in the order of the prompts."""
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def generate_one(prompt):
+            async with semaphore:
+                return await self.generate(prompt, params=params)
+
+        return list(await asyncio.gather(*(generate_one(prompt) for prompt in prompts)))
+
+    async def close(self):
+        """Releases the connections of the client."""
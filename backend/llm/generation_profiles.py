@@ -0,0 +1,114 @@
+# General packages
+import re
+from dataclasses import dataclass, field, replace
+from typing import Callable, List, Optional
+
+# Metrics
+from metrics import metrics
+
+# ALLaM starts a new turn or a new few-shot example after its answer, the answer is complete there
+CHAT_STOP_SEQUENCES = ['[INST]', '<s>', '</s>']
+EXAMPLE_STOP_SEQUENCES = CHAT_STOP_SEQUENCES + ['\nInput']
+
+# the free-text quiz ends with the answer paragraph ("الاجابة الصحيحة: ...")
+_free_text_answer_pattern = re.compile(r'ال[اإ]جابة الصحيحة\s*:[^\n]*\S[^\n]*\n\s*\n')
+# the evaluation ends with its result line ("النتيجة: ...")
+_evaluation_result_pattern = re.compile(r'^\s*النتيجة\s*:[^\n]*\S[^\n]*\n', re.MULTILINE)
+
+
+def is_free_text_quiz_complete(text):
+    """The question and its answer are written."""
+    return _free_text_answer_pattern.search(text) is not None
+
+
+def is_evaluation_complete(text):
+    """The score and its explanation up to the result line are written."""
+    return _evaluation_result_pattern.search(text) is not None
+
+
+def get_topic_label_validator(labels):
+    """
+    Validator of the classification: the output is one of the topic labels.
+    A label that is the beginning of another label is only complete when the other one is ruled out.
+    """
+    labels = set(labels)
+
+    def is_complete(text):
+        label = text.replace('.', '').strip()
+        if label not in labels:
+            return False
+        return not any(other != label and other.startswith(label) for other in labels)
+
+    return is_complete
+
+
+@dataclass
+class GenerationProfile:
+    """
+    Generation parameters of one task: the token limit, the stop sequences and optionally a validator that ends
+    the generation as soon as the output is complete (LLMClient.generate(..., is_complete=...)).
+
+    The request policy of the task (ResilientLLMClient, `profile=...`): the seconds until the text (generate)
+    or its first token (stream) has to be there before the request is retried, and whether a slow request
+    is hedged by a second one.
+    """
+    name: str
+    max_new_tokens: int
+    stop_sequences: List[str] = field(default_factory=list)
+    validator: Optional[Callable[[str], bool]] = None
+    timeout: Optional[float] = None
+    hedge: bool = False
+
+    @property
+    def params(self):
+        """Generation parameters (watsonx names), they override the default parameters of the client."""
+        params = {'max_new_tokens': self.max_new_tokens}
+        if self.stop_sequences:
+            params['stop_sequences'] = self.stop_sequences
+            params['include_stop_sequence'] = False
+        return params
+
+    def get_validator(self, validator=None):
+        """
+        The is_complete callable of a generation with this profile (`validator` replaces the validator of the
+        profile, e.g. the topic labels of the classification), None without validator. Early stops are counted.
+        """
+        validator = validator or self.validator
+        if validator is None:
+            return None
+
+        def is_complete(text):
+            if validator(text):
+                metrics.increment(f'generation_profile.{self.name}.early_stops')
+                return True
+            return False
+
+        return is_complete
+
+    def for_batch(self, count, stop_sequence=None):
+        """
+        The profile of `count` generations of this task in one call (e.g. several quiz questions): the token limit
+        and the timeout grow with the count, `stop_sequence` ends the batch (the validator is for single outputs).
+        """
+        stop_sequences = self.stop_sequences + ([stop_sequence] if stop_sequence else [])
+        return replace(self, name=f'{self.name}_batch', max_new_tokens=self.max_new_tokens * count,
+                       stop_sequences=stop_sequences, validator=None, timeout=self.timeout and self.timeout * count)
+
+
+# one label, ends when a known label is written (the labels are given at the call)
+CLASSIFICATION_PROFILE = GenerationProfile('classification', max_new_tokens=24, stop_sequences=EXAMPLE_STOP_SEQUENCES,
+                                           timeout=20, hedge=True)
+# one question with 3-4 answers, generated in the background
+MULTIPLE_CHOICE_QUIZ_PROFILE = GenerationProfile('quiz_multiple_choice', max_new_tokens=384,
+                                                 stop_sequences=EXAMPLE_STOP_SEQUENCES, timeout=60)
+# one question and its answer, generated in the background
+FREE_TEXT_QUIZ_PROFILE = GenerationProfile('quiz_free_text', max_new_tokens=384, stop_sequences=EXAMPLE_STOP_SEQUENCES,
+                                           validator=is_free_text_quiz_complete, timeout=60)
+# the score and its explanation, the student waits for it
+EVALUATION_PROFILE = GenerationProfile('evaluation', max_new_tokens=512, stop_sequences=EXAMPLE_STOP_SEQUENCES,
+                                       validator=is_evaluation_complete, timeout=45, hedge=True)
+# streamed answers of the chats, the timeouts are the time to the first token
+SIMPLIFY_PROFILE = GenerationProfile('simplify', max_new_tokens=1024, stop_sequences=CHAT_STOP_SEQUENCES,
+                                     timeout=20, hedge=True)
+HELP_CHAT_PROFILE = GenerationProfile('help_chat', max_new_tokens=768, stop_sequences=CHAT_STOP_SEQUENCES,
+                                      timeout=20, hedge=True)
@@ -0,0 +1,101 @@
+# General packages
+import asyncio
+import hashlib
+import os
+import random
+from typing import AsyncIterator, Callable, Optional
+
+# LLM client interface
+from llm.base import LLMClient, Prompt, to_prompt_text
+
+# Simulated latency of the mock: time to the first token and time per following token (seconds)
+MOCK_LLM_TTFT = float(os.environ.get('MOCK_LLM_TTFT', 0.3))
+MOCK_LLM_TOKEN_DELAY = float(os.environ.get('MOCK_LLM_TOKEN_DELAY', 0.02))
+# Number of generated tokens (words), limited by max_new_tokens
+MOCK_LLM_OUTPUT_TOKENS = int(os.environ.get('MOCK_LLM_OUTPUT_TOKENS', 120))
+# Number of requests the simulated server processes at the same time, further requests wait
+MOCK_LLM_CONCURRENCY = int(os.environ.get('MOCK_LLM_CONCURRENCY', 8))
+# Latency tail: share of the requests whose time to the first token is TAIL_FACTOR times longer
+MOCK_LLM_TAIL_PROBABILITY = float(os.environ.get('MOCK_LLM_TAIL_PROBABILITY', 0.0))
+MOCK_LLM_TAIL_FACTOR = float(os.environ.get('MOCK_LLM_TAIL_FACTOR', 10.0))
+# Share of the requests that fail (connection error) instead of the first token
+MOCK_LLM_FAILURE_RATE = float(os.environ.get('MOCK_LLM_FAILURE_RATE', 0.0))
+
+_vocabulary = ('الطالب', 'المعلم', 'الدرس', 'مثال', 'فكرة', 'سؤال', 'الإجابة', 'الشمس', 'الأرض', 'الماء',
+               'يتعلم', 'يشرح', 'بسيط', 'مهم', 'جديد', 'كل', 'في', 'من', 'على', 'عن', 'هذا', 'لأن')
+
+
+class MockLLMClient(LLMClient):
+    def __init__(self, ttft=MOCK_LLM_TTFT, token_delay=MOCK_LLM_TOKEN_DELAY, output_tokens=MOCK_LLM_OUTPUT_TOKENS,
+                 concurrency=MOCK_LLM_CONCURRENCY, section_separator=None, section_tokens=60,
+                 tail_probability=MOCK_LLM_TAIL_PROBABILITY, tail_factor=MOCK_LLM_TAIL_FACTOR,
+                 failure_rate=MOCK_LLM_FAILURE_RATE, seed=None):
+        """
+        Local, deterministic LLM for offline development and load tests.
+
+        The same prompt always gives the same text (words drawn with the prompt hash as seed). The latency
+        of a real server is simulated: a request waits for one of `concurrency` slots, then for the first
+        token (`ttft`) and for every following token (`token_delay`). Optionally, some requests are much slower
+        (latency tail) or fail, drawn independently of the prompt.
+
+        Parameters:
+        ttft (float): Seconds to the first token.
+        token_delay (float): Seconds per following token.
+        output_tokens (int): Generated tokens, limited by the parameter max_new_tokens.
+        concurrency (int): Requests processed at the same time.
+        section_separator (str): If set, inserted every `section_tokens` tokens (e.g. the learning plan separator).
+        section_tokens (int): Tokens per section.
+        tail_probability (float): Share of the requests whose time to the first token is `tail_factor` times longer.
+        tail_factor (float): Slowdown of the requests in the latency tail.
+        failure_rate (float): Share of the requests that fail with a ConnectionError.
+        seed (int): Seed of the latency tail and the failures, random by default.
+        """
+        self.ttft = ttft
+        self.token_delay = token_delay
+        self.output_tokens = output_tokens
+        self.section_separator = section_separator
+        self.section_tokens = section_tokens
+        self.tail_probability = tail_probability
+        self.tail_factor = tail_factor
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        self._slots = asyncio.Semaphore(concurrency)
+
+    def _get_tokens(self, prompt, params):
+        seed = hashlib.sha256(to_prompt_text(prompt).encode('utf-8')).digest()
+        generator = random.Random(seed)
+        token_count = min(self.output_tokens, (params or {}).get('max_new_tokens', self.output_tokens))
+        tokens = []
+        for index in range(token_count):
+            if self.section_separator and index > 0 and index % self.section_tokens == 0:
+                tokens.append(self.section_separator)
+            tokens.append(('' if index == 0 else ' ') + generator.choice(_vocabulary))
+        return tokens
+
+    async def _wait_for_first_token(self):
+        """Waits the time to the first token of one request, raises if the request fails."""
+        ttft = self.ttft
+        if self._random.random() < self.tail_probability:
+            ttft *= self.tail_factor
+        await asyncio.sleep(ttft)
+        if self._random.random() < self.failure_rate:
+            raise ConnectionError('mock LLM: simulated upstream failure')
+
+    async def generate(self, prompt: Prompt, params: Optional[dict] = None,
+                       is_complete: Optional[Callable[[str], bool]] = None) -> str:
+        if is_complete is not None:
+            return await self._generate_until_complete(prompt, params, is_complete)
+        tokens = self._get_tokens(prompt, params)
+        async with self._slots:
+            await self._wait_for_first_token()
+            await asyncio.sleep(self.token_delay * max(0, len(tokens) - 1))
+        return ''.join(tokens)
+
+    async def stream(self, prompt: Prompt, params: Optional[dict] = None) -> AsyncIterator[str]:
+        tokens = self._get_tokens(prompt, params)
+        async with self._slots:
+            await self._wait_for_first_token()
+            for index, token in enumerate(tokens):
+                if index > 0:
+                    await asyncio.sleep(self.token_delay)
+                yield token
@@ -0,0 +1,64 @@
+# General packages
+from typing import AsyncIterator, Callable, Optional
+
+# LLM client interface
+from llm.base import LLMClient, Prompt, to_messages
+
+# watsonx parameter names -> OpenAI parameter names
+OPENAI_PARAMETER_NAMES = {
+    'max_new_tokens': 'max_tokens',
+    'stop_sequences': 'stop',
+    'temperature': 'temperature',
+    'top_p': 'top_p',
+}
+
+
+class OpenAILLMClient(LLMClient):
+    def __init__(self, client, model='gpt-4o', params=None):
+        """
+        Async client of an OpenAI chat model.
+
+        Parameters:
+        client: The openai.AsyncOpenAI client.
+        model (str): The chat model.
+        params (dict): Default generation parameters (watsonx names).
+        """
+        self.client = client
+        self.model = model
+        self.params = params or {}
+
+    def _get_arguments(self, params):
+        params = {**self.params, **(params or {})}
+        return {OPENAI_PARAMETER_NAMES[name]: value for name, value in params.items() if name in OPENAI_PARAMETER_NAMES}
+
+    async def generate(self, prompt: Prompt, params: Optional[dict] = None,
+                       is_complete: Optional[Callable[[str], bool]] = None) -> str:
+        if is_complete is not None:
+            return await self._generate_until_complete(prompt, params, is_complete)
+        completion = await self.client.chat.completions.create(
+            model=self.model,
+            messages=to_messages(prompt),
+            **self._get_arguments(params)
+        )
+        return completion.choices[0].message.content or ''
+
+    async def stream(self, prompt: Prompt, params: Optional[dict] = None) -> AsyncIterator[str]:
+        response = await self.client.chat.completions.create(
+            model=self.model,
+            messages=to_messages(prompt),
+            stream=True,
+            **self._get_arguments(params)
+        )
+        try:
+            async for chunk in response:
+                if not chunk.choices:
+                    continue
+                content = getattr(chunk.choices[0].delta, 'content', '') or ''
+                if content:  # Only yield if content is not empty
+                    yield content
+        finally:
+            # a stream that is closed early closes its HTTP response, OpenAI stops generating
+            await response.close()
+
+    async def close(self):
+        await self.client.close()
@@ -0,0 +1,292 @@
+# General packages
+import asyncio
+import os
+import random
+import time
+from typing import AsyncIterator, List, Optional
+
+# LLM client interface
+from llm.base import LLMClient, Prompt, DEFAULT_BATCH_CONCURRENCY
+from llm.scheduler import ScheduledLLMClient
+from metrics import metrics
+
+# Seconds until the text (generate) or its first token (stream) of a request without profile has to be there
+LLM_DEFAULT_TIMEOUT = float(os.environ.get('LLM_DEFAULT_TIMEOUT', 120))
+# Retries of a failed or timed out request, after an exponential backoff with full jitter (seconds)
+LLM_MAX_RETRIES = int(os.environ.get('LLM_MAX_RETRIES', 2))
+LLM_RETRY_BACKOFF = float(os.environ.get('LLM_RETRY_BACKOFF', 0.5))
+LLM_RETRY_BACKOFF_MAX = float(os.environ.get('LLM_RETRY_BACKOFF_MAX', 8))
+# Set to 0 to disable hedging: a second request is sent when the first is slower than this percentile of its profile
+LLM_HEDGING = os.environ.get('LLM_HEDGING', '1') == '1'
+LLM_HEDGE_PERCENTILE = float(os.environ.get('LLM_HEDGE_PERCENTILE', 95))
+# Observed requests of a profile before its requests are hedged
+LLM_HEDGE_MIN_SAMPLES = int(os.environ.get('LLM_HEDGE_MIN_SAMPLES', 20))
+# Budget of the extra requests (retries and hedges): this share of the requests, with up to BURST saved
+LLM_EXTRA_REQUEST_RATIO = float(os.environ.get('LLM_EXTRA_REQUEST_RATIO', 0.1))
+LLM_EXTRA_REQUEST_BURST = float(os.environ.get('LLM_EXTRA_REQUEST_BURST', 10))
+
+# HTTP status codes of transient errors
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504}
+
+
+class LLMUnavailableError(Exception):
+    """The model failed or did not answer in time, also after the retries."""
+
+
+def get_status_code(exception):
+    """HTTP status code of an error of the OpenAI or watsonx SDK, None if it has none."""
+    status_code = getattr(exception, 'status_code', None)
+    if status_code is None:
+        status_code = getattr(getattr(exception, 'response', None), 'status_code', None)
+    return status_code if isinstance(status_code, int) else None
+
+
+def is_retryable(exception):
+    """Timeouts, connection errors and transient HTTP errors are retried, invalid requests are not."""
+    if isinstance(exception, (asyncio.TimeoutError, OSError)):
+        return True
+    status_code = get_status_code(exception)
+    if status_code is not None:
+        return status_code in RETRYABLE_STATUS_CODES
+    return not isinstance(exception, (TypeError, ValueError, KeyError, NotImplementedError))
+
+
+def _consume_exception(task):
+    # the error of a request that lost the race or was abandoned is not needed
+    if not task.cancelled():
+        task.exception()
+
+
+class ExtraRequestBudget:
+    def __init__(self, ratio=LLM_EXTRA_REQUEST_RATIO, burst=LLM_EXTRA_REQUEST_BURST):
+        """
+        Budget of the extra requests (retries and hedges), so a slow or failing model never gets multiplied load.
+        Every request adds `ratio` to the balance (at most `burst`), every extra request costs one.
+
+        Parameters:
+        ratio (float): Extra requests per request.
+        burst (float): Maximum number of saved extra requests.
+        """
+        self.ratio = ratio
+        self.burst = burst
+        self._balance = burst
+
+    def deposit(self):
+        self._balance = min(self.burst, self._balance + self.ratio)
+
+    def withdraw(self):
+        """Takes one extra request from the budget, False if it is used up."""
+        if self._balance < 1:
+            return False
+        self._balance -= 1
+        return True
+
+
+class ResilientLLMClient(LLMClient):
+    def __init__(self, client, name, budget=None, max_retries=LLM_MAX_RETRIES, backoff=LLM_RETRY_BACKOFF,
+                 backoff_max=LLM_RETRY_BACKOFF_MAX, hedging=LLM_HEDGING, hedge_percentile=LLM_HEDGE_PERCENTILE,
+                 hedge_min_samples=LLM_HEDGE_MIN_SAMPLES, default_timeout=LLM_DEFAULT_TIMEOUT):
+        """
+        LLM client with the request policy of the generation profiles (`profile=...`): timeouts, retries and hedging.
+
+        A request that fails or times out (the text of generate, the first token of a stream) is retried up to
+        `max_retries` times after a jittered exponential backoff; LLM requests have no side effects. A stream is only
+        retried before its first token. A request of a hedged profile that has no text (first token) after the
+        `hedge_percentile` of its profile gets a second, identical request; the first answer wins and the other
+        request is cancelled. Retries and hedges are limited by the extra request budget. When all attempts failed,
+        LLMUnavailableError is raised.
+
+        Above a ScheduledLLMClient, every attempt (also a retry or a hedge) is admitted by the scheduler on its own,
+        so its concurrency limit and metrics count the upstream requests. The timeout and the hedge delay start when
+        the first attempt of a try is admitted, the time in the queue is not counted.
+
+        Parameters:
+        client (LLMClient): The backend client.
+        name (str): Name of the client in the metrics.
+        budget (ExtraRequestBudget): Budget of the retries and hedges.
+        max_retries (int): Maximum number of retries of a request.
+        backoff (float): Backoff of the first retry in seconds, doubled for every further retry.
+        backoff_max (float): Maximum backoff in seconds.
+        hedging (bool): Whether the requests of hedged profiles are hedged.
+        hedge_percentile (float): Percentile of the latency of a profile after which a request is hedged.
+        hedge_min_samples (int): Observed requests of a profile before its requests are hedged.
+        default_timeout (float): Timeout of the requests without profile (or profile timeout).
+        """
+        self.client = client
+        self.name = name
+        self.budget = budget or ExtraRequestBudget()
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.hedging = hedging
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.default_timeout = default_timeout
+        self._is_scheduled = isinstance(client, ScheduledLLMClient)
+
+    def _get_attempt_options(self, options):
+        """The options of an attempt and the event that is set when the scheduler admits it."""
+        admitted = asyncio.Event()
+        if not self._is_scheduled:
+            admitted.set()
+            return admitted, options
+        return admitted, {**options, 'on_admitted': admitted.set}
+
+    @staticmethod
+    async def _wait_for_admission(attempt):
+        """Waits until the attempt is admitted (or already finished, e.g. failed in the queue)."""
+        _, task, admitted = attempt
+        if not admitted.is_set():
+            admission = asyncio.ensure_future(admitted.wait())
+            try:
+                await asyncio.wait([admission, task], return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                admission.cancel()
+
+    def _get_policy(self, profile):
+        """Returns the metrics name, the timeout and whether the request is hedged."""
+        if profile is None:
+            return 'default', self.default_timeout, False
+        return profile.name, profile.timeout or self.default_timeout, self.hedging and profile.hedge
+
+    def _get_hedge_delay(self, metric_name, hedge):
+        if not hedge:
+            return None
+        return metrics.get_percentile(metric_name, self.hedge_percentile, min_samples=self.hedge_min_samples)
+
+    async def _wait_before_retry(self, exception, attempt, name):
+        """Waits for the backoff of the retry, raises if the request is not retried."""
+        if not is_retryable(exception):
+            raise exception
+        if attempt >= self.max_retries or not self.budget.withdraw():
+            metrics.increment(f'llm_requests.{self.name}.{name}.failed')
+            raise LLMUnavailableError(f'{self.name} ({name}) is not available: {exception!r}') from exception
+        delay = random.uniform(0, min(self.backoff_max, self.backoff * 2 ** attempt))
+        metrics.increment(f'llm_requests.{self.name}.{name}.retries')
+        print(f'LLM request {self.name} ({name}) failed, retry {attempt + 1} in {delay:.2f} s: {exception!r}')
+        await asyncio.sleep(delay)
+
+    async def _race(self, start_attempt, timeout, hedge_delay, name):
+        """
+        Runs one attempt (and possibly its hedge) until the first one succeeds.
+        Returns the winning attempt (stream, task, admission event) and the time its try was admitted,
+        the other attempts are closed.
+        """
+        attempts = [start_attempt()]
+        hedged = False
+        try:
+            await self._wait_for_admission(attempts[0])
+            start = time.perf_counter()
+            while True:
+                now = time.perf_counter()
+                remaining = start + timeout - now
+                if remaining <= 0:
+                    metrics.increment(f'llm_requests.{self.name}.{name}.timeouts')
+                    raise asyncio.TimeoutError(f'no answer within {timeout} s')
+                wait = remaining
+                if hedge_delay is not None and not hedged:
+                    wait = min(wait, max(0.0, start + hedge_delay - now))
+                done, _ = await asyncio.wait([attempt[1] for attempt in attempts], timeout=wait,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                for attempt in attempts:
+                    task = attempt[1]
+                    if task in done and (task.exception() is None or isinstance(task.exception(), StopAsyncIteration)):
+                        if hedged and attempt is not attempts[0]:
+                            metrics.increment(f'llm_requests.{self.name}.{name}.hedge_wins')
+                        attempts.remove(attempt)
+                        return attempt, start
+                if done:
+                    failed = [attempt for attempt in attempts if attempt[1] in done]
+                    attempts = [attempt for attempt in attempts if attempt[1] not in done]
+                    if not attempts:
+                        raise failed[0][1].exception()
+                    continue  # the other request can still answer
+                if hedge_delay is not None and not hedged and time.perf_counter() >= start + hedge_delay:
+                    hedged = True
+                    if self.budget.withdraw():
+                        metrics.increment(f'llm_requests.{self.name}.{name}.hedges')
+                        attempts.append(start_attempt())
+                    else:
+                        metrics.increment(f'llm_requests.{self.name}.{name}.budget_exhausted')
+        finally:
+            for attempt in attempts:
+                await self._close_attempt(attempt)
+
+    @staticmethod
+    async def _close_attempt(attempt):
+        stream, task, _ = attempt
+        if not task.done():
+            # a stream closes itself when the cancellation reaches it
+            task.cancel()
+        elif stream is not None:
+            await stream.aclose()
+
+    async def generate(self, prompt: Prompt, params: Optional[dict] = None, profile=None, **options) -> str:
+        name, timeout, hedge = self._get_policy(profile)
+        metric_name = f'llm_requests.{self.name}.{name}.latency_seconds'
+        self.budget.deposit()
+
+        def start_attempt():
+            admitted, attempt_options = self._get_attempt_options(options)
+            task = asyncio.ensure_future(self.client.generate(prompt, params=params, **attempt_options))
+            task.add_done_callback(_consume_exception)
+            return None, task, admitted
+
+        attempt = 0
+        while True:
+            try:
+                (_, task, _), start = await self._race(start_attempt, timeout,
+                                                       self._get_hedge_delay(metric_name, hedge), name)
+                break
+            except Exception as e:
+                await self._wait_before_retry(e, attempt, name)
+                attempt += 1
+        metrics.observe(metric_name, time.perf_counter() - start)
+        return task.result()
+
+    async def stream(self, prompt: Prompt, params: Optional[dict] = None, profile=None,
+                     **options) -> AsyncIterator[str]:
+        name, timeout, hedge = self._get_policy(profile)
+        metric_name = f'llm_requests.{self.name}.{name}.ttft_seconds'
+        self.budget.deposit()
+
+        def start_attempt():
+            admitted, attempt_options = self._get_attempt_options(options)
+            stream = self.client.stream(prompt, params=params, **attempt_options)
+            task = asyncio.ensure_future(stream.__anext__())
+            task.add_done_callback(_consume_exception)
+            return stream, task, admitted
+
+        attempt = 0
+        while True:
+            try:
+                (stream, task, _), start = await self._race(start_attempt, timeout,
+                                                            self._get_hedge_delay(metric_name, hedge), name)
+                break
+            except Exception as e:
+                await self._wait_before_retry(e, attempt, name)
+                attempt += 1
+        metrics.observe(metric_name, time.perf_counter() - start)
+
+        # the winner is streamed to its end, without retries once the first token is sent
+        try:
+            if task.exception() is None:
+                yield task.result()
+                async for chunk in stream:
+                    yield chunk
+        finally:
+            await stream.aclose()
+
+    async def batch(self, prompts: List[Prompt], params: Optional[dict] = None,
+                    concurrency: int = DEFAULT_BATCH_CONCURRENCY, profile=None, **options) -> List[str]:
+        # every prompt is retried on its own
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def generate_one(prompt):
+            async with semaphore:
+                return await self.generate(prompt, params=params, profile=profile, **options)
+
+        return list(await asyncio.gather(*(generate_one(prompt) for prompt in prompts)))
+
+    async def close(self):
+        await self.client.close()
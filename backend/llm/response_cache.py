@@ -0,0 +1,243 @@
+# General packages
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, List, Optional
+
+# LLM client interface
+from llm.base import LLMClient, Prompt, to_prompt_text, DEFAULT_BATCH_CONCURRENCY
+from metrics import metrics
+
+# Set to 0 to disable the cache
+RESPONSE_CACHE = os.environ.get('RESPONSE_CACHE', '1') == '1'
+RESPONSE_CACHE_PATH = os.environ.get('RESPONSE_CACHE_PATH', './cache/llm_responses.sqlite')
+# Size bounds, the least recently used responses are evicted first
+RESPONSE_CACHE_MAX_MB = int(os.environ.get('RESPONSE_CACHE_MAX_MB', 256))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 100000))
+# The access times of cache hits are written in batches, at most this many seconds late
+RESPONSE_CACHE_ACCESS_FLUSH_SECONDS = float(os.environ.get('RESPONSE_CACHE_ACCESS_FLUSH_SECONDS', 5))
+# Writes after which the size of the cache is counted again (the other worker processes write into it too)
+_SIZE_RECOUNT_WRITES = 1000
+# Responses evicted per query
+_EVICTION_BATCH = 100
+# Seconds between the replayed chunks of a cached stream (0: as fast as possible)
+RESPONSE_CACHE_REPLAY_DELAY = float(os.environ.get('RESPONSE_CACHE_REPLAY_DELAY', 0.0))
+
+# a replayed stream yields the text word by word, like the model streams it
+_replay_chunk_pattern = re.compile(r'\s*\S+|\s+')
+
+
+class ResponseCache:
+    def __init__(self, path=RESPONSE_CACHE_PATH, max_bytes=RESPONSE_CACHE_MAX_MB * 1024 * 1024,
+                 max_entries=RESPONSE_CACHE_MAX_ENTRIES):
+        """
+        Persistent LRU cache of generated texts in SQLite (key -> text), shared by all API worker processes.
+
+        Parameters:
+        path (str): The SQLite file.
+        max_bytes (int): Maximum size of the cached texts.
+        max_entries (int): Maximum number of cached texts.
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS responses ('
+                                 'key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)')
+        self._connection.commit()
+        self._lock = threading.Lock()
+        # size estimate, counted at the start and every _SIZE_RECOUNT_WRITES writes, updated by the own writes
+        self._entries, self._bytes = self._count()
+        self._writes_since_count = 0
+        # key -> last access of the hits that are not written yet
+        self._pending_accesses = {}
+        self._last_access_flush = time.monotonic()
+        # the database is only used from this thread, so requests never wait for the disk in the event loop
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='response-cache')
+
+    def _count(self):
+        return self._connection.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses').fetchone()
+
+    def _write_accesses(self):
+        """Writes the access times of the recent hits (without commit)."""
+        if self._pending_accesses:
+            self._connection.executemany('UPDATE responses SET last_access = ? WHERE key = ?',
+                                         [(access, key) for key, access in self._pending_accesses.items()])
+            self._pending_accesses.clear()
+        self._last_access_flush = time.monotonic()
+
+    def _evict(self):
+        """Deletes the least recently used responses until the cache is within its bounds, returns their number."""
+        evicted = 0
+        while self._entries > self.max_entries or self._bytes > self.max_bytes:
+            rows = self._connection.execute('SELECT key, size FROM responses ORDER BY last_access LIMIT ?',
+                                            (_EVICTION_BATCH,)).fetchall()
+            if not rows:
+                self._entries, self._bytes = 0, 0
+                break
+            for old_key, old_size in rows:
+                if self._entries <= self.max_entries and self._bytes <= self.max_bytes:
+                    break
+                self._connection.execute('DELETE FROM responses WHERE key = ?', (old_key,))
+                self._entries -= 1
+                self._bytes -= old_size
+                evicted += 1
+        return evicted
+
+    def _get(self, key):
+        with self._lock:
+            row = self._connection.execute('SELECT response FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            # the LRU order only needs approximate access times, they are written in batches
+            self._pending_accesses[key] = time.time()
+            if time.monotonic() - self._last_access_flush >= RESPONSE_CACHE_ACCESS_FLUSH_SECONDS:
+                self._write_accesses()
+                self._connection.commit()
+            return row[0]
+
+    def _put(self, key, response):
+        size = len(response.encode('utf-8'))
+        with self._lock:
+            self._write_accesses()
+            old_row = self._connection.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+            self._connection.execute('INSERT OR REPLACE INTO responses (key, response, size, last_access) VALUES (?, ?, ?, ?)',
+                                     (key, response, size, time.time()))
+            if old_row is None:
+                self._entries += 1
+                self._bytes += size
+            else:
+                self._bytes += size - old_row[0]
+            self._writes_since_count += 1
+            if self._writes_since_count >= _SIZE_RECOUNT_WRITES or \
+                    self._entries > self.max_entries or self._bytes > self.max_bytes:
+                # the exact size, only when the estimate is over a bound or outdated
+                self._entries, self._bytes = self._count()
+                self._writes_since_count = 0
+            evicted = self._evict()
+            self._connection.commit()
+        if evicted:
+            metrics.increment('llm_cache.evictions', evicted)
+
+    async def get(self, key):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._get, key)
+
+    async def put(self, key, response):
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._put, key, response)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            self._write_accesses()
+            self._connection.commit()
+        self._connection.close()
+
+
+def is_deterministic(params):
+    """Only greedy decoding gives the same text for the same prompt (watsonx parameter names)."""
+    return params.get('decoding_method', 'greedy') == 'greedy'
+
+
+def get_request_key(model_id, default_params, prompt, params=None):
+    """Hash of the model id, the generation parameters (defaults and overrides) and the prompt, None if not deterministic."""
+    params = {**default_params, **(params or {})}
+    if not is_deterministic(params):
+        return None
+    request = json.dumps({'model_id': model_id, 'params': params, 'prompt': to_prompt_text(prompt)},
+                         sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(request.encode('utf-8')).hexdigest()
+
+
+class CachedLLMClient(LLMClient):
+    def __init__(self, client, cache, model_id, params, replay_delay=RESPONSE_CACHE_REPLAY_DELAY):
+        """
+        LLM client that answers repeated prompts from the response cache.
+
+        The key is the hash of the model id, the generation parameters (defaults and overrides) and the prompt.
+        Only deterministic (greedy) generations are cached. Cached streams are replayed word by word,
+        `replay_delay` seconds apart. Further keyword arguments (e.g. user and priority) are passed to the client.
+        A generation that ended early (is_complete) is cached like a complete one, every generation profile has its
+        own parameters, so a key always belongs to the same validator.
+
+        Parameters:
+        client (LLMClient): The client that generates the misses.
+        cache (ResponseCache): The response cache.
+        model_id (str): The model of the client.
+        params (dict): The default generation parameters of the client.
+        replay_delay (float): Seconds between the replayed chunks of a cached stream.
+        """
+        self.client = client
+        self.cache = cache
+        self.model_id = model_id
+        self.params = params
+        self.replay_delay = replay_delay
+
+    def _get_key(self, prompt, params):
+        """Cache key of the request, None if the generation is not deterministic."""
+        return get_request_key(self.model_id, self.params, prompt, params)
+
+    async def _lookup(self, key):
+        if key is None:
+            metrics.increment('llm_cache.bypass')
+            return None
+        response = await self.cache.get(key)
+        metrics.increment('llm_cache.hits' if response is not None else 'llm_cache.misses')
+        return response
+
+    async def generate(self, prompt: Prompt, params: Optional[dict] = None, **options) -> str:
+        key = self._get_key(prompt, params)
+        response = await self._lookup(key)
+        if response is None:
+            response = await self.client.generate(prompt, params=params, **options)
+            if key is not None:
+                await self.cache.put(key, response)
+        return response
+
+    async def stream(self, prompt: Prompt, params: Optional[dict] = None, **options) -> AsyncIterator[str]:
+        key = self._get_key(prompt, params)
+        response = await self._lookup(key)
+        if response is not None:
+            for index, chunk in enumerate(_replay_chunk_pattern.findall(response)):
+                if index > 0 and self.replay_delay > 0:
+                    await asyncio.sleep(self.replay_delay)
+                yield chunk
+            return
+
+        chunks = []
+        upstream = self.client.stream(prompt, params=params, **options)
+        try:
+            async for chunk in upstream:
+                chunks.append(chunk)
+                yield chunk
+        finally:
+            await upstream.aclose()
+        # only complete streams are cached, a stream that was closed early never gets here
+        if key is not None:
+            await self.cache.put(key, ''.join(chunks))
+
+    async def batch(self, prompts: List[Prompt], params: Optional[dict] = None,
+                    concurrency: int = DEFAULT_BATCH_CONCURRENCY, **options) -> List[str]:
+        keys = [self._get_key(prompt, params) for prompt in prompts]
+        responses = [await self._lookup(key) for key in keys]
+        missing = [index for index, response in enumerate(responses) if response is None]
+        if missing:
+            generated = await self.client.batch([prompts[index] for index in missing], params=params,
+                                                concurrency=concurrency, **options)
+            for index, response in zip(missing, generated):
+                responses[index] = response
+                if keys[index] is not None:
+                    await self.cache.put(keys[index], response)
+        return responses
+
+    async def close(self):
+        await self.client.close()
+        self.cache.close()
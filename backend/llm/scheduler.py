@@ -0,0 +1,191 @@
+# General packages
+import asyncio
+import itertools
+import os
+import time
+from collections import Counter
+from typing import AsyncIterator, Callable, List, Optional
+
+# LLM client interface
+from llm.base import LLMClient, Prompt, DEFAULT_BATCH_CONCURRENCY
+from metrics import metrics
+
+# Priority classes, a lower value is served first
+INTERACTIVE = 0  # chat and learning plan streams, a user is waiting for the first token
+EVALUATION = 1  # quiz evaluation and topic classification
+BACKGROUND = 2  # quiz generation and summaries
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', EVALUATION: 'evaluation', BACKGROUND: 'background'}
+
+# Maximum number of requests sent to the model at the same time
+LLM_MAX_CONCURRENCY = int(os.environ.get('LLM_MAX_CONCURRENCY', 8))
+# Maximum number of interactive requests of one user at the same time
+LLM_MAX_CONCURRENCY_PER_USER = int(os.environ.get('LLM_MAX_CONCURRENCY_PER_USER', 3))
+# Maximum number of evaluation and background requests of one user at the same time, counted apart from the
+# interactive ones, so the quizzes of a user never hold the slots of the user's chats
+LLM_MAX_BACKGROUND_PER_USER = int(os.environ.get('LLM_MAX_BACKGROUND_PER_USER', 2))
+# Number of the slots only interactive requests may use, so chats never wait behind background work
+LLM_INTERACTIVE_RESERVED = int(os.environ.get('LLM_INTERACTIVE_RESERVED', 2))
+
+
+class _Waiter:
+    def __init__(self, user_id, priority, sequence, future):
+        self.user_id = user_id
+        self.priority = priority
+        self.sequence = sequence
+        self.future = future
+
+
+class LLMScheduler:
+    def __init__(self, name, max_concurrency=LLM_MAX_CONCURRENCY, max_per_user=LLM_MAX_CONCURRENCY_PER_USER,
+                 max_background_per_user=LLM_MAX_BACKGROUND_PER_USER, interactive_reserved=LLM_INTERACTIVE_RESERVED):
+        """
+        Admission control of the requests to one model: global and per-user concurrency limits and priority classes.
+
+        Requests that cannot start wait in a queue instead of failing. A free slot goes to the waiting request
+        with the highest priority; within a priority, to the user with the fewest running requests, then first come
+        first served. Non-interactive requests can only use `max_concurrency - interactive_reserved` slots.
+        The per-user limits count the interactive and the other requests of a user apart, so a user's chat never
+        waits behind the same user's quiz generation.
+
+        Parameters:
+        name (str): Name of the scheduler in the metrics.
+        max_concurrency (int): Maximum number of running requests.
+        max_per_user (int): Maximum number of running interactive requests per user.
+        max_background_per_user (int): Maximum number of running evaluation and background requests per user.
+        interactive_reserved (int): Slots that are reserved for interactive requests.
+        """
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_per_user = max_per_user
+        self.max_background_per_user = max_background_per_user
+        self.interactive_reserved = min(interactive_reserved, max_concurrency - 1)
+        self._running = 0
+        self._running_per_user = Counter()
+        # the running requests per user and per class (interactive or not)
+        self._running_per_user_class = Counter()
+        self._waiters = []
+        self._sequence = itertools.count()
+
+    def _can_start(self, user_id, priority):
+        limit = self.max_concurrency if priority == INTERACTIVE else self.max_concurrency - self.interactive_reserved
+        if self._running >= limit:
+            return False
+        if user_id is None:
+            return True
+        is_interactive = priority == INTERACTIVE
+        user_limit = self.max_per_user if is_interactive else self.max_background_per_user
+        return self._running_per_user_class[(user_id, is_interactive)] < user_limit
+
+    def _start(self, user_id, priority):
+        self._running += 1
+        if user_id is not None:
+            self._running_per_user[user_id] += 1
+            self._running_per_user_class[(user_id, priority == INTERACTIVE)] += 1
+
+    def _dispatch(self):
+        # a cancelled request can still be in the queue until its task runs again
+        self._waiters = [waiter for waiter in self._waiters if not waiter.future.done()]
+        while self._waiters:
+            eligible = [waiter for waiter in self._waiters if self._can_start(waiter.user_id, waiter.priority)]
+            if not eligible:
+                break
+            waiter = min(eligible, key=lambda w: (w.priority, self._running_per_user[w.user_id], w.sequence))
+            self._waiters.remove(waiter)
+            self._start(waiter.user_id, waiter.priority)
+            waiter.future.set_result(None)
+        self._update_gauges()
+
+    def _update_gauges(self):
+        metrics.set_gauge(f'llm_scheduler.{self.name}.running', self._running)
+        for priority, priority_name in PRIORITY_NAMES.items():
+            metrics.set_gauge(f'llm_scheduler.{self.name}.queue_depth.{priority_name}',
+                              sum(1 for waiter in self._waiters if waiter.priority == priority))
+
+    async def acquire(self, user_id=None, priority=INTERACTIVE):
+        """Waits for a slot, every acquire needs a release."""
+        start = time.perf_counter()
+        waiter = _Waiter(user_id, priority, next(self._sequence), asyncio.get_running_loop().create_future())
+        self._waiters.append(waiter)
+        self._dispatch()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                self.release(user_id, priority)  # the slot was granted while the request was cancelled
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+                self._update_gauges()
+            raise
+        metrics.observe(f'llm_scheduler.{self.name}.wait_seconds.{PRIORITY_NAMES[priority]}', time.perf_counter() - start)
+
+    def release(self, user_id=None, priority=INTERACTIVE):
+        self._running -= 1
+        if user_id is not None:
+            self._running_per_user[user_id] -= 1
+            if self._running_per_user[user_id] == 0:
+                del self._running_per_user[user_id]
+            user_class = (user_id, priority == INTERACTIVE)
+            self._running_per_user_class[user_class] -= 1
+            if self._running_per_user_class[user_class] == 0:
+                del self._running_per_user_class[user_class]
+        self._dispatch()
+
+
+class ScheduledLLMClient(LLMClient):
+    def __init__(self, client, scheduler):
+        """
+        LLM client whose requests are admitted by a scheduler.
+        The methods take the user and the priority class of the request in addition to the LLMClient arguments,
+        and `on_admitted`, called when the request gets its slot (e.g. to start its timeout only then);
+        further keyword arguments are passed to the client.
+
+        Parameters:
+        client (LLMClient): The backend client.
+        scheduler (LLMScheduler): The scheduler of the backend's model.
+        """
+        self.client = client
+        self.scheduler = scheduler
+
+    async def generate(self, prompt: Prompt, params: Optional[dict] = None,
+                       is_complete: Optional[Callable[[str], bool]] = None,
+                       user_id: Optional[str] = None, priority: int = INTERACTIVE,
+                       on_admitted: Optional[Callable[[], None]] = None, **options) -> str:
+        await self.scheduler.acquire(user_id, priority)
+        try:
+            if on_admitted is not None:
+                on_admitted()
+            return await self.client.generate(prompt, params=params, is_complete=is_complete, **options)
+        finally:
+            self.scheduler.release(user_id, priority)
+
+    async def stream(self, prompt: Prompt, params: Optional[dict] = None,
+                     user_id: Optional[str] = None, priority: int = INTERACTIVE,
+                     on_admitted: Optional[Callable[[], None]] = None, **options) -> AsyncIterator[str]:
+        # the slot is held until the stream is finished or closed
+        await self.scheduler.acquire(user_id, priority)
+        try:
+            if on_admitted is not None:
+                on_admitted()
+            upstream = self.client.stream(prompt, params=params, **options)
+            try:
+                async for chunk in upstream:
+                    yield chunk
+            finally:
+                await upstream.aclose()
+        finally:
+            self.scheduler.release(user_id, priority)
+
+    async def batch(self, prompts: List[Prompt], params: Optional[dict] = None,
+                    concurrency: int = DEFAULT_BATCH_CONCURRENCY,
+                    user_id: Optional[str] = None, priority: int = BACKGROUND, **options) -> List[str]:
+        # every prompt is admitted on its own, so a large batch never blocks other requests
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def generate_one(prompt):
+            async with semaphore:
+                return await self.generate(prompt, params=params, user_id=user_id, priority=priority, **options)
+
+        return list(await asyncio.gather(*(generate_one(prompt) for prompt in prompts)))
+
+    async def close(self):
+        await self.client.close()
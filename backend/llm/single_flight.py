@@ -0,0 +1,133 @@
+# General packages
+import asyncio
+from typing import AsyncIterator, Optional
+
+# LLM client interface
+from llm.base import LLMClient, Prompt
+from llm.response_cache import get_request_key
+from metrics import metrics
+
+
+class _Flight:
+    """One running upstream request and the number of requests waiting for it."""
+
+    def __init__(self):
+        self.task = None
+        self.subscribers = 0
+        # stream flights: all chunks so far, so late subscribers start from the first token
+        self.chunks = []
+        self.finished = False
+        self.error = None
+        self.changed = asyncio.Condition()
+
+
+class SingleFlightLLMClient(LLMClient):
+    def __init__(self, client, model_id, params):
+        """
+        LLM client that coalesces identical requests that are running at the same time into one upstream request.
+
+        Identical means the same model, parameters and prompt of a deterministic (greedy) generation, so all requests
+        would get the same text anyway. Streams are fanned out: every subscriber gets the complete token sequence,
+        also if it joins after the first tokens. The upstream request is cancelled when all its requests are gone.
+        Further keyword arguments (e.g. user and priority) are taken from the first request.
+
+        Parameters:
+        client (LLMClient): The client of the upstream requests.
+        model_id (str): The model of the client.
+        params (dict): The default generation parameters of the client.
+        """
+        self.client = client
+        self.model_id = model_id
+        self.params = params
+        self._generations = {}
+        self._streams = {}
+
+    @staticmethod
+    def _remove(flights, key, flight):
+        """Removes the flight, new requests start a new one."""
+        if flights.get(key) is flight:
+            del flights[key]
+
+    async def generate(self, prompt: Prompt, params: Optional[dict] = None, **options) -> str:
+        key = get_request_key(self.model_id, self.params, prompt, params)
+        if key is None:
+            return await self.client.generate(prompt, params=params, **options)
+
+        flight = self._generations.get(key)
+        if flight is None:
+            flight = _Flight()
+            flight.task = asyncio.create_task(self.client.generate(prompt, params=params, **options))
+            flight.task.add_done_callback(lambda _: self._remove(self._generations, key, flight))
+            self._generations[key] = flight
+        else:
+            metrics.increment('llm_single_flight.generate.coalesced')
+
+        flight.subscribers += 1
+        try:
+            # shield: a cancelled request must not cancel the generation of the others
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.task.done():
+                self._remove(self._generations, key, flight)
+                flight.task.cancel()
+
+    async def _produce(self, flight, prompt, params, options):
+        upstream = self.client.stream(prompt, params=params, **options)
+        try:
+            async for chunk in upstream:
+                async with flight.changed:
+                    flight.chunks.append(chunk)
+                    flight.changed.notify_all()
+        except Exception as e:
+            flight.error = e
+        finally:
+            await upstream.aclose()
+            async with flight.changed:
+                flight.finished = True
+                flight.changed.notify_all()
+
+    async def stream(self, prompt: Prompt, params: Optional[dict] = None, **options) -> AsyncIterator[str]:
+        key = get_request_key(self.model_id, self.params, prompt, params)
+        if key is None:
+            upstream = self.client.stream(prompt, params=params, **options)
+            try:
+                async for chunk in upstream:
+                    yield chunk
+            finally:
+                await upstream.aclose()
+            return
+
+        flight = self._streams.get(key)
+        if flight is None:
+            flight = _Flight()
+            flight.task = asyncio.create_task(self._produce(flight, prompt, params, options))
+            flight.task.add_done_callback(lambda _: self._remove(self._streams, key, flight))
+            self._streams[key] = flight
+        else:
+            metrics.increment('llm_single_flight.stream.coalesced')
+
+        flight.subscribers += 1
+        try:
+            index = 0
+            while True:
+                async with flight.changed:
+                    await flight.changed.wait_for(lambda: index < len(flight.chunks) or flight.finished)
+                    chunks = flight.chunks[index:]
+                    finished = flight.finished
+                for chunk in chunks:
+                    yield chunk
+                index += len(chunks)
+                if finished and index == len(flight.chunks):
+                    break
+            if flight.error is not None:
+                raise flight.error
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.task.done():
+                # nobody listens anymore, the producer closes the upstream stream
+                self._remove(self._streams, key, flight)
+                flight.task.cancel()
+
+    async def close(self):
+        await self.client.close()
@@ -0,0 +1,41 @@
+# General packages
+from typing import AsyncIterator, Callable, Optional
+
+# LLM client interface
+from llm.base import LLMClient, Prompt, to_prompt_text
+
+
+class WatsonxLLMClient(LLMClient):
+    def __init__(self, model):
+        """
+        Async client of a model on watsonx (ALLaM).
+
+        A ModelInference of the ibm_watsonx_ai SDK (1.8 or later) is called with its async methods (agenerate,
+        agenerate_stream), on the pooled httpx client of its APIClient.
+
+        Parameters:
+        model: The ibm_watsonx_ai.foundation_models.ModelInference, with its default generation parameters.
+        """
+        self.model = model
+
+    def _get_params(self, params):
+        # the SDK replaces its default parameters by the given ones, the interface overrides single parameters
+        if not params:
+            return None
+        return {**(getattr(self.model, 'params', None) or {}), **params}
+
+    async def generate(self, prompt: Prompt, params: Optional[dict] = None,
+                       is_complete: Optional[Callable[[str], bool]] = None) -> str:
+        if is_complete is not None:
+            return await self._generate_until_complete(prompt, params, is_complete)
+        response = await self.model.agenerate(prompt=to_prompt_text(prompt), params=self._get_params(params))
+        return response['results'][0]['generated_text']
+
+    async def stream(self, prompt: Prompt, params: Optional[dict] = None) -> AsyncIterator[str]:
+        response = await self.model.agenerate_stream(prompt=to_prompt_text(prompt), params=self._get_params(params))
+        try:
+            async for chunk in response:
+                yield chunk['results'][0]['generated_text']
+        finally:
+            # closes the upstream response, also when the stream is cancelled
+            await response.aclose()
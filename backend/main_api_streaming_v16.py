@@ -12,6 +12,8 @@ import uvicorn
 import os
 import re
 import shutil
+import time
+from functools import partial
 
 
 # Additional imports for session management
@@ -19,36 +21,81 @@ from starlette.middleware.sessions import SessionMiddleware
 
 # Additional imports for PDF processing and OpenAI API
 import PyPDF2
-from openai import OpenAI
+from openai import AsyncOpenAI
 import json
 import uuid
-import requests  # Added for image downloading
+import aiofiles
 
 # ALLaM imports
-from ibm_watsonx_ai.foundation_models import Model
-
-from prompts_with_examples import get_general_paraphrasing_prompt, get_free_text_quiz_prompt, get_quiz_evaluator_prompt
+from ibm_watsonx_ai import APIClient, Credentials
+from ibm_watsonx_ai.foundation_models import ModelInference
+
+# async LLM clients (watsonx, OpenAI, local mock)
+from llm.watsonx_client import WatsonxLLMClient
+from llm.openai_client import OpenAILLMClient
+from llm.mock_client import MockLLMClient
+from llm.scheduler import LLMScheduler, ScheduledLLMClient, INTERACTIVE, EVALUATION, BACKGROUND
+from llm.response_cache import ResponseCache, CachedLLMClient, RESPONSE_CACHE
+from llm.single_flight import SingleFlightLLMClient
+from llm.resilience import ResilientLLMClient, LLMUnavailableError
+from llm.generation_profiles import (CLASSIFICATION_PROFILE, MULTIPLE_CHOICE_QUIZ_PROFILE, FREE_TEXT_QUIZ_PROFILE,
+                                     EVALUATION_PROFILE, SIMPLIFY_PROFILE, HELP_CHAT_PROFILE, get_topic_label_validator)
+
+from prompts_with_examples import get_general_paraphrasing_prompt, get_free_text_quiz_prompt, \
+    get_quiz_evaluator_instructions, get_quiz_evaluator_examples
 
 # RAG imports
 from RAG.RAGApplication2 import RAGSystem
-from langchain.embeddings import SentenceTransformerEmbeddings  # Import the embedding model
+from RAG.lazy_embeddings import LazySentenceTransformerEmbeddings  # Import the embedding model
 from RAG_DB.learn_material_to_vectordb import PDFVectorStore
 
 # Azure Speech SDK import
 import azure.cognitiveservices.speech as speechsdk  # azure-cognitiveservices-speech
 
 # pdf extraction 
-from marker.convert import convert_single_pdf
-from marker.models import load_all_models
+from pdf_extraction.extraction_worker import PDFExtractionWorker
+from pdf_extraction.page_stream import stream_pdf_pages
+from pdf_extraction.image_pipeline import get_image_url, hash_images, optimize_images, replace_image_references
+
+# streamed, size-bounded uploads
+from upload_storage import RequestSizeLimitMiddleware, UploadBudget, UploadTooLargeError, save_upload_file
 
 # dynamic prompts
-from dynamic_system_prompts.dynamic_classifier_prompt_builder import get_dynamic_classifier_prompt
-from dynamic_system_prompts.dynamic_system_prompts_builder import build_all_system_prompts
+from dynamic_system_prompts.topic_registry import TopicRegistry
+from dynamic_system_prompts.embedding_topic_classifier import EmbeddingTopicClassifier
+from dynamic_system_prompts.document_sampler import sample_document
+from dynamic_system_prompts.example_selector import ExampleSelector
+
+# bounded chat history with rolling summary
+from conversation_memory import ConversationMemory, SUMMARY_MAX_NEW_TOKENS
+
+# prompt templates with token accounting
+from prompt_templates import PromptTemplate, SlotPolicy, TRUNCATE, DROP_EXAMPLES, SUMMARIZE
+from metrics import metrics
+from stream_cancellation import start_stream, stream_until_disconnect
+from token_counting import get_tokenizer
+from http_clients import OutboundHTTP
+from quiz_jobs import QuizJob, LAZY_QUIZZES, QUIZ_CACHE_PATH, get_plan_hash
+from quiz_batching import QUIZ_BATCH_SIZE, format_quiz_batch, get_batch_stop_sequence, group_chunks, \
+    is_free_text_question_valid, is_multiple_choice_question_valid, parse_quiz_batch
 
 # Globally loaded models and components
 models = {}
 # Global user dictionary
 user_dict = {}
+# Separator between the chunks of a learning plan
+LEARNING_PLAN_SEPARATOR = "\n\n---\n\n"
+# Number of PDF pages converted at once before the learning plan generation of these pages starts
+PDF_PAGES_PER_BATCH = int(os.environ.get('PDF_PAGES_PER_BATCH', 2))
+# 'mock' replaces ALLaM and GPT-4o by a local, deterministic mock (offline development and load tests)
+LLM_BACKEND = os.environ.get('LLM_BACKEND', 'watsonx')
+# Number of quiz questions (one per learning plan chunk) that are generated at the same time, per quiz
+QUIZ_GENERATION_CONCURRENCY = int(os.environ.get('QUIZ_GENERATION_CONCURRENCY', 4))
+# 1: the embedding model is loaded in the background at startup, 0: with the first embedding request
+EMBEDDING_WARM_UP = int(os.environ.get('EMBEDDING_WARM_UP', 1))
+# Quiz types of a learning plan, the names in the quiz job
+MULTIPLE_CHOICE_QUIZ = 'multiple_choice'
+FREE_TEXT_QUIZ = 'free_text'
 
 
 def initialize_user_dict(user_id):
@@ -68,6 +115,17 @@ def user_exists_in_dict(user_id):
     return user_id in user_dict
 
 
+async def wait_for_classification(user_id):
+    """
+    Waits until the topic of the last upload is classified, if its classification is still running.
+    The classification runs in the background of /upload-pdf/, the topic (prompt_key, ref_knowledge_path) is stored
+    when it finishes. A client that stops waiting does not cancel the classification.
+    """
+    classification_task = user_dict[user_id].get('classification_task')
+    if classification_task is not None:
+        await asyncio.wait({classification_task})
+
+
 class ChatMessage(BaseModel):
     role: str
     content: str
@@ -110,22 +168,56 @@ async def lifespan(app: FastAPI):
     api_key = str(os.environ.get('ALLAM_WATSONX_KEY'))
     project_id = str(os.environ.get('ALLAM_PROJECT_ID'))
 
-    models['llm'] = Model(
-        model_id=model_id,
-        params=parameters,
-        credentials={
-            'url': 'https://eu-de.ml.cloud.ibm.com',
-            'apikey': api_key
-        },
-        project_id=project_id
-    )
-
     # Ensure OpenAI API key is set
     openai_api_key = os.environ.get('OPENAI_API_KEY')
-    models['openai_client'] = OpenAI(api_key=openai_api_key)
-
-    # load pdf extraction models
-    models['markdown'] = load_all_models()
+    # the prompts are measured with the ALLaM tokenizer, loaded (or downloaded) here in the executor instead of
+    # blocking the event loop with the first token count
+    await asyncio.get_running_loop().run_in_executor(None, get_tokenizer)
+
+    # all outbound requests go through pooled keep-alive connections, one pool per service
+    models['http'] = OutboundHTTP()
+    # images (DALL-E) and transcriptions (Whisper)
+    models['openai_client'] = AsyncOpenAI(api_key=openai_api_key, http_client=models['http'].get_client('openai'))
+
+    # the endpoints only use the async LLM interface: models['llm'] (ALLaM) and models['learning_plan_llm'] (GPT-4o)
+    if LLM_BACKEND == 'mock':
+        print("LLM backend: local mock")
+        llm = MockLLMClient()
+        learning_plan_llm = MockLLMClient(output_tokens=600, section_separator=LEARNING_PLAN_SEPARATOR)
+    else:
+        watsonx_client = APIClient(
+            credentials=Credentials(url='https://eu-de.ml.cloud.ibm.com', api_key=api_key),
+            project_id=project_id,
+            httpx_client=models['http'].get_sync_client('watsonx'),
+            async_httpx_client=models['http'].get_client('watsonx')
+        )
+        # the retries are done by the ResilientLLMClient, with the extra request budget
+        llm = WatsonxLLMClient(ModelInference(
+            model_id=model_id,
+            params=parameters,
+            api_client=watsonx_client,
+            max_retries=0
+        ))
+        learning_plan_llm = OpenAILLMClient(models['openai_client'].with_options(max_retries=0), model='gpt-4o',
+                                            params={'temperature': 0.1})
+    # the requests follow the policy of their generation profile (timeouts, retries, hedging), every attempt is
+    # admitted on its own by the admission control of the model (concurrency limits and priority classes), so
+    # retries and hedges never exceed its concurrency limit
+    models['llm'] = ResilientLLMClient(ScheduledLLMClient(llm, LLMScheduler('allam')), 'allam')
+    models['learning_plan_llm'] = ResilientLLMClient(ScheduledLLMClient(learning_plan_llm, LLMScheduler('openai')),
+                                                     'openai')
+    # ALLaM decodes greedily, repeated prompts (classification, quizzes, evaluations) are answered from the cache,
+    # cache hits do not wait for the scheduler
+    llm_model_id = 'mock' if LLM_BACKEND == 'mock' else model_id
+    if RESPONSE_CACHE:
+        models['llm'] = CachedLLMClient(models['llm'], ResponseCache(), model_id=llm_model_id, params=parameters)
+    # identical requests at the same time (e.g. a class uploading the same worksheet) share one generation
+    models['llm'] = SingleFlightLLMClient(models['llm'], model_id=llm_model_id, params=parameters)
+    # the generated quiz questions, by learning plan, chunk and quiz type
+    models['quiz_cache'] = ResponseCache(path=QUIZ_CACHE_PATH)
+
+    # pdf extraction runs in separate worker processes, which load the marker models on demand
+    models['pdf_extractor'] = PDFExtractionWorker(max_workers=int(os.environ.get('PDF_EXTRACTION_WORKERS', 1)))
 
     # Initialize Azure Speech SDK
     speech_key = os.environ.get('SPEECH_KEY')
@@ -135,17 +227,38 @@ async def lifespan(app: FastAPI):
 
     models['speech_config'] = speech_config
 
-    ## Load the embedding model globally
+    ## The embedding model is shared globally and loaded with the first embedding request,
+    ## or in the executor right away: the server starts without waiting for it, the first upload usually does not
     embedding_model_name = "intfloat/multilingual-e5-large"
-    embedding_model = SentenceTransformerEmbeddings(
+    embedding_model = LazySentenceTransformerEmbeddings(
         model_name=embedding_model_name
     )
+    if EMBEDDING_WARM_UP:
+        models['embedding_warm_up'] = asyncio.get_running_loop().run_in_executor(None, embedding_model.warm_up)
 
+    models['embedding_model'] = embedding_model
     models['rag_system'] = RAGSystem(embedding_model)
 
+    # topics (prompts, definitions, reference paths) are served from memory and reloaded when the folder changes
+    models['topic_registry'] = TopicRegistry(base_folder='./dynamic_system_prompts')
+    models['topic_registry'].start_polling()
+    models['topic_classifier'] = EmbeddingTopicClassifier(embedding_model, models['topic_registry'])
+    models['topic_registry'].add_listener(models['topic_classifier'].invalidate)
+
+    # only the few-shot examples most similar to the user input are sent, the examples are embedded once
+    models['example_selector'] = ExampleSelector(embedding_model, get_examples=models['topic_registry'].get_examples)
+    models['topic_registry'].add_listener(models['example_selector'].invalidate)
+    models['evaluator_example_selector'] = ExampleSelector(embedding_model, get_examples=lambda key: get_quiz_evaluator_examples())
+
     print("Server started")
     yield
     # Clean up the ML models and release the resources
+    models['pdf_extractor'].shutdown()
+    models['topic_registry'].stop_polling()
+    await models['llm'].close()
+    await models['learning_plan_llm'].close()
+    await models['http'].aclose()
+    models['quiz_cache'].close()
     models.clear()
     print("Server shutting down")
 
@@ -153,6 +266,10 @@ async def lifespan(app: FastAPI):
 app = FastAPI(lifespan=lifespan)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
+# Reject too large request bodies while they are received, before the multipart parser spools them
+# (innermost middleware: the rejections still get the CORS headers)
+app.add_middleware(RequestSizeLimitMiddleware)
+
 # Add session middleware
 secret_key = os.environ.get('SESSION_SECRET_KEY', 'default-secret-key')  # Replace with a secure key
 app.add_middleware(SessionMiddleware, secret_key=secret_key)
@@ -167,28 +284,12 @@ app.add_middleware(
 )
 
 
-# Updated AsyncIteratorWrapper
-class AsyncIteratorWrapper:
-    def __init__(self, iterator):
-        self.iterator = iterator
-
-    def __aiter__(self):
-        return self
-
-    async def __anext__(self):
-        def next_wrapper():
-            try:
-                return next(self.iterator)
-            except StopIteration:
-                return None
-
-        loop = asyncio.get_event_loop()
-        value = await loop.run_in_executor(None, next_wrapper)
-
-        if value is None:
-            raise StopAsyncIteration
-        else:
-            return value
+@app.exception_handler(LLMUnavailableError)
+async def llm_unavailable_handler(request: Request, exc: LLMUnavailableError):
+    # the model failed or was too slow also after the retries, the client may try again later
+    print(f'LLM unavailable: {exc}')
+    return JSONResponse(status_code=503, content={'detail': 'The language model is not available, please try again.'},
+                        headers={'Retry-After': '5'})
 
 
 def get_user_id(request: Request):
@@ -203,6 +304,27 @@ def get_user_folder(user_id: str):
     return user_folder
 
 
+# the chunks are ordered by similarity, the least similar chunk is cut first
+HELP_CHAT_TEMPLATE = PromptTemplate('help_chat', """<s> [INST] You are an AI assistant answering questions exclusively based only on the information in these three chunks:
+Chunk 1:
+<<CHUNK1>>
+Chunk 2:
+<<CHUNK2>>
+Chunk 3:
+<<CHUNK3>>
+User's question: <<QUESTION>>
+Answer the question using only information from these chunks. 
+If the answer isn't fully contained in the chunks, answer the following: ""  you don't have enough information to respond because you have to answer only based on the underlying information..
+Thus, never use external knowledge to answer. Similarly, never use your own knowledge to answer. Also, never make assumptions. 
+If you cannot answer from the chunks, simply say I don't have enough information to respond because I have to answer only based on the underlying information.  
+Answer always in Arabic, never answer in English. [/INST] Answer: """, slot_policies={
+    'CHUNK3': SlotPolicy(TRUNCATE),
+    'CHUNK2': SlotPolicy(TRUNCATE),
+    'CHUNK1': SlotPolicy(TRUNCATE),
+    'QUESTION': SlotPolicy(TRUNCATE),
+}, max_new_tokens=HELP_CHAT_PROFILE.max_new_tokens)
+
+
 @app.post("/help-chat/")
 async def stream_response(request: Request, generation_request: GenerationRequest):
     try:
@@ -230,54 +352,73 @@ async def stream_response(request: Request, generation_request: GenerationReques
         print(f"Learning Style: {generation_request.user_info.learning_style}")
         print(f"Interests: {generation_request.user_info.interests}")
 
-        system_prompt = """You are an AI assistant answering questions exclusively based only on the information in these three chunks:
-Chunk 1:
-<<CHUNK1>>
-Chunk 2:
-<<CHUNK2>>
-Chunk 3:
-<<CHUNK3>>
-User's question: <<QUESTION>>
-Answer the question using only information from these chunks. 
-If the answer isn't fully contained in the chunks, answer the following: ""  you don't have enough information to respond because you have to answer only based on the underlying information..
-Thus, never use external knowledge to answer. Similarly, never use your own knowledge to answer. Also, never make assumptions. 
-If you cannot answer from the chunks, simply say I don't have enough information to respond because I have to answer only based on the underlying information.  
-Answer always in Arabic, never answer in English."""
-
         last_user_question = chat_history[-1]['content']
 
         # user vectorstore path (learning plan)
         # user_embedding_path = request.session['user_vector_db_path']
         user_embedding_path = user_dict[user_id]['user_vector_db_path']
-        # ref vectorstore path (External knowledge Ref)
+        # ref vectorstore path (External knowledge Ref), of the topic of the last upload
         # ref_knowledge_path = request.session['ref_knowledge_path']
+        await wait_for_classification(user_id)
         ref_knowledge_path = user_dict[user_id]['ref_knowledge_path']
-        most_similar_chunks = models['rag_system'].retrieve_top_chunks_from_two_vectorstores(user_embedding_path, ref_knowledge_path, last_user_question)
+        # the question is embedded (and the model loaded, the first time) in the executor
+        loop = asyncio.get_running_loop()
+        most_similar_chunks = await loop.run_in_executor(None, models['rag_system'].retrieve_top_chunks_from_two_vectorstores,
+                                                         user_embedding_path, ref_knowledge_path, last_user_question)
 
         # create entire prompt
-        system_prompt_temp = system_prompt.replace("<<QUESTION>>", last_user_question)
-        system_prompt_temp = system_prompt_temp.replace("<<CHUNK1>>", most_similar_chunks[0])
-        system_prompt_temp = system_prompt_temp.replace("<<CHUNK2>>", most_similar_chunks[1])
-        system_prompt_temp = system_prompt_temp.replace("<<CHUNK3>>", most_similar_chunks[2])
-
-        prompt = f"<s> [INST] {system_prompt_temp} [/INST] Answer: "
+        prompt = HELP_CHAT_TEMPLATE.render(
+            CHUNK1=most_similar_chunks[0],
+            CHUNK2=most_similar_chunks[1],
+            CHUNK3=most_similar_chunks[2],
+            QUESTION=last_user_question
+        )
         print("-" * 50)
         print(prompt)
         print("-" * 50)
 
-        # generate response
-        gen = models['llm'].generate_text_stream(prompt=prompt)
+        # generate response, the generation stops when the client disconnects
+        gen = stream_until_disconnect(
+            request,
+            models['llm'].stream(prompt, params=HELP_CHAT_PROFILE.params, profile=HELP_CHAT_PROFILE,
+                                 user_id=user_id, priority=INTERACTIVE),
+            'help_chat', max_tokens=HELP_CHAT_PROFILE.max_new_tokens
+        )
+        # the model is unavailable: answered with 503 as long as the response has not started
+        gen = await start_stream(gen)
 
         async def event_generator():
-            async for chunk in AsyncIteratorWrapper(gen):
+            async for chunk in gen:
                 yield chunk
 
         return StreamingResponse(event_generator(), media_type="text/plain")
+    except LLMUnavailableError:
+        raise
     except Exception as e:
         print(f'Error in /help-chat/ endpoint: {e}')
         raise HTTPException(status_code=500, detail=str(e))
 
 
+GENERAL_SIMPLIFY_TEMPLATE = PromptTemplate(
+    'simplify_general',
+    get_general_paraphrasing_prompt() + " Now, follow the style of paraphrasing and simplification you learned from the given examples and then answer the following question accordingly! <s> [INST] <<QUESTION>> [/INST] User interest: <<INTERESTS>> [/INST]",
+    slot_policies={'QUESTION': SlotPolicy(TRUNCATE)},
+    max_new_tokens=SIMPLIFY_PROFILE.max_new_tokens
+)
+
+# on overflow, the older conversation is cut first, then the examples are dropped
+TOPIC_SIMPLIFY_TEMPLATE = PromptTemplate(
+    'simplify_topic',
+    "<s>[INST] <<INSTRUCTIONS>>\n<<EXAMPLES>>Now, follow the style of paraphrasing and simplification you learned from the given examples and then answer the following question accordingly!<<HISTORY>><s> [INST] <<QUESTION>> [/INST]User interest: <<INTERESTS>>[/INST]",
+    slot_policies={
+        'HISTORY': SlotPolicy(TRUNCATE, keep='end'),
+        'EXAMPLES': SlotPolicy(DROP_EXAMPLES, separator=''),
+        'QUESTION': SlotPolicy(TRUNCATE),
+    },
+    max_new_tokens=SIMPLIFY_PROFILE.max_new_tokens
+)
+
+
 @app.post("/simplify/")
 async def stream_simplified_text(request: Request, generation_request: GenerationRequest):
     try:
@@ -294,6 +435,8 @@ async def stream_simplified_text(request: Request, generation_request: Generatio
         if user_dict[user_id]['clear_chat_history']:
             chat_history = [chat_history[-1]]  # chat_history is a list with one element: user question
             user_dict[user_id]['clear_chat_history'] = False
+            if 'conversation_memory' in user_dict[user_id]:
+                user_dict[user_id]['conversation_memory'].reset()
         # if request.session['clear_chat_history']:
         #     chat_history = [chat_history[-1]]  # chat_history is a list with one element: user question
         #     request.session['clear_chat_history'] = False
@@ -310,31 +453,54 @@ async def stream_simplified_text(request: Request, generation_request: Generatio
         last_user_instruction = chat_history[-1]['content']
         print(f'Last user instruction: {last_user_instruction}')
 
-        formatted_question = f"""<s> [INST] {last_user_instruction} [/INST]"""
-
         # here for General Paraphrasing
-        prompt_key = request.session.get('prompt_key', 'General_Paraphrasing')
+        # the topic of the last upload, its classification may still be running
+        await wait_for_classification(user_id)
+        # prompt_key = request.session.get('prompt_key', 'General_Paraphrasing')
+        prompt_key = user_dict[user_id].get('prompt_key', 'General_Paraphrasing')
 
         if prompt_key == "General_Paraphrasing":
             # Use the general paraphrasing prompt
             print("General paraphrasing prompt will be used.")
-            general_prompt = get_general_paraphrasing_prompt()
-            prompt = f"{general_prompt} Now, follow the style of paraphrasing and simplification you learned from the given examples and then answer the following question accordingly! {formatted_question} User interest: {str(generation_request.user_info.interests)} [/INST]"
+            prompt = GENERAL_SIMPLIFY_TEMPLATE.render(
+                QUESTION=last_user_instruction,
+                INTERESTS=str(generation_request.user_info.interests)
+            )
         else:
-            # build all system prompts dynamically
-            topic_dict = build_all_system_prompts(base_folder='./dynamic_system_prompts')
+            # all topics, served from memory by the topic registry
+            topic_registry = models['topic_registry']
 
             # this is just debugging check, this condition must not apply because the support is dynamic
-            if request.session['prompt_key'] not in topic_dict.keys():
+            if prompt_key not in topic_registry.get_topics():
                 raise ValueError("The uploaded topic is not supported yet by our simplifier!!")
 
-            # set the corresponding system prompt
-            definition_instructions_examples_prompt = topic_dict[request.session['prompt_key']]
-            classified_system_prompt = definition_instructions_examples_prompt[3]
             print("classified_system_prompt will be used!!")
-            prompt = f"""{classified_system_prompt}{"Now, follow the style of paraphrasing and simplification you learned from the given examples and then answer the following question accordingly!"}{chat_history[:-1]}{formatted_question}{"User interest: " + str(generation_request.user_info.interests)}[/INST]"""
+            # the examples of the topic most similar to the question (embedding, runs in the executor)
+            loop = asyncio.get_running_loop()
+            examples = await loop.run_in_executor(None, models['example_selector'].select, prompt_key, last_user_instruction)
+            # last turns within the token budget and the rolling summary of the older turns, in ALLaM's chat format
+            if 'conversation_memory' not in user_dict[user_id]:
+                user_dict[user_id]['conversation_memory'] = ConversationMemory(
+                    summarize=lambda summary_prompt: summarize_conversation(summary_prompt, user_id=user_id))
+            previous_conversation = user_dict[user_id]['conversation_memory'].build_history(chat_history[:-1])
+            # the system prompt of the topic (instructions and examples), followed by the conversation
+            prompt = TOPIC_SIMPLIFY_TEMPLATE.render(
+                INSTRUCTIONS=topic_registry.get_instructions(prompt_key),
+                EXAMPLES=examples,
+                HISTORY=previous_conversation,
+                QUESTION=last_user_instruction,
+                INTERESTS=str(generation_request.user_info.interests)
+            )
 
-        gen = models['llm'].generate_text_stream(prompt=prompt)
+        # the generation stops when the client disconnects (e.g. the tab is closed mid-answer)
+        gen = stream_until_disconnect(
+            request,
+            models['llm'].stream(prompt, params=SIMPLIFY_PROFILE.params, profile=SIMPLIFY_PROFILE,
+                                 user_id=user_id, priority=INTERACTIVE),
+            'simplify', max_tokens=SIMPLIFY_PROFILE.max_new_tokens
+        )
+        # the model is unavailable: answered with 503 as long as the response has not started
+        gen = await start_stream(gen)
 
         # Append the response as assistant msg to the chat history for complete context
         # Capture the response from the stream
@@ -342,7 +508,7 @@ async def stream_simplified_text(request: Request, generation_request: Generatio
 
         async def event_generator():
             nonlocal full_response  # Capture the full response
-            async for chunk in AsyncIteratorWrapper(gen):
+            async for chunk in gen:
                 full_response += chunk  # Append each chunk to the full response
                 yield chunk
 
@@ -353,6 +519,8 @@ async def stream_simplified_text(request: Request, generation_request: Generatio
         })
 
         return StreamingResponse(event_generator(), media_type="text/plain")
+    except LLMUnavailableError:
+        raise
     except Exception as e:
         print(f'Error in /simplify/ endpoint: {e}')
         raise HTTPException(status_code=500, detail=str(e))
@@ -379,7 +547,7 @@ async def generate_image(request: Request, image_request: ImageRequest):
         text_to_image_prompt = image_request.prompt
 
         # Generate the image using the DALL·E 3 model
-        response = models['openai_client'].images.generate(
+        response = await models['openai_client'].images.generate(
             model="dall-e-3",
             prompt=text_to_image_prompt,
             size="1024x1024",
@@ -392,13 +560,13 @@ async def generate_image(request: Request, image_request: ImageRequest):
         print(f"Image URL: {image_url}")
 
         # Download the image and save it in the user's folder
-        image_response = requests.get(image_url)
+        image_response = await models['http'].get_client('downloads').get(image_url)
         if image_response.status_code == 200:
             # Generate a unique image filename
             image_filename = f"{uuid.uuid4()}.png"
             image_path = os.path.join(user_folder, image_filename)
-            with open(image_path, 'wb') as f:
-                f.write(image_response.content)
+            async with aiofiles.open(image_path, 'wb') as f:
+                await f.write(image_response.content)
             print(f"Image saved at: {image_path}")
         else:
             print("Failed to download the image")
@@ -431,51 +599,90 @@ async def upload_pdf(request: Request, file: UploadFile = File(...), user_info:
 
         # Important: here we initialize the user dictionary for first upload
         initialize_user_dict(user_id)
+        # the quizzes of the previous upload are replaced
+        previous_quiz_job = user_dict[user_id].pop('quiz_job', None)
+        if previous_quiz_job is not None:
+            previous_quiz_job.cancel()
+        # the topic of the previous upload must not be used for this one while it is classified
+        for key in ('classification_task', 'prompt_key', 'ref_knowledge_path'):
+            user_dict[user_id].pop(key, None)
 
         # Generate a unique filename to avoid conflicts
         unique_filename = f"{uuid.uuid4()}_{file.filename}"
         file_location = os.path.join(user_folder, unique_filename)
 
-        # Save the uploaded PDF file
-        with open(file_location, "wb") as file_object:
-            file_content = await file.read()
-            file_object.write(file_content)
+        # Save the uploaded PDF file, streamed in chunks and hashed on the fly
+        # (the request size is limited by the RequestSizeLimitMiddleware while the body is received)
+        upload_budget = UploadBudget(user_id, user_folder)
+        saved_upload = await save_upload_file(file, file_location, upload_budget)
+
+        # the same content uploaded again is stored once, the file of the previous upload is reused
+        previous_location = user_dict[user_id].get('learn_content_path')
+        if (user_dict[user_id].get('learn_content_sha256') == saved_upload.sha256 and previous_location
+                and os.path.exists(previous_location)):
+            os.remove(file_location)
+            file_location = previous_location
 
         # Store the path in the session (optional)
         # request.session['learn_content_path'] = file_location
         user_dict[user_id]['learn_content_path'] = file_location
-
-        # Step 1: Extract text and images from the PDF file
-        pdf_content, images, out_meta = convert_single_pdf(file_location, models['markdown'])
-
-        # Step 1.A: Classify system prompt
-        topic, ref_knowledge_path = classify_topic(pdf_content=pdf_content)
-        request.session['prompt_key'] = topic.strip()
-        # request.session['ref_knowledge_path'] = ref_knowledge_path
-        user_dict[user_id]['ref_knowledge_path'] = ref_knowledge_path
-
-        # Save images to static directory
-        user_images_folder = os.path.join('static', 'user_images', user_id)
-        os.makedirs(user_images_folder, exist_ok=True)
-
-        for image_name, image_obj in images.items():
-            image_path = os.path.join(user_images_folder, image_name)
-            image_obj.save(image_path)
-
-        # Step 2: Prepare the learning plan as an iterator response
-        # pass user info to create learning plan accordingly
-        openai_response = create_learning_plan(pdf_content, user_info_dict)
+        # the content hash identifies identical uploads
+        user_dict[user_id]['learn_content_sha256'] = saved_upload.sha256
+
+        # Step 1: Extract text and images from the PDF file page by page,
+        # the learning plan of the first pages is generated while the next pages are still converted
+        page_stream = stream_pdf_pages(file_location, models['pdf_extractor'], pages_per_batch=PDF_PAGES_PER_BATCH)
+        first_page_batch = await anext(page_stream)
+
+        # The upload pipeline runs as a small async DAG once the first pages are converted:
+        #   classification  (first pages)   -> topic, served by /classified-topic/
+        #   image optimization (per batch)  -> runs in the background, awaited before post-processing
+        #   learning plan streaming (per batch, in page order)
+        # Step 1.A: Classify system prompt (based on the first pages) without blocking the learning plan
+        classification_task = asyncio.create_task(classify_user_topic(user_id, first_page_batch.text))
+        user_dict[user_id]['classification_task'] = classification_task
+
+        async def page_batches():
+            try:
+                yield first_page_batch
+                async for page_batch in page_stream:
+                    yield page_batch
+            finally:
+                await page_stream.aclose()
 
         # Collect the learning plan as it's streamed
         learning_plan_buffer = []
 
         async def stream_learning_plan():
-            async for chunk in AsyncIteratorWrapper(openai_response):
-                delta = chunk.choices[0].delta
-                content = getattr(delta, 'content', '') or ''
-                learning_plan_buffer.append(content)
-                if content:  # Only yield if content is not empty
-                    yield content
+            # Step 2: Create the learning plan part by part, in page order
+            # pass user info to create learning plan accordingly
+            async for page_batch in page_batches():
+                # The learning plan references the optimized (and deduplicated) images by their content hash,
+                # the hashes are cheap, the encoding into the static directory runs while the model starts its answer
+                image_hashes = await hash_images(page_batch.images)
+                image_urls = {image_name: get_image_url(image_hash, page_batch.images[image_name].width)
+                              for image_name, image_hash in image_hashes.items()}
+                image_task = asyncio.create_task(optimize_images(page_batch.images, image_hashes))
+                page_content = replace_image_references(page_batch.text, image_urls)
+                if not page_batch.is_first:
+                    learning_plan_buffer.append(LEARNING_PLAN_SEPARATOR)
+                    yield LEARNING_PLAN_SEPARATOR
+
+                learning_plan_stream = create_learning_plan(page_content, user_info_dict,
+                                                            is_first_part=page_batch.is_first,
+                                                            is_last_part=page_batch.is_last,
+                                                            user_id=user_id)
+                try:
+                    async for content in learning_plan_stream:
+                        # the client renders the image URLs of the batch as soon as it gets the text,
+                        # the images have to be stored before
+                        if not image_task.done():
+                            await image_task
+                        learning_plan_buffer.append(content)
+                        yield content
+                    await image_task
+                finally:
+                    image_task.cancel()
 
             # After streaming is complete, do the following 3 post-processing:
             learning_plan = ''.join(learning_plan_buffer)
@@ -483,58 +690,176 @@ async def upload_pdf(request: Request, file: UploadFile = File(...), user_info:
             user_vector_db_path = os.path.join(user_folder, "user_vector_db")
             # request.session['user_vector_db_path'] = user_vector_db_path
             user_dict[user_id]['user_vector_db_path'] = user_vector_db_path
-            models['rag_system'].create_faiss_from_text(learning_plan, user_vector_db_path)
+            # the chunks are embedded (and the model loaded, the first time) in the executor, not on the event loop
+            await asyncio.get_running_loop().run_in_executor(None, models['rag_system'].create_faiss_from_text,
+                                                             learning_plan, user_vector_db_path)
             # 2. flag clear_chat_history when simplifying
             user_dict[user_id]['clear_chat_history'] = True
-            # 3. generate quiz for the chunks
-            learning_plan_chunks = learning_plan.split("\n\n---\n\n")
-            # 3.1 multiple-choice quiz
-            multiple_choice_quiz = generate_multiple_choice_quiz(learning_plan_chunks=learning_plan_chunks)
-            user_dict[user_id]['multiple_choice_quiz'] = multiple_choice_quiz
-            print("$$$$$ Multiple-choice Quiz is generated $$$$$")
-            # 3.2 free-text quiz
-            free_text_quiz = generate_free_text_quiz(learning_plan_chunks=learning_plan_chunks)
-            user_dict[user_id]['free_text_quiz'] = free_text_quiz
-            print("$$$$$ Free-text Quiz is generated $$$$$")
+            # 3. generate quiz for the chunks, in the background: the response closes with the learning plan,
+            # the quiz endpoints serve the questions as they are generated (/quiz-status/ tracks the job).
+            # In lazy mode a quiz is only generated when it is requested, many students never open one
+            learning_plan_chunks = learning_plan.split(LEARNING_PLAN_SEPARATOR)
+            quiz_job = QuizJob([MULTIPLE_CHOICE_QUIZ, FREE_TEXT_QUIZ], chunk_count=max(0, len(learning_plan_chunks) - 2),
+                               generate_questions=partial(generate_quiz, learning_plan_chunks=learning_plan_chunks,
+                                                          user_id=user_id),
+                               plan_hash=get_plan_hash(learning_plan), cache=models['quiz_cache'])
+            if not LAZY_QUIZZES:
+                quiz_job.request_quiz(MULTIPLE_CHOICE_QUIZ)
+                quiz_job.request_quiz(FREE_TEXT_QUIZ)
+            user_dict[user_id]['quiz_job'] = quiz_job
 
         # Prepare the response
-        response = StreamingResponse(stream_learning_plan(), media_type="text/plain")
-        response.headers['X-Classified-Topic'] = topic
-        response.headers['Access-Control-Expose-Headers'] = 'X-Classified-Topic'
+        # a client that disconnects stops the learning plan (and the GPT-4o stream) at once
+        # the first part of the learning plan is awaited, the model is unavailable: answered with 503
+        try:
+            learning_plan_stream = await start_stream(stream_until_disconnect(request, stream_learning_plan(),
+                                                                              'learning_plan'))
+        except BaseException:
+            # the upload failed: no topic is classified for it, and the conversion of the next pages is stopped
+            classification_task.cancel()
+            if user_dict[user_id].get('classification_task') is classification_task:
+                del user_dict[user_id]['classification_task']
+            await page_stream.aclose()
+            raise
+        response = StreamingResponse(learning_plan_stream, media_type="text/plain")
+        # The classified topic is not known yet, the client gets it from /classified-topic/
         # Add the user_id to the response headers
         response.headers['X-User-ID'] = user_id
-        response.headers['Access-Control-Expose-Headers'] = 'X-Classified-Topic, X-User-ID'
+        response.headers['Access-Control-Expose-Headers'] = 'X-User-ID'
         return response
+    except UploadTooLargeError as e:
+        print(f'Error in /upload-pdf/ endpoint: {e}')
+        raise HTTPException(status_code=413, detail=str(e))
+    except LLMUnavailableError:
+        raise
     except Exception as e:
         print(f'Error in /upload-pdf/ endpoint: {e}')
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def classify_user_topic(user_id, pdf_content):
+    """
+    Classifies the uploaded content and stores the topic and its reference knowledge for the user.
+    The topic is stored in the user dictionary, because the session cookie is already sent with the streamed response.
+    """
+    try:
+        topic, ref_knowledge_path = await classify_topic(pdf_content, user_id=user_id)
+    except Exception as e:
+        print(f'Error while classifying the topic: {e}')
+        topic = 'General_Paraphrasing'
+        ref_knowledge_path = models['topic_registry'].get_ref_knowledge_path(topic=topic)
+    # a newer upload replaced this one while it was classified, its topic is not stored
+    if user_dict[user_id].get('classification_task') is not asyncio.current_task():
+        return topic
+    user_dict[user_id]['prompt_key'] = topic.strip()
+    # request.session['ref_knowledge_path'] = ref_knowledge_path
+    user_dict[user_id]['ref_knowledge_path'] = ref_knowledge_path
+    return topic
+
+
+@app.get('/classified-topic/')
+async def get_classified_topic(request: Request):
+    """Returns the topic of the last upload, waits if the classification is still running."""
+    user_id = get_user_id(request=request)
+    if not user_exists_in_dict(user_id=user_id) or 'classification_task' not in user_dict[user_id]:
+        raise HTTPException(status_code=404, detail="No file has been uploaded yet!!")
+    classification_task = user_dict[user_id]['classification_task']
+    # a client that stops waiting does not cancel the classification
+    await asyncio.wait({classification_task})
+    if classification_task.cancelled():
+        # the upload failed after the classification was started
+        raise HTTPException(status_code=404, detail="No file has been uploaded yet!!")
+    return {'topic': classification_task.result()}
+
+
 @app.get('/topics/')
 def get_topics():
-    topics = get_all_topics('./dynamic_system_prompts')
+    topics = models['topic_registry'].get_topics()
     topics.append('General_Paraphrasing')  # Include General_Paraphrasing in the list
     return {'topics': topics}
 
 
+async def get_quiz(user_id, quiz_type, wait):
+    """
+    The questions of a quiz that are generated so far, in chunk order, and whether the quiz is complete.
+    The first request of a quiz starts its generation, with `wait` the response waits until the quiz is complete.
+    Before the learning plan is complete, the quiz is empty and its status is 'not_started'.
+    """
+    quiz_job = user_dict.get(user_id, {}).get('quiz_job')
+    if quiz_job is None:
+        return {'quiz': [], 'complete': False, 'status': 'not_started'}
+    quiz_job.request_quiz(quiz_type)
+    if wait:
+        await quiz_job.wait_for_quiz(quiz_type)
+    return {'quiz': quiz_job.get_questions(quiz_type), 'complete': quiz_job.is_complete(quiz_type),
+            'status': quiz_job.status}
+
+
+async def get_quiz_question(user_id, quiz_type, chunk_index):
+    """The question of one chunk, generated on the first request; the next chunk is generated ahead."""
+    quiz_job = user_dict.get(user_id, {}).get('quiz_job')
+    if quiz_job is None:
+        raise HTTPException(status_code=404, detail="The learning plan is not complete yet")
+    try:
+        question = await quiz_job.get_question(quiz_type, chunk_index)
+    except IndexError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    if question is None:
+        raise HTTPException(status_code=503, detail="The question could not be generated, please try again")
+    return {'question': question, 'chunk_index': chunk_index, 'total': quiz_job.chunk_count}
+
+
+# a client that asks once gets the complete quiz, a client that polls with wait=false until `complete` shows the
+# questions as they are generated
 @app.get('/multiple-choice-quiz/')
-def get_multiple_choice_quiz(request: Request):
+async def get_multiple_choice_quiz(request: Request, wait: bool = True):
     user_id = get_user_id(request=request)
-    quiz = []
-    if 'multiple_choice_quiz' in user_dict[user_id]:
-        quiz = user_dict[user_id]['multiple_choice_quiz']
+    return await get_quiz(user_id, MULTIPLE_CHOICE_QUIZ, wait)
+
 
-    return {'quiz': quiz}
+@app.get('/multiple-choice-quiz/{chunk_index}')
+async def get_multiple_choice_question(request: Request, chunk_index: int):
+    user_id = get_user_id(request=request)
+    return await get_quiz_question(user_id, MULTIPLE_CHOICE_QUIZ, chunk_index)
 
 
 @app.get('/free-text-quiz/')
-def get_free_text_quiz(request: Request):
+async def get_free_text_quiz(request: Request, wait: bool = True):
+    user_id = get_user_id(request=request)
+    return await get_quiz(user_id, FREE_TEXT_QUIZ, wait)
+
+
+@app.get('/free-text-quiz/{chunk_index}')
+async def get_free_text_question(request: Request, chunk_index: int):
     user_id = get_user_id(request=request)
-    quiz = []
-    if 'free_text_quiz' in user_dict[user_id]:
-        quiz = user_dict[user_id]['free_text_quiz']
+    return await get_quiz_question(user_id, FREE_TEXT_QUIZ, chunk_index)
+
+
+@app.get('/quiz-status/')
+def get_quiz_status(request: Request):
+    """Progress of the quiz generation of the last upload: ready, failed and total questions per quiz."""
+    user_id = get_user_id(request=request)
+    if not user_exists_in_dict(user_id=user_id) or 'learn_content_path' not in user_dict[user_id]:
+        raise HTTPException(status_code=404, detail="No file has been uploaded yet!!")
+    quiz_job = user_dict[user_id].get('quiz_job')
+    if quiz_job is None:
+        # the learning plan is still generated
+        return {'status': 'not_started', 'quizzes': {}}
+    return quiz_job.get_status()
+
 
-    return {'quiz': quiz}
+QUIZ_EVALUATION_TEMPLATE = PromptTemplate('quiz_evaluation', get_quiz_evaluator_instructions() + """<<EXAMPLES>>
+Now, evaluate the given Answer and Ground Truth accordingly!
+Follow the example you learned and give the 'التقدير' and the 'تفسير التقدير'. Answer in Arabic. Here are the Answer and Ground Truth:
+Answer:
+<<ANSWER>>
+Ground Truth:
+<<GROUND_TRUTH>>
+[/INST]""", slot_policies={
+    'EXAMPLES': SlotPolicy(DROP_EXAMPLES, separator=''),
+    'ANSWER': SlotPolicy(TRUNCATE),
+    'GROUND_TRUTH': SlotPolicy(TRUNCATE),
+}, max_new_tokens=EVALUATION_PROFILE.max_new_tokens)
 
 
 @app.post('/evaluate-text-quiz/')
@@ -544,73 +869,88 @@ async def evaluate_text_quiz(request: Request):
     answer = data.get('answer', '')
     ground_truth = data.get('ground_truth', '')
 
-    # Get the system prompt
-    system_prompt = get_quiz_evaluator_prompt()
+    # the evaluation examples most similar to the answer and the ground truth
+    loop = asyncio.get_running_loop()
+    examples = await loop.run_in_executor(None, models['evaluator_example_selector'].select,
+                                          'quiz_evaluation', f"{answer}\n{ground_truth}")
 
     # Prepare the prompt
-    prompt = f"""{system_prompt}
-Now, evaluate the given Answer and Ground Truth accordingly!
-Follow the example you learned and give the 'التقدير' and the 'تفسير التقدير'. Answer in Arabic. Here are the Answer and Ground Truth:
-Answer:
-{answer}
-Ground Truth:
-{ground_truth}
-[/INST]"""
+    prompt = QUIZ_EVALUATION_TEMPLATE.render(EXAMPLES=examples, ANSWER=answer, GROUND_TRUTH=ground_truth)
 
-    # Generate the evaluation using your LLM model
-    evaluation = models['llm'].generate(prompt=prompt)['results'][0]['generated_text'].strip()
+    # Generate the evaluation using your LLM model, it ends with the result line of the explanation
+    evaluation = (await models['llm'].generate(prompt, params=EVALUATION_PROFILE.params,
+                                               is_complete=EVALUATION_PROFILE.get_validator(), profile=EVALUATION_PROFILE,
+                                               user_id=get_user_id(request), priority=EVALUATION)).strip()
 
     return {'evaluation': evaluation}
 
 
 @app.post('/confirm-topic/')
 async def confirm_topic(request: Request, topic: str = Form(...)):
-    request.session['prompt_key'] = topic.strip()
-    if topic == 'General_Paraphrasing':
-        ref_knowledge_path = "./RAG_DB/General_Reference-VS"
-    else:
-        ref_knowledge_path = get_ref_knowledge_path(path="./dynamic_system_prompts", topic=topic)
+    # request.session['prompt_key'] = topic.strip()
+    ref_knowledge_path = models['topic_registry'].get_ref_knowledge_path(topic=topic.strip())
 
     # request.session['ref_knowledge_path'] = ref_knowledge_path
     user_id = get_user_id(request=request)
     # double check, actually, at this point, user must be surl in dictionary..
     initialize_user_dict(user_id=user_id)
 
+    # wait for a running classification, otherwise it would overwrite the confirmed topic
+    await wait_for_classification(user_id)
+    user_dict[user_id]['prompt_key'] = topic.strip()
     user_dict[user_id]['ref_knowledge_path'] = ref_knowledge_path
     return {'message': 'Topic confirmed and session updated.'}
 
 
-def classify_topic(pdf_content):
+CLASSIFIER_TEMPLATE = PromptTemplate(
+    'classifier',
+    "<<CLASSIFIER_PROMPT>>Now, follow the given examples and classify the following content accordingly!<<DOCUMENT>>[/INST]",
+    slot_policies={'DOCUMENT': SlotPolicy(TRUNCATE)},
+    max_new_tokens=CLASSIFICATION_PROFILE.max_new_tokens
+)
+
+
+async def classify_topic(pdf_content, user_id=None):
     """
     This functions classifies the given pdf_content into the corresponding system prompt.
+    :param user_id: the user of the upload, for the LLM scheduling
     :return:
     """
-    # Dynamic prompt classifier
-    system_prompt = get_dynamic_classifier_prompt(base_folder="./dynamic_system_prompts")
-    prompt = f"""{system_prompt}{"Now, follow the given examples and classify the following content accordingly!"}{pdf_content}[/INST]"""
-    topic = models['llm'].generate(prompt=prompt)['results'][0]['generated_text'].strip()
+    # Fast path: embedding similarity of sampled passages to the topic centroids (runs in the executor)
+    loop = asyncio.get_running_loop()
+    topic, topic_scores = await loop.run_in_executor(None, models['topic_classifier'].classify, pdf_content)
+    print('Embedding classifier scores: {}'.format(topic_scores))
 
-    # these changes for General Paraphrasing feature
-    topic = topic.replace(".", "").strip()
     # Get the list of known topics
-    known_topics = get_all_topics(base_folder='./dynamic_system_prompts')
+    known_topics = models['topic_registry'].get_topics()
     known_topics.append('General_Paraphrasing')
 
+    if topic is None:
+        # Not confident enough: fall back to the dynamic prompt classifier (ALLaM)
+        system_prompt = models['topic_registry'].get_classifier_prompt()
+        # only representative passages within a fixed token budget, so the prompt size does not grow with the document
+        document_sample = sample_document(pdf_content)
+        prompt = CLASSIFIER_TEMPLATE.render(CLASSIFIER_PROMPT=system_prompt, DOCUMENT=document_sample)
+        # the generation ends as soon as a known topic label is written
+        topic = (await models['llm'].generate(prompt, params=CLASSIFICATION_PROFILE.params,
+                                              is_complete=CLASSIFICATION_PROFILE.get_validator(get_topic_label_validator(known_topics)),
+                                              profile=CLASSIFICATION_PROFILE, user_id=user_id, priority=EVALUATION)).strip()
+
+        print("$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$")
+        print("Prompt Classifier: {}".format(prompt))
+        print("$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$")
+
+    # these changes for General Paraphrasing feature
+    topic = topic.replace(".", "").strip()
+
     # Validate the topic
     if topic not in known_topics:
         topic = 'General_Paraphrasing'
 
     # Set the reference knowledge path
-    if topic == 'General_Paraphrasing':
-        ref_knowledge_path = "./RAG_DB/General_Reference-VS"
-    else:
-        ref_knowledge_path = get_ref_knowledge_path(path="./dynamic_system_prompts", topic=topic)
+    ref_knowledge_path = models['topic_registry'].get_ref_knowledge_path(topic=topic)
     print('ref_knowledge_path: {}'.format(ref_knowledge_path))
 
-    print("$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$")
-    print("Prompt Classifier: {}".format(prompt))
-    print("$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$$")
-
     print("###############################")
     print("Classified Topic: {}".format(topic))
     print("###############################")
@@ -618,28 +958,13 @@ def classify_topic(pdf_content):
     return topic, ref_knowledge_path
 
 
-def get_all_topics(base_folder):
-    topics = []
-    for folder_name in os.listdir(base_folder):
-        if folder_name == '__pycache__':
-            continue
-        full_folder_path = os.path.join(base_folder, folder_name)
-        if os.path.isdir(full_folder_path):
-            topics.append(folder_name)
-    return topics
-
-
-def get_ref_knowledge_path(path, topic):
-    for folder_name in os.listdir(path):
-        if folder_name == '___pycache__':
-            continue
-        full_folder_path = os.path.join(path, folder_name)
-        if not os.path.isdir(full_folder_path):
-            continue
-        if folder_name in topic:
-            ref_vs_path = os.path.join(full_folder_path, 'References-VS')
-            return ref_vs_path
-    return None
+async def summarize_conversation(prompt, user_id=None):
+    """
+    Generates the rolling summary of the conversation memory with ALLaM (runs in the background).
+    :return: the summary
+    """
+    return await models['llm'].generate(prompt, params={'max_new_tokens': SUMMARY_MAX_NEW_TOKENS},
+                                        user_id=user_id, priority=BACKGROUND)
 
 
 def create_markdown_learning_plan(learning_plan_json):
@@ -684,7 +1009,13 @@ def fix_arabic_numbers_and_words(text):
     return fixed_text
 
 
-def create_learning_plan(content, user_info_dict):
+def create_learning_plan(content, user_info_dict, is_first_part=True, is_last_part=True, user_id=None):
+    """
+    Streams a learning plan for the given content with GPT-4o.
+    Long documents are converted and planned part by part, so the flags tell the model whether
+    this part has to start with the introduction and/or end with the summary of the whole plan.
+    :return: async iterator over the streamed text chunks
+    """
     try:
         teaching_style = user_info_dict.get('teaching_style', 'Neutral')
         explanation_complexity = user_info_dict.get('explanation_complexity', 'Middle School (Ages 11-14)')
@@ -708,6 +1039,16 @@ def create_learning_plan(content, user_info_dict):
         teaching_style_instruction = teaching_styles_descriptions.get(teaching_style, '')
         explanation_complexity_instruction = explanation_complexities_descriptions.get(explanation_complexity, '')  # not used now
 
+        # introduction and summary only belong to the first and the last part of the learning plan
+        if is_first_part and is_last_part:
+            structure_instruction = "Begin with a short introduction of the content, written by you, and end with a short summary, also written by you."
+        elif is_first_part:
+            structure_instruction = "This content is the first part of a longer document that continues later. Begin with a short introduction of the content, written by you, but do not write a summary."
+        elif is_last_part:
+            structure_instruction = "This content is the last part of a longer document whose introduction was already written. Do not write an introduction, but end with a short summary, written by you."
+        else:
+            structure_instruction = "This content is a middle part of a longer document whose introduction was already written. Do not write an introduction or a summary."
+
         # system prompt
         system_prompt = f"""
         You are an expert curriculum designer. Your task is to create a structured learning plan from the given content, and you must use **markdown** to highlight key elements. Always structure the content into logical sections, each containing 200-300 words, and keep the original sequence intact for coherent learning.
@@ -717,14 +1058,14 @@ Teaching Style:
 {teaching_style_instruction}
 
 **Important Guidelines:**
-1. **Introduction and Summary**: Begin with a short introduction of the content, written by you, and end with a short summary, also written by you. These sections should clearly indicate that they are your own text, using a distinct markdown format.
+1. **Introduction and Summary**: {structure_instruction} These sections should clearly indicate that they are your own text, using a distinct markdown format.
 2. **Chunk Separation**: Use the separator `\n\n---\n\n` to split between content chunks.
 3. **Use Markdown Features**:
    - **Bold**: Highlight main terms using bold text.
    - **Headings**: Use small headings to organize information.
    - **Tables**: Include at least one table to display data clearly.
    - **Quotes**: Use blockquotes to emphasize important points.
-4. **Images**: If there are images in the markdown file, shown like this `![image_name](image_name)`, you must include them in the learning plan. Ensure the images are meaningfully integrated into the corresponding section, and explain their relevance.
+4. **Images**: If there are images in the markdown file, shown like this `![image_name](image_path)`, you must include them in the learning plan with exactly the same image path. Ensure the images are meaningfully integrated into the corresponding section, and explain their relevance.
 5. **Language**: Always write in **Arabic**; do not use any English.
 6. **Integration Example**: If you add your own text, display it under the respective section, clearly marking it as additional content, so the user knows it’s not part of the original material.
 7. **Mathematical Formulas**: If there are formulas also add them and use the latex notation with `$<formula>$` or `$$<block_formula>$$`.
@@ -743,15 +1084,10 @@ Ensure the content is engaging, well-organized, and visually appealing using the
                 {content}
                 """
 
-        openai_response = models['openai_client'].chat.completions.create(
-            model="gpt-4o",
-            temperature=0.1,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            stream=True
-        )
+        learning_plan_stream = models['learning_plan_llm'].stream([
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ], user_id=user_id, priority=INTERACTIVE)
 
         # learning_plan = completion.choices[0].message.content
         #
@@ -761,7 +1097,7 @@ Ensure the content is engaging, well-organized, and visually appealing using the
         #
         # return learning_plan
 
-        return openai_response  # 'response' is an iterator over the streamed chunks
+        return learning_plan_stream  # async iterator over the streamed text chunks
     except Exception as e:
         print(f"Error creating learning plan: {e}")
         raise
@@ -783,47 +1119,185 @@ def save_learning_plan_to_json(learning_plan, output_file):
         raise
 
 
-def generate_multiple_choice_quiz(learning_plan_chunks):
+async def summarize_text(text, max_tokens):
     """
-    this function uses ALLaM to generate multiple choice quiz from the learning plan chucks
-    :param learning_plan_chunks: introduction chuck, learning chunks, and a summary chunk
-    :return: quiz, one multiple-choice question per chunk
+    Summarizes a text that does not fit into its prompt slot with ALLaM.
+    :return: the summary, at most max_tokens long
     """
-    content_chunks = learning_plan_chunks[1:-1]
-    generated_questions = []
-    system_prompt = """<s> [INST]
+    prompt = f"<s> [INST] Summarize the following text in Arabic, keep its main ideas and key facts:\n{text} [/INST]"
+    return (await models['llm'].generate(prompt, params={'max_new_tokens': max_tokens}, priority=BACKGROUND)).strip()
+
+
+# a learning plan chunk that is too long is summarized, the questions are about its main idea
+MULTIPLE_CHOICE_QUIZ_TEMPLATE = PromptTemplate('quiz_multiple_choice', """<s> [INST]
     You are an AI-powered quiz generator. Your task is to generate one multiple-choice question from the given text in Arabic language. 
     Concretely, You should generate a multiple-choice question about the main idea of the given text, and generate 3-4 potential answers, and mark the correct ones.
     Important: generate always in Arabic, never generate in English.
+    
+         Now, generate a multiple-choice question for the following text accordingly! This is the text:
+        <<CHUNK>>[/INST]""", slot_policies={'CHUNK': SlotPolicy(SUMMARIZE, summarize=summarize_text)},
+    max_new_tokens=MULTIPLE_CHOICE_QUIZ_PROFILE.max_new_tokens)
+
+FREE_TEXT_QUIZ_TEMPLATE = PromptTemplate('quiz_free_text', get_free_text_quiz_prompt() + """
+         Important: generate in Arabic language, never user English.
+        Now, generate a free-text question for the following text accordingly! This is the text:
+        <<CHUNK>>[/INST]""", slot_policies={'CHUNK': SlotPolicy(SUMMARIZE, summarize=summarize_text)},
+    max_new_tokens=FREE_TEXT_QUIZ_PROFILE.max_new_tokens)
+
+# several chunks per call, the instructions and the example are sent once; the chunks are grouped so that they fit
+# (the TRUNCATE policy only guards the context window, the items of cut chunks are generated one by one)
+_QUIZ_BATCH_FORMAT = """
+    You get <<COUNT>> numbered texts, each starts with a line "### <number>". Write the question of every text in the same order,
+    start each question with the line "### <number>" of its text, and do not write anything else.
+    These are the texts:
+<<CHUNKS>>[/INST]"""
+
+MULTIPLE_CHOICE_QUIZ_BATCH_TEMPLATE = PromptTemplate('quiz_multiple_choice_batch', """<s> [INST]
+    You are an AI-powered quiz generator. Your task is to generate one multiple-choice question for each of the given texts in Arabic language. 
+    Concretely, You should generate a multiple-choice question about the main idea of each text, and generate 3-4 potential answers, and mark the correct ones.
+    Important: generate always in Arabic, never generate in English.
+    """ + _QUIZ_BATCH_FORMAT, slot_policies={'CHUNKS': SlotPolicy(TRUNCATE)},
+    max_new_tokens=MULTIPLE_CHOICE_QUIZ_PROFILE.for_batch(QUIZ_BATCH_SIZE).max_new_tokens)
+
+FREE_TEXT_QUIZ_BATCH_TEMPLATE = PromptTemplate('quiz_free_text_batch', get_free_text_quiz_prompt() + """
+         Important: generate in Arabic language, never user English.
+        Now, generate a free-text question followed by its answer for each of the following texts accordingly!""" +
+    _QUIZ_BATCH_FORMAT, slot_policies={'CHUNKS': SlotPolicy(TRUNCATE)},
+    max_new_tokens=FREE_TEXT_QUIZ_PROFILE.for_batch(QUIZ_BATCH_SIZE).max_new_tokens)
+
+
+async def generate_quiz_questions(template, profile, learning_plan_chunks, user_id=None,
+                                  concurrency=QUIZ_GENERATION_CONCURRENCY, on_question=None,
+                                  batch_template=None, is_valid=None, batch_size=QUIZ_BATCH_SIZE, indices=None):
+    """
+    Generates one question per content chunk of the learning plan with ALLaM, up to `concurrency` calls at the same
+    time. With a batch template, up to `batch_size` chunks share one call; the questions that are missing or invalid
+    in its output are generated one by one. A chunk whose question fails is left out (and counted in the metrics),
+    the other questions keep the chunk order.
+    :param template: the prompt template of the question, with a CHUNK slot
+    :param profile: the generation profile of the question
+    :param learning_plan_chunks: introduction chuck, learning chunks, and a summary chunk
+    :param user_id: the user of the learning plan, for the LLM scheduling
+    :param concurrency: maximum number of calls at the same time
+    :param on_question: called with the chunk index and the question (None if it failed) as soon as it is done
+    :param batch_template: the prompt template of a batch, with COUNT and CHUNKS slots (None: no batches)
+    :param is_valid: validator of a single question of a batch
+    :param batch_size: maximum number of chunks per call
+    :param indices: the indices of the content chunks whose questions are generated (None: all chunks)
+    :return: the questions, in chunk order
     """
-    for chunk in content_chunks:
-        prompt = f"""{system_prompt}
-        {" Now, generate a multiple-choice question for the following text accordingly! This is the text:"}
-        {chunk}[/INST]"""
-        question = models['llm'].generate(prompt=prompt)['results'][0]['generated_text'].strip()
-        generated_questions.append(question)
+    content_chunks = learning_plan_chunks[1:-1]
+    if indices is None:
+        indices = range(len(content_chunks))
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def generate_batch(indices):
+        if len(indices) == 1:
+            return [await generate_question(indices[0], content_chunks[indices[0]])]
+        batch_profile = profile.for_batch(len(indices), stop_sequence=get_batch_stop_sequence(len(indices)))
+        try:
+            async with semaphore:
+                prompt = await batch_template.render_async(
+                    COUNT=len(indices), CHUNKS=format_quiz_batch([content_chunks[index] for index in indices]))
+                text = await models['llm'].generate(prompt, params=batch_profile.params, profile=batch_profile,
+                                                    user_id=user_id, priority=BACKGROUND)
+            items = parse_quiz_batch(text, len(indices), is_valid)
+        except Exception as e:
+            print(f'{batch_profile.name} of chunks {indices[0] + 1}-{indices[-1] + 1} failed: {e!r}')
+            items = [None] * len(indices)
+        metrics.increment(f'quiz_batches.{profile.name}.calls')
+        fallback_indices = []
+        for index, item in zip(indices, items):
+            if item is None:
+                fallback_indices.append(index)
+            elif on_question is not None:
+                on_question(index, item)
+        metrics.increment(f'quiz_batches.{profile.name}.fallbacks', len(fallback_indices))
+        # the missing questions are generated one by one, with the full slot policies (e.g. summaries)
+        fallback_questions = await asyncio.gather(*(generate_question(index, content_chunks[index])
+                                                    for index in fallback_indices))
+        questions = dict(zip(indices, items))
+        questions.update(zip(fallback_indices, fallback_questions))
+        return [questions[index] for index in indices]
+
+    async def generate_question(index, chunk):
+        try:
+            async with semaphore:
+                prompt = await template.render_async(CHUNK=chunk)
+                question = (await models['llm'].generate(prompt, params=profile.params,
+                                                         is_complete=profile.get_validator(), profile=profile,
+                                                         user_id=user_id, priority=BACKGROUND)).strip()
+        except Exception as e:
+            print(f'{profile.name} question of chunk {index + 1} failed: {e!r}')
+            metrics.increment(f'quiz_generation.{profile.name}.failed')
+            question = None
+        if on_question is not None:
+            on_question(index, question)
+        return question
+
+    start = time.perf_counter()
+    if batch_template is not None and batch_size > 1:
+        # the chunks of a batch and its item headers fill the CHUNKS slot
+        token_budget = batch_template.token_budget - batch_template.literal_tokens
+        batches = group_chunks([content_chunks[index] for index in indices], batch_size, token_budget)
+        batch_questions = await asyncio.gather(*(generate_batch([indices[position] for position in batch])
+                                                 for batch in batches))
+        questions = [question for batch in batch_questions for question in batch]
+    else:
+        questions = await asyncio.gather(*(generate_question(index, content_chunks[index]) for index in indices))
+    metrics.observe(f'quiz_generation.{profile.name}.seconds', time.perf_counter() - start)
+    return [question for question in questions if question is not None]
+
 
-    return generated_questions
+async def generate_multiple_choice_quiz(learning_plan_chunks, user_id=None, on_question=None, indices=None):
+    """
+    this function uses ALLaM to generate multiple choice quiz from the learning plan chucks
+    :param learning_plan_chunks: introduction chuck, learning chunks, and a summary chunk
+    :param user_id: the user of the learning plan, for the LLM scheduling
+    :param on_question: called with the chunk index and the question as soon as it is done
+    :param indices: the content chunks to generate questions for (None: all chunks)
+    :return: quiz, one multiple-choice question per chunk
+    """
+    return await generate_quiz_questions(MULTIPLE_CHOICE_QUIZ_TEMPLATE, MULTIPLE_CHOICE_QUIZ_PROFILE,
+                                         learning_plan_chunks, user_id=user_id, on_question=on_question,
+                                         indices=indices,
+                                         batch_template=MULTIPLE_CHOICE_QUIZ_BATCH_TEMPLATE,
+                                         is_valid=is_multiple_choice_question_valid)
 
 
-def generate_free_text_quiz(learning_plan_chunks):
+async def generate_free_text_quiz(learning_plan_chunks, user_id=None, on_question=None, indices=None):
     """
     this function uses ALLaM to generate free-text quiz from the learning plan chucks
     :param learning_plan_chunks: introduction chuck, learning chunks, and a summary chunk
+    :param user_id: the user of the learning plan, for the LLM scheduling
+    :param on_question: called with the chunk index and the question as soon as it is done
+    :param indices: the content chunks to generate questions for (None: all chunks)
     :return: quiz, one free-text question per chunk
     """
-    content_chunks = learning_plan_chunks[1:-1]
-    generated_questions = []
-    system_prompt = get_free_text_quiz_prompt()
-    for chunk in content_chunks:
-        prompt = f"""{system_prompt}
-        {" Important: generate in Arabic language, never user English."}
-        {"Now, generate a free-text question for the following text accordingly! This is the text:"}
-        {chunk}[/INST]"""
-        question = models['llm'].generate(prompt=prompt)['results'][0]['generated_text'].strip()
-        generated_questions.append(question)
+    return await generate_quiz_questions(FREE_TEXT_QUIZ_TEMPLATE, FREE_TEXT_QUIZ_PROFILE,
+                                         learning_plan_chunks, user_id=user_id, on_question=on_question,
+                                         indices=indices,
+                                         batch_template=FREE_TEXT_QUIZ_BATCH_TEMPLATE,
+                                         is_valid=is_free_text_question_valid)
 
-    return generated_questions
+
+async def generate_quiz(quiz_type, indices, on_question, learning_plan_chunks, user_id=None):
+    """
+    Generates the questions of a quiz for some chunks of a learning plan, the generate_questions of its quiz job.
+    :param quiz_type: MULTIPLE_CHOICE_QUIZ or FREE_TEXT_QUIZ
+    :param indices: the content chunks to generate questions for
+    :param on_question: called with the chunk index and the question as soon as it is done
+    :param learning_plan_chunks: introduction chuck, learning chunks, and a summary chunk
+    :param user_id: the user of the learning plan, for the LLM scheduling
+    """
+    generate = generate_multiple_choice_quiz if quiz_type == MULTIPLE_CHOICE_QUIZ else generate_free_text_quiz
+    await generate(learning_plan_chunks, user_id=user_id, on_question=on_question, indices=indices)
+
+
+@app.get('/metrics/')
+def get_metrics():
+    """Counters and summaries of the API, e.g. the token counts of the prompt slots."""
+    return metrics.snapshot()
 
 
 # New endpoint for text-to-speech synthesis
@@ -845,8 +1319,9 @@ async def synthesize_speech(request: SynthesizeRequest):
         speech_synthesizer = speechsdk.SpeechSynthesizer(speech_config=models['speech_config'],
                                                          audio_config=audio_output_config)
 
-        # Synthesize speech
-        result = speech_synthesizer.speak_text_async(text).get()
+        # Synthesize speech, the Speech SDK blocks until the audio is written
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(None, lambda: speech_synthesizer.speak_text_async(text).get())
 
         if result.reason == speechsdk.ResultReason.SynthesizingAudioCompleted:
             # Read the audio file and return it
@@ -894,6 +1369,11 @@ async def add_topic(
         if errors:
             return JSONResponse(content={'error': 'Validation errors', 'details': errors}, status_code=400)
 
+        # The request size is limited by the RequestSizeLimitMiddleware; the references are stored with the topic,
+        # the user limit only counts them while they are written
+        user_id = get_user_id(request)
+        upload_budget = UploadBudget(user_id, get_user_folder(user_id))
+
         # Sanitize topic_name to prevent directory traversal
         sanitized_topic_name = "".join(c for c in topic_name if c.isalnum() or c in (' ', '_', '-')).rstrip()
 
@@ -939,9 +1419,12 @@ async def add_topic(
             references_dir = os.path.join(topic_dir, 'References')
             os.makedirs(references_dir)
             for file in references:
-                file_location = os.path.join(references_dir, file.filename)
-                with open(file_location, "wb") as buffer:
-                    shutil.copyfileobj(file.file, buffer)
+                file_location = os.path.join(references_dir, os.path.basename(file.filename))
+                await save_upload_file(file, file_location, upload_budget)
+        except UploadTooLargeError as e:
+            # remove the incomplete topic, otherwise it would be listed without references
+            shutil.rmtree(topic_dir, ignore_errors=True)
+            return JSONResponse(content={'error': str(e)}, status_code=413)
         except Exception as e:
             return JSONResponse(content={'error': f'Failed to save reference files: {str(e)}'}, status_code=500)
 
@@ -950,17 +1433,18 @@ async def add_topic(
             # Define the embeddings path
             references_vs_dir = os.path.join(topic_dir, 'References-VS')
 
-            # Initialize the embedding model
-            embedding_model_id = "intfloat/multilingual-e5-large"
-            embedding_model = SentenceTransformerEmbeddings(model_name=embedding_model_id)
-
-            # Create the vector store
-            vectorstore = PDFVectorStore(embedding_model, embeddings_path=references_vs_dir)
-            vectorstore.add_pdf_folder_to_vectorstore(references_dir)
+            # Create the vector store with the globally shared embedding model,
+            # the references are embedded in the executor, not on the event loop
+            vectorstore = PDFVectorStore(models['embedding_model'], embeddings_path=references_vs_dir)
+            await asyncio.get_running_loop().run_in_executor(None, vectorstore.add_pdf_folder_to_vectorstore,
+                                                             references_dir)
 
         except Exception as e:
             return JSONResponse(content={'error': f'Failed to create vector store for references: {str(e)}'}, status_code=500)
 
+        # reload the topics, this also rebuilds the topic centroids of the classifier
+        models['topic_registry'].invalidate()
+
         # Return success message
         return {"message": f'The topic "{topic_name}" has been added successfully.'}
 
@@ -986,9 +1470,10 @@ async def transcribe_audio(request: Request, file: UploadFile = File(...)):
         os.system(command)
 
         # Use Whisper to transcribe the WAV file
-        with open(wav_filepath, 'rb') as audio_file:
-            transcript = models['openai_client'].audio.transcriptions.create(
-                file=audio_file,
+        async with aiofiles.open(wav_filepath, 'rb') as audio_file:
+            audio = await audio_file.read()
+            transcript = await models['openai_client'].audio.transcriptions.create(
+                file=(os.path.basename(wav_filepath), audio),
                 model="whisper-1",
                 language='ar',  # Specify Arabic language
                 response_format="text",
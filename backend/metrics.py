@@ -0,0 +1,71 @@
+"""
+In-process metrics of the API (counters, gauges and summaries of observed values), served by GET /metrics/.
+"""
+import math
+import threading
+from collections import deque
+
+# Number of recent observations per summary that are kept for the percentiles
+MAX_SAMPLES = 1000
+
+
+def _percentile(sorted_values, percentile):
+    index = max(0, math.ceil(percentile / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+class Metrics:
+    def __init__(self, max_samples=MAX_SAMPLES):
+        self.max_samples = max_samples
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._summaries = {}
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def set_gauge(self, name, value):
+        """Sets a current value, e.g. a queue depth."""
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name, value):
+        """Records one observation, e.g. a token count or a latency in seconds."""
+        with self._lock:
+            summary = self._summaries.get(name)
+            if summary is None:
+                summary = {'count': 0, 'sum': 0.0, 'max': value, 'samples': deque(maxlen=self.max_samples)}
+                self._summaries[name] = summary
+            summary['count'] += 1
+            summary['sum'] += value
+            summary['max'] = max(summary['max'], value)
+            summary['samples'].append(value)
+
+    def get_percentile(self, name, percentile, min_samples=1):
+        """Percentile of the recent observations, None with fewer than `min_samples` observations."""
+        with self._lock:
+            summary = self._summaries.get(name)
+            if summary is None or len(summary['samples']) < max(1, min_samples):
+                return None
+            return _percentile(sorted(summary['samples']), percentile)
+
+    def snapshot(self):
+        with self._lock:
+            summaries = {}
+            for name, summary in self._summaries.items():
+                samples = sorted(summary['samples'])
+                summaries[name] = {
+                    'count': summary['count'],
+                    'mean': summary['sum'] / summary['count'],
+                    'p50': _percentile(samples, 50),
+                    'p95': _percentile(samples, 95),
+                    'p99': _percentile(samples, 99),
+                    'max': summary['max'],
+                }
+            return {'counters': dict(self._counters), 'gauges': dict(self._gauges), 'summaries': summaries}
+
+
+# metrics of the running API
+metrics = Metrics()
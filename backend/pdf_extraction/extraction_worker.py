@@ -0,0 +1,63 @@
+# General packages
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+# marker models of the current worker process, loaded on the first conversion
+_worker_models = None
+
+
+def _convert_in_worker(pdf_path: str, start_page: int, max_pages: int):
+    """
+    Runs inside the worker process: loads the marker layout/OCR models once and converts the requested pages.
+    marker is imported here on purpose, so the API process never loads torch and the models.
+    """
+    global _worker_models
+    from marker.convert import convert_single_pdf
+    from marker.models import load_all_models
+
+    if _worker_models is None:
+        print("PDF extraction worker: loading marker models")
+        _worker_models = load_all_models()
+
+    return convert_single_pdf(pdf_path, _worker_models, max_pages=max_pages, start_page=start_page)
+
+
+class PDFExtractionWorker:
+    def __init__(self, max_workers: int = 1):
+        """
+        Local pool of PDF extraction processes, separated from the API process.
+
+        The processes are started with the first conversion and load the marker models on demand,
+        so the API workers start fast and stay small. The number of processes can be scaled
+        independently of the uvicorn workers.
+
+        Parameters:
+        max_workers (int): Number of extraction processes.
+        """
+        self.max_workers = max_workers
+        self._executor = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn: never fork the API process with its threads and clients
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+        return self._executor
+
+    async def convert(self, pdf_path: str, start_page: int = None, max_pages: int = None):
+        """
+        Converts the given pages of the PDF in a worker process.
+
+        Returns:
+        Tuple[str, dict, dict]: The markdown text, the extracted images and marker's meta data,
+        just like `convert_single_pdf`.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(), _convert_in_worker, pdf_path, start_page, max_pages)
+
+    def shutdown(self):
+        """Stops the worker processes, they are started again with the next conversion."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
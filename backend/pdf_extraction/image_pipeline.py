@@ -0,0 +1,122 @@
+# General packages
+import asyncio
+import hashlib
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+
+# Image processing
+from PIL import features
+
+# Content-addressed image store, shared by all users
+IMAGES_FOLDER = os.path.join('static', 'images')
+IMAGES_URL = '/static/images'
+# Widths of the responsive thumbnails, the full-size image is kept as well
+THUMBNAIL_WIDTHS = (320, 640)
+# WebP by default, AVIF only if requested and Pillow was built with it
+IMAGE_FORMAT = os.environ.get('IMAGE_FORMAT', 'webp').lower()
+if IMAGE_FORMAT == 'avif' and not features.check('avif'):
+    IMAGE_FORMAT = 'webp'
+IMAGE_QUALITY = int(os.environ.get('IMAGE_QUALITY', 80))
+
+# own pool, so image encoding never waits behind other blocking work
+_image_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('IMAGE_WORKERS', 2)),
+                                     thread_name_prefix='image-pipeline')
+
+
+def get_image_hash(image_obj) -> str:
+    """Hashes the pixel data, so identical images get the same name regardless of the user or the PDF."""
+    sha256 = hashlib.sha256()
+    sha256.update(f"{image_obj.mode}:{image_obj.size}".encode())
+    sha256.update(image_obj.tobytes())
+    return sha256.hexdigest()[:32]
+
+
+def _save_encoded(image_obj, image_path: str):
+    # write to a temporary file first, so concurrent uploads of the same image never see half-written files
+    temp_path = f"{image_path}.{uuid.uuid4().hex}.tmp"
+    image_obj.save(temp_path, format=IMAGE_FORMAT.upper(), quality=IMAGE_QUALITY)
+    os.replace(temp_path, image_path)
+
+
+def get_image_url(image_hash: str, width: int = None) -> str:
+    """
+    URL of the full-size image. With its width (`?w=<width>`, ignored by the static files) the client knows which
+    thumbnails exist: those of THUMBNAIL_WIDTHS that are smaller than the image.
+    """
+    url = f"{IMAGES_URL}/{image_hash}.{IMAGE_FORMAT}"
+    return f"{url}?w={width}" if width else url
+
+
+def optimize_image(image_obj, image_hash: str = None) -> str:
+    """
+    Encodes the image and its thumbnails into the shared image store, unless an identical image is already stored.
+
+    Returns:
+    str: The URL of the full-size image.
+    """
+    image_hash = image_hash or get_image_hash(image_obj)
+    image_width = image_obj.width
+    image_path = os.path.join(IMAGES_FOLDER, f"{image_hash}.{IMAGE_FORMAT}")
+
+    if not os.path.exists(image_path):
+        os.makedirs(IMAGES_FOLDER, exist_ok=True)
+        if image_obj.mode not in ('RGB', 'RGBA'):
+            image_obj = image_obj.convert('RGBA' if 'A' in image_obj.getbands() else 'RGB')
+
+        for width in THUMBNAIL_WIDTHS:
+            if width >= image_obj.width:
+                continue
+            height = max(1, round(image_obj.height * width / image_obj.width))
+            thumbnail = image_obj.resize((width, height))
+            _save_encoded(thumbnail, os.path.join(IMAGES_FOLDER, f"{image_hash}_{width}.{IMAGE_FORMAT}"))
+
+        # the full-size image is written last, its existence marks the image as complete
+        _save_encoded(image_obj, image_path)
+
+    return get_image_url(image_hash, image_width)
+
+
+async def hash_images(images: Dict) -> Dict[str, str]:
+    """
+    Hashes all extracted images on the image pool. Hashing is much faster than encoding,
+    so the final image URLs are known before the images are optimized.
+
+    Returns:
+    Dict[str, str]: The content hash for each image name.
+    """
+    loop = asyncio.get_running_loop()
+    image_names = list(images.keys())
+    image_hashes = await asyncio.gather(
+        *[loop.run_in_executor(_image_executor, get_image_hash, images[image_name]) for image_name in image_names]
+    )
+    return dict(zip(image_names, image_hashes))
+
+
+async def optimize_images(images: Dict, image_hashes: Dict[str, str] = None) -> Dict[str, str]:
+    """
+    Runs `optimize_image` for all extracted images in parallel on the image pool.
+
+    Parameters:
+    images (Dict): The extracted PIL images, keyed by the name used inside the markdown.
+    image_hashes (Dict[str, str]): Already computed hashes (see `hash_images`), optional.
+
+    Returns:
+    Dict[str, str]: The optimized image URL for each image name.
+    """
+    loop = asyncio.get_running_loop()
+    image_hashes = image_hashes or {}
+    image_names = list(images.keys())
+    image_urls = await asyncio.gather(
+        *[loop.run_in_executor(_image_executor, optimize_image, images[image_name], image_hashes.get(image_name))
+          for image_name in image_names]
+    )
+    return dict(zip(image_names, image_urls))
+
+
+def replace_image_references(markdown_text: str, image_urls: Dict[str, str]) -> str:
+    """Points the image links of the extracted markdown, e.g. `![0_image_0.png](0_image_0.png)`, to the optimized images."""
+    for image_name, image_url in image_urls.items():
+        markdown_text = markdown_text.replace(f"]({image_name})", f"]({image_url})")
+    return markdown_text
@@ -0,0 +1,87 @@
+# General packages
+import asyncio
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Dict
+
+# PDF processing
+from PyPDF2 import PdfReader
+
+
+@dataclass
+class PageBatch:
+    """
+    One converted slice of a PDF document.
+
+    index: position of the batch in the document (0-based)
+    batch_count: total number of batches the document is split into
+    start_page: first page of the batch (0-based)
+    text: markdown extracted by marker for these pages
+    images: extracted PIL images, keyed by the name used inside the markdown
+    """
+    index: int
+    batch_count: int
+    start_page: int
+    text: str
+    images: Dict = field(default_factory=dict)
+
+    @property
+    def is_first(self) -> bool:
+        return self.index == 0
+
+    @property
+    def is_last(self) -> bool:
+        return self.index == self.batch_count - 1
+
+
+def get_pdf_page_count(pdf_path: str) -> int:
+    """Returns the number of pages of the given PDF, without converting it."""
+    return len(PdfReader(pdf_path).pages)
+
+
+async def stream_pdf_pages(pdf_path: str, extraction_worker, pages_per_batch: int = 2,
+                           max_buffered_batches: int = 2) -> AsyncIterator[PageBatch]:
+    """
+    Converts the PDF with marker (in the extraction worker) in slices of `pages_per_batch` pages and yields each slice as soon as it is ready.
+
+    The conversion runs in a single background task, so batches are always yielded in page order.
+    The queue between the converter and the consumer holds at most `max_buffered_batches` slices,
+    i.e. the converter waits (backpressure) when the consumer (e.g. the learning plan stream) is slower.
+    If the consumer stops early, the background conversion is cancelled.
+
+    Parameters:
+    pdf_path (str): Path to the PDF document.
+    extraction_worker (PDFExtractionWorker): The worker (pool) that runs marker.
+    pages_per_batch (int): Number of pages converted per marker call.
+    max_buffered_batches (int): Number of converted batches that may wait for the consumer.
+    """
+    loop = asyncio.get_running_loop()
+    page_count = await loop.run_in_executor(None, get_pdf_page_count, pdf_path)
+    pages_per_batch = max(1, pages_per_batch)
+    batch_count = max(1, -(-page_count // pages_per_batch))
+    queue = asyncio.Queue(maxsize=max(1, max_buffered_batches))
+    end_of_document = object()
+
+    async def produce():
+        try:
+            for index in range(batch_count):
+                start_page = index * pages_per_batch
+                text, images, _ = await extraction_worker.convert(pdf_path, start_page=start_page,
+                                                                  max_pages=pages_per_batch)
+                await queue.put(PageBatch(index=index, batch_count=batch_count, start_page=start_page,
+                                          text=text, images=images))
+            await queue.put(end_of_document)
+        except Exception as e:
+            # hand the error over to the consumer instead of losing it in the background task
+            await queue.put(e)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            item = await queue.get()
+            if item is end_of_document:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        producer.cancel()
@@ -0,0 +1,146 @@
+"""
+Precompiled prompt templates for ALLaM.
+A template is split once into its literal parts and its `<<SLOT>>` placeholders; rendering fills the slots
+and joins all parts at once. The rendered token count of every slot is reported to the metrics, and the
+overflow policies of the slots keep the prompt inside the context window of the model.
+"""
+import os
+import re
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional
+
+from metrics import metrics
+from token_counting import count_tokens, truncate_to_tokens
+
+# Context window of ALLaM-1-13B on watsonx
+ALLAM_CONTEXT_WINDOW = int(os.environ.get('ALLAM_CONTEXT_WINDOW', 4096))
+# Tokens reserved for the generated text, the default of the ALLaM parameters in the API
+DEFAULT_MAX_NEW_TOKENS = 1536
+
+# Overflow policies
+TRUNCATE = 'truncate'  # cut the text (at the end, or at the start with keep='end')
+DROP_EXAMPLES = 'drop_examples'  # the slot value is a list of examples, the last examples are dropped first
+SUMMARIZE = 'summarize'  # summarize the text with `await summarize(text, max_tokens)` (render_async only), truncated if still too long
+
+_slot_pattern = re.compile(r'<<([A-Z][A-Z0-9_]*)>>')
+
+
+@dataclass
+class SlotPolicy:
+    overflow: str = TRUNCATE
+    max_tokens: Optional[int] = None  # per slot limit, applied even if the prompt fits
+    keep: str = 'start'  # for TRUNCATE: the part of the text that is kept
+    separator: str = '\n'  # for DROP_EXAMPLES: joins the examples
+    summarize: Optional[Callable[[str, int], Awaitable[str]]] = None  # for SUMMARIZE, async (e.g. an ALLaM call)
+
+
+class PromptTemplate:
+    def __init__(self, name, template, slot_policies=None, max_new_tokens=DEFAULT_MAX_NEW_TOKENS,
+                 context_window=ALLAM_CONTEXT_WINDOW):
+        """
+        Parameters:
+        name (str): Name of the prompt in the metrics.
+        template (str): The prompt with `<<SLOT>>` placeholders (upper case names).
+        slot_policies (dict): Slot name -> SlotPolicy. If the prompt does not fit, the slots are shrunk in this order;
+                              slots without a policy are never shrunk.
+        max_new_tokens (int): Tokens reserved for the generated text.
+        context_window (int): Context window of the model.
+        """
+        self.name = name
+        self.slot_policies = slot_policies or {}
+        self.token_budget = context_window - max_new_tokens
+        # the split alternates literal parts (even indices) and slot names (odd indices)
+        self._parts = _slot_pattern.split(template)
+        self.slot_names = self._parts[1::2]
+        self._literal_tokens = None
+
+        unknown_slots = set(self.slot_policies) - set(self.slot_names)
+        if unknown_slots:
+            raise ValueError(f"Prompt template '{name}' has no slots {unknown_slots}")
+
+    @property
+    def literal_tokens(self):
+        """Tokens of the fixed text, counted with the first rendering (the tokenizer is loaded lazily)."""
+        if self._literal_tokens is None:
+            self._literal_tokens = count_tokens(''.join(self._parts[0::2]))
+        return self._literal_tokens
+
+    def _fit(self, value, policy, max_tokens):
+        """
+        Returns the slot text within max_tokens (None: no limit), its token count and whether it was shrunk.
+        SUMMARIZE slots are truncated here, render_async summarizes them.
+        """
+        if policy.overflow == DROP_EXAMPLES:
+            kept_examples = []
+            used_tokens = 0
+            for example in value:
+                example_tokens = count_tokens(example) + (count_tokens(policy.separator) if kept_examples else 0)
+                if max_tokens is not None and used_tokens + example_tokens > max_tokens:
+                    break
+                kept_examples.append(example)
+                used_tokens += example_tokens
+            return policy.separator.join(kept_examples), used_tokens, len(kept_examples) < len(value)
+
+        text = str(value)
+        text_tokens = count_tokens(text)
+        if max_tokens is None or text_tokens <= max_tokens:
+            return text, text_tokens, False
+        text = truncate_to_tokens(text, max_tokens, keep=policy.keep)
+        return text, count_tokens(text), True
+
+    def _render(self, values, record_metrics=True):
+        """Returns the prompt and the token limits of the slots that had to be shrunk."""
+        texts = {}
+        tokens = {}
+        shrunk_slots = {}
+        for name in set(self.slot_names):
+            policy = self.slot_policies.get(name, SlotPolicy())
+            texts[name], tokens[name], shrunk = self._fit(values[name], policy, policy.max_tokens)
+            if shrunk:
+                shrunk_slots[name] = policy.max_tokens
+
+        # shrink the slots in the order of their policies until the prompt fits
+        overflow = self.literal_tokens + sum(tokens.values()) - self.token_budget
+        for name, policy in self.slot_policies.items():
+            if overflow <= 0:
+                break
+            max_tokens = max(0, tokens[name] - overflow)
+            texts[name], slot_tokens, _ = self._fit(values[name], policy, max_tokens)
+            overflow -= tokens[name] - slot_tokens
+            tokens[name] = slot_tokens
+            shrunk_slots[name] = max_tokens
+            if record_metrics:
+                metrics.increment(f'prompt_overflow.{self.name}.{name}')
+        if not record_metrics:
+            return None, shrunk_slots
+        if overflow > 0:
+            print(f"Prompt '{self.name}' exceeds the context window by {overflow} tokens")
+            metrics.increment(f'prompt_overflow.{self.name}.unresolved')
+
+        parts = list(self._parts)
+        parts[1::2] = [texts[name] for name in self.slot_names]
+
+        for name, slot_tokens in tokens.items():
+            metrics.observe(f'prompt_tokens.{self.name}.{name}', slot_tokens)
+        metrics.observe(f'prompt_tokens.{self.name}.total', self.literal_tokens + sum(tokens.values()))
+        return ''.join(parts), shrunk_slots
+
+    def render(self, **values):
+        """Fills all slots (keyword arguments by slot name) and returns the prompt."""
+        prompt, _ = self._render(values)
+        return prompt
+
+    async def render_async(self, **values):
+        """Like render, but SUMMARIZE slots that do not fit are summarized instead of truncated."""
+        _, shrunk_slots = self._render(values, record_metrics=False)
+        for name, max_tokens in shrunk_slots.items():
+            policy = self.slot_policies[name]
+            if policy.overflow != SUMMARIZE or policy.summarize is None or max_tokens <= 0:
+                continue
+            try:
+                values[name] = await policy.summarize(str(values[name]), max_tokens)
+                metrics.increment(f'prompt_summarized.{self.name}.{name}')
+            except Exception as e:
+                print(f"Summarizing a slot of the prompt '{self.name}' failed, it is truncated: {e}")
+        prompt, _ = self._render(values)
+        return prompt
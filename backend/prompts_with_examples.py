@@ -2,6 +2,7 @@
 This file was for the prototype V1, where we tested static system prompts for specific topics.
 Now, we only use the "general paraphrasing" and "quiz" prompts, while others are created dynamically when adding a topic
 """
+import re
 
 general_paraphrasing_prompt = """
 <s>[INST] You are an AI-powered paraphrasing system for the Arabic language. Your task is to explain the given text in Saudi dialect. 
@@ -568,3 +569,14 @@ def get_quiz_evaluator_prompt():
 
 def get_free_text_quiz_prompt():
     return free_text_quiz_prompt
+
+
+def get_quiz_evaluator_instructions():
+    """The quiz evaluator prompt without its examples."""
+    return quiz_evaluator_prompt[:quiz_evaluator_prompt.index('Example 1:')]
+
+
+def get_quiz_evaluator_examples():
+    """The examples of the quiz evaluator prompt as a list, joining them with '' gives the examples part of the prompt."""
+    examples_part = quiz_evaluator_prompt[quiz_evaluator_prompt.index('Example 1:'):]
+    return [example for example in re.split(r'(?=Example \d+:)', examples_part) if example]
@@ -0,0 +1,93 @@
+"""
+Batched quiz generation: several learning plan chunks are sent in one ALLaM call, so the long quiz instructions and
+examples are sent once per batch instead of once per chunk. The output is a numbered list, one item per chunk
+(`### 1`, `### 2`, ...); every item is parsed and validated on its own, the chunks of the missing or invalid items
+are generated one by one.
+"""
+import os
+import re
+
+from token_counting import count_tokens
+
+# Number of chunks per quiz call, 1 generates every question on its own
+QUIZ_BATCH_SIZE = int(os.environ.get('QUIZ_BATCH_SIZE', 3))
+
+# header of an item of the output, e.g. "### 2"
+_item_header_pattern = re.compile(r'^[ \t]*#{2,4}[ \t]*(\d+)[ \t]*:?[ \t]*$', re.MULTILINE)
+# the model sometimes repeats the "Output:" of the examples
+_output_label_pattern = re.compile(r'^\s*Output\s*:\s*')
+# the correct answer ("الإجابة الصحيحة: ...") with its text
+_answer_pattern = re.compile(r'ال[اإ]جابة\s*الصحيحة\s*:?\s*\S')
+# the answer options of a multiple-choice question, e.g. "أ)", "1.", "- "
+_option_pattern = re.compile(r'^\s*(?:[أ-ي]|[A-Da-d]|\d)\s*[).\-:]|^\s*[-*•]\s+\S', re.MULTILINE)
+
+
+def get_item_header(number):
+    return f'### {number}'
+
+
+def format_quiz_batch(chunks):
+    """The numbered chunks of a batch, the numbers of the items in the output."""
+    return '\n\n'.join(f'{get_item_header(number)}\n{chunk.strip()}' for number, chunk in enumerate(chunks, start=1))
+
+
+def get_batch_stop_sequence(count):
+    """The model starts an item that has no chunk, the batch is complete."""
+    return get_item_header(count + 1)
+
+
+def is_multiple_choice_question_valid(text):
+    """A question with at least three answer options and the correct answer."""
+    return _answer_pattern.search(text) is not None and len(_option_pattern.findall(text)) >= 3
+
+
+def is_free_text_question_valid(text):
+    """A question followed by its answer."""
+    answer = _answer_pattern.search(text)
+    return answer is not None and text[:answer.start()].strip() != ''
+
+
+def parse_quiz_batch(text, count, is_valid):
+    """
+    Splits the output of a batch into its items.
+
+    :param text: the generated text
+    :param count: number of chunks in the batch
+    :param is_valid: validator of a single item
+    :return: list of `count` questions in chunk order, None for a missing or invalid item
+    """
+    items = [None] * count
+    headers = list(_item_header_pattern.finditer(text))
+    for header, next_header in zip(headers, headers[1:] + [None]):
+        number = int(header.group(1))
+        if not 1 <= number <= count or items[number - 1] is not None:
+            continue
+        item = text[header.end():next_header.start() if next_header else len(text)]
+        item = _output_label_pattern.sub('', item).strip()
+        if item and is_valid(item):
+            items[number - 1] = item
+    return items
+
+
+def group_chunks(chunks, batch_size, token_budget):
+    """
+    Groups consecutive chunks into batches of up to `batch_size` chunks whose text fits into `token_budget` tokens.
+    A chunk that does not fit on its own is a batch of one (its prompt summarizes it).
+
+    :return: list of batches, each a list of chunk indices
+    """
+    batches = []
+    batch = []
+    batch_tokens = 0
+    for index, chunk in enumerate(chunks):
+        # the chunk and its item header
+        chunk_tokens = count_tokens(chunk) + count_tokens(get_item_header(index + 1)) + 2
+        if batch and (len(batch) >= batch_size or batch_tokens + chunk_tokens > token_budget):
+            batches.append(batch)
+            batch = []
+            batch_tokens = 0
+        batch.append(index)
+        batch_tokens += chunk_tokens
+    if batch:
+        batches.append(batch)
+    return batches
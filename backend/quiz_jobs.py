@@ -0,0 +1,215 @@
+"""
+Quiz generation of an upload as a tracked background job. The learning plan response closes as soon as the plan is
+complete; the questions are generated on demand (a whole quiz, or the quiz of a single chunk and the chunks ahead of
+it) and stored per chunk as soon as they are generated, so the quiz endpoints serve them progressively.
+Generated questions are cached by (learning plan hash, chunk index, quiz type).
+"""
+import asyncio
+import hashlib
+import os
+
+from metrics import metrics
+
+# Set to 0 to generate both quizzes of every upload right away, instead of when a quiz is requested
+LAZY_QUIZZES = os.environ.get('LAZY_QUIZZES', '1') == '1'
+# Number of chunks generated ahead of a requested chunk
+QUIZ_PREFETCH = int(os.environ.get('QUIZ_PREFETCH', 1))
+QUIZ_CACHE_PATH = os.environ.get('QUIZ_CACHE_PATH', './cache/quiz_questions.sqlite')
+
+# States of a quiz job
+ON_DEMAND = 'on_demand'  # nothing is generated right now, the missing questions are generated when requested
+RUNNING = 'running'
+COMPLETED = 'completed'
+CANCELLED = 'cancelled'
+
+# A chunk whose question failed, it is left out of the quiz
+_FAILED_QUESTION = object()
+
+
+def get_plan_hash(learning_plan):
+    return hashlib.sha256(learning_plan.encode('utf-8')).hexdigest()
+
+
+def get_quiz_cache_key(plan_hash, index, quiz_type):
+    return f'quiz:{plan_hash}:{index}:{quiz_type}'
+
+
+class QuizJob:
+    def __init__(self, quiz_types, chunk_count, generate_questions, plan_hash=None, cache=None,
+                 prefetch=QUIZ_PREFETCH):
+        """
+        The questions of the quizzes of one learning plan, one slot per content chunk and quiz type.
+
+        Nothing is generated until a quiz is requested: request_quiz generates all missing questions of a quiz in
+        the background, get_question the question of one chunk and the `prefetch` chunks after it. A question that
+        is already generated or in generation is never generated again; a failed one is generated again when its
+        chunk is requested.
+
+        Parameters:
+        quiz_types (list): Names of the quizzes, e.g. 'multiple_choice' and 'free_text'.
+        chunk_count (int): Number of content chunks, one question per chunk.
+        generate_questions (callable): async (quiz_type, indices, on_question) that generates the questions of the
+                                       chunks and calls on_question(index, question) for each (None if it failed).
+        plan_hash (str): Hash of the learning plan, the cache key of its questions.
+        cache (ResponseCache): Cache of the generated questions, None to disable it.
+        prefetch (int): Number of chunks generated ahead of a requested chunk.
+        """
+        self.chunk_count = chunk_count
+        self.generate_questions = generate_questions
+        self.plan_hash = plan_hash
+        self.cache = cache
+        self.prefetch = prefetch
+        self._questions = {quiz_type: [None] * chunk_count for quiz_type in quiz_types}
+        # (quiz type, chunk index) -> future of the question that is generated right now
+        self._pending = {}
+        self._requested_quizzes = set()
+        # chunks left out of the quiz list because their question had failed, also after it is generated again
+        self._left_out = {quiz_type: set() for quiz_type in quiz_types}
+        self._tasks = set()
+        self._cancelled = False
+
+    @property
+    def status(self):
+        if self._cancelled:
+            return CANCELLED
+        if self._tasks:
+            return RUNNING
+        if all(self.is_complete(quiz_type) for quiz_type in self._questions):
+            return COMPLETED
+        return ON_DEMAND
+
+    def _set_question(self, quiz_type, index, question):
+        """Stores the question of a chunk, None if its generation failed."""
+        self._questions[quiz_type][index] = _FAILED_QUESTION if question is None else question
+        future = self._pending.pop((quiz_type, index), None)
+        if future is not None and not future.done():
+            future.set_result(question)
+
+    def _is_generated(self, quiz_type, index):
+        question = self._questions[quiz_type][index]
+        return question is not None and question is not _FAILED_QUESTION
+
+    async def _load_from_cache(self, quiz_type, indices):
+        """Stores the cached questions, returns the indices of the chunks that have to be generated."""
+        if self.cache is None or self.plan_hash is None:
+            return indices
+        missing_indices = []
+        for index in indices:
+            question = await self.cache.get(get_quiz_cache_key(self.plan_hash, index, quiz_type))
+            if question is None:
+                missing_indices.append(index)
+            else:
+                self._set_question(quiz_type, index, question)
+        metrics.increment('quiz_cache.hits', len(indices) - len(missing_indices))
+        metrics.increment('quiz_cache.misses', len(missing_indices))
+        return missing_indices
+
+    async def _generate(self, quiz_type, indices):
+        stored = []
+
+        def on_question(index, question):
+            self._set_question(quiz_type, index, question)
+            if question is not None:
+                stored.append(index)
+
+        try:
+            missing_indices = await self._load_from_cache(quiz_type, indices)
+            if missing_indices:
+                await self.generate_questions(quiz_type, missing_indices, on_question)
+            if self.cache is not None and self.plan_hash is not None:
+                for index in stored:
+                    await self.cache.put(get_quiz_cache_key(self.plan_hash, index, quiz_type),
+                                         self._questions[quiz_type][index])
+        except Exception as e:
+            print(f'Quiz generation failed: {e!r}')
+        finally:
+            # the chunks without question failed (or the job was cancelled)
+            for index in indices:
+                if (quiz_type, index) in self._pending:
+                    self._set_question(quiz_type, index, None)
+
+    def _start(self, quiz_type, indices):
+        """Generates the questions of the chunks that are neither generated nor in generation, in the background."""
+        indices = [index for index in indices
+                   if 0 <= index < self.chunk_count and not self._is_generated(quiz_type, index)
+                   and (quiz_type, index) not in self._pending]
+        if not indices or self._cancelled:
+            return
+        loop = asyncio.get_running_loop()
+        for index in indices:
+            self._pending[(quiz_type, index)] = loop.create_future()
+        task = asyncio.create_task(self._generate(quiz_type, indices))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def request_quiz(self, quiz_type):
+        """Generates the missing questions of a quiz in the background, once per quiz."""
+        if quiz_type not in self._requested_quizzes:
+            self._requested_quizzes.add(quiz_type)
+            self._start(quiz_type, range(self.chunk_count))
+
+    async def wait_for_quiz(self, quiz_type):
+        """Waits until all questions of a requested quiz are done."""
+        futures = [future for (pending_type, _), future in self._pending.items() if pending_type == quiz_type]
+        # shield: a client that stops waiting must not cancel the generation
+        await asyncio.shield(asyncio.gather(*futures))
+
+    async def get_question(self, quiz_type, index):
+        """
+        The question of a chunk, generated if it is not there yet; the next chunks are generated in the background.
+        Returns None if the question could not be generated.
+        """
+        if not 0 <= index < self.chunk_count:
+            raise IndexError(f'The learning plan has no chunk {index}')
+        if self._is_generated(quiz_type, index):
+            metrics.increment('quiz_questions.ready_when_requested')
+        else:
+            self._start(quiz_type, [index])
+        self._start(quiz_type, range(index + 1, index + 1 + self.prefetch))
+        future = self._pending.get((quiz_type, index))
+        if future is not None:
+            return await asyncio.shield(future)
+        question = self._questions[quiz_type][index]
+        return None if question is _FAILED_QUESTION else question
+
+    def get_questions(self, quiz_type):
+        """
+        The questions of the chunks whose predecessors are all done, in chunk order (failed chunks are left out).
+        Later calls only append questions, so a client can show the first questions while the rest is generated:
+        a failed chunk stays out of the list, also when get_question generates its question again.
+        """
+        questions = []
+        left_out = self._left_out[quiz_type]
+        for index, question in enumerate(self._questions[quiz_type]):
+            if question is None:
+                break
+            if question is _FAILED_QUESTION:
+                left_out.add(index)
+            elif index not in left_out:
+                questions.append(question)
+        return questions
+
+    def is_complete(self, quiz_type):
+        return all(question is not None for question in self._questions[quiz_type])
+
+    def get_status(self):
+        quizzes = {}
+        for quiz_type, questions in self._questions.items():
+            failed = sum(question is _FAILED_QUESTION for question in questions)
+            quizzes[quiz_type] = {
+                'total': self.chunk_count,
+                'ready': sum(question is not None for question in questions) - failed,
+                'failed': failed,
+                'in_progress': sum(pending_type == quiz_type for pending_type, _ in self._pending),
+                'complete': self.is_complete(quiz_type),
+            }
+        return {'status': self.status, 'quizzes': quizzes}
+
+    def cancel(self):
+        """Stops the generation, e.g. when the user uploads a new file. The waiting requests get no question."""
+        self._cancelled = True
+        for task in list(self._tasks):
+            task.cancel()
+        # a task that is cancelled before it started never resolves its questions
+        for quiz_type, index in list(self._pending):
+            self._set_question(quiz_type, index, None)
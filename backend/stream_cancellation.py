@@ -0,0 +1,110 @@
+"""
+Cancellation of streamed responses when the client disconnects (e.g. a student closes the tab mid-answer).
+The LLM stream is closed right away, which closes the upstream request and frees its scheduler slot.
+"""
+import asyncio
+import os
+
+from metrics import metrics
+from token_counting import count_tokens
+
+# Seconds between two checks whether the client is still connected
+DISCONNECT_POLL_INTERVAL = float(os.environ.get('DISCONNECT_POLL_INTERVAL', 0.5))
+
+
+async def _wait_for_disconnect(request, poll_interval):
+    while not await request.is_disconnected():
+        await asyncio.sleep(poll_interval)
+
+
+def _get_expected_tokens(name, max_tokens):
+    """Typical length of a complete stream: the median of the completed ones, else the token limit."""
+    expected_tokens = metrics.get_percentile(f'stream_output_tokens.{name}', 50)
+    if expected_tokens is None:
+        expected_tokens = max_tokens or 0
+    return expected_tokens
+
+
+async def stream_until_disconnect(request, stream, name, max_tokens=None, poll_interval=DISCONNECT_POLL_INTERVAL):
+    """
+    Yields the chunks of an async text stream as long as the client is connected.
+
+    Every chunk is awaited next to a watcher of the connection. When the client disconnects (also while the model
+    is still waiting for its first token), or the response stops consuming, the stream is closed at once instead of
+    running to its end. The tokens that were not generated are counted in the metrics (`tokens_saved.<name>`),
+    estimated from the median length of the completed streams of the same name.
+
+    :param request: the Starlette request of the response
+    :param stream: async iterator of text chunks, it is closed in any case
+    :param name: name of the stream in the metrics
+    :param max_tokens: token limit of the stream, the estimate as long as no stream was completed
+    :param poll_interval: seconds between two checks of the connection
+    """
+    text = []
+    completed = False
+    failed = False
+    next_chunk = None
+    disconnect = asyncio.ensure_future(_wait_for_disconnect(request, poll_interval))
+    try:
+        while True:
+            next_chunk = asyncio.ensure_future(stream.__anext__())
+            await asyncio.wait({next_chunk, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+            if not next_chunk.done():
+                print(f'Client disconnected, {name} stream cancelled')
+                break
+            try:
+                chunk = next_chunk.result()
+            except StopAsyncIteration:
+                completed = True
+                break
+            except Exception:
+                failed = True
+                raise
+            text.append(chunk)
+            yield chunk
+    finally:
+        disconnect.cancel()
+        if next_chunk is not None and not next_chunk.done():
+            # the cancellation runs through the stream (scheduler, watsonx or OpenAI client) up to the upstream request,
+            # the stream closes itself on the way
+            next_chunk.cancel()
+        else:
+            close = getattr(stream, 'aclose', None)
+            if close is not None:
+                await close()
+        if completed:
+            metrics.observe(f'stream_output_tokens.{name}', count_tokens(''.join(text)))
+        elif not failed:
+            # disconnected, or the response stopped consuming
+            output_tokens = count_tokens(''.join(text))
+            metrics.increment(f'stream_cancelled.{name}')
+            metrics.increment(f'tokens_saved.{name}', max(0, int(_get_expected_tokens(name, max_tokens)) - output_tokens))
+
+
+async def start_stream(stream):
+    """
+    Waits for the first chunk of a stream before the response is started. An error before the first chunk (e.g.
+    LLMUnavailableError) is raised here, while the endpoint can still answer it with an error status; once the
+    streamed response has started, its status is sent.
+
+    :param stream: async iterator of text chunks
+    :return: async iterator of all chunks of the stream, the first one included
+    """
+    try:
+        first_chunk = await anext(stream)
+    except StopAsyncIteration:
+        first_chunk = None
+
+    async def chunks():
+        if first_chunk is None:
+            return
+        try:
+            yield first_chunk
+            async for chunk in stream:
+                yield chunk
+        finally:
+            close = getattr(stream, 'aclose', None)
+            if close is not None:
+                await close()
+
+    return chunks()
@@ -0,0 +1,71 @@
+"""
+Two uploads of the same material at the same time are classified with one upstream ALLaM call.
+
+Both classifications build their prompt like classify_topic (the classifier prompt of the topic registry and the
+sampled document) and go through the single-flight layer to a counting mock; the test fails if the prompts differ
+or the upstream model is called more than once. It also checks that a reload of the same topics gives the same
+classifier prompt.
+
+Run from the backend folder:
+    python testing/classification_single_flight_test.py
+"""
+import asyncio
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from dynamic_system_prompts.topic_registry import TopicRegistry
+from dynamic_system_prompts.document_sampler import sample_document
+from llm.generation_profiles import CLASSIFICATION_PROFILE
+from llm.mock_client import MockLLMClient
+from llm.single_flight import SingleFlightLLMClient
+from prompt_templates import PromptTemplate, SlotPolicy, TRUNCATE
+
+BASE_FOLDER = './dynamic_system_prompts'
+# same template as the classifier of the API
+CLASSIFIER_TEMPLATE = PromptTemplate(
+    'classifier',
+    "<<CLASSIFIER_PROMPT>>Now, follow the given examples and classify the following content accordingly!<<DOCUMENT>>[/INST]",
+    slot_policies={'DOCUMENT': SlotPolicy(TRUNCATE)},
+    max_new_tokens=CLASSIFICATION_PROFILE.max_new_tokens
+)
+DOCUMENT = 'مجموعة من الأصدقاء قاموا بلعب كرة السلة، حيث رمى كل واحد منهم الكرة 100 مرة. ' * 20
+
+
+class CountingLLMClient(MockLLMClient):
+    def __init__(self):
+        super().__init__(ttft=0.2, token_delay=0.0, output_tokens=5)
+        self.calls = 0
+
+    async def generate(self, prompt, params=None, **options):
+        self.calls += 1
+        return await super().generate(prompt, params=params, **options)
+
+
+async def classify(topic_registry, llm):
+    prompt = CLASSIFIER_TEMPLATE.render(CLASSIFIER_PROMPT=topic_registry.get_classifier_prompt(),
+                                        DOCUMENT=sample_document(DOCUMENT))
+    return prompt, await llm.generate(prompt, params=CLASSIFICATION_PROFILE.params)
+
+
+async def main():
+    topic_registry = TopicRegistry(base_folder=BASE_FOLDER)
+    upstream = CountingLLMClient()
+    llm = SingleFlightLLMClient(upstream, model_id='mock', params={'decoding_method': 'greedy'})
+
+    (first_prompt, first_topic), (second_prompt, second_topic) = await asyncio.gather(
+        classify(topic_registry, llm), classify(topic_registry, llm)
+    )
+    assert first_prompt == second_prompt, 'the classifier prompts differ'
+    assert first_topic == second_topic
+    assert upstream.calls == 1, f'{upstream.calls} upstream calls for two identical classifications'
+
+    # a reload of unchanged topics keeps the prompt (and its cache entries)
+    prompt = topic_registry.get_classifier_prompt()
+    topic_registry.invalidate()
+    assert topic_registry.get_classifier_prompt() == prompt, 'the classifier prompt changed with a reload'
+    print('OK: two concurrent classifications, 1 upstream call')
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
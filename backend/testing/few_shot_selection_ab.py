@@ -0,0 +1,115 @@
+"""
+A/B comparison of the adaptive few-shot example selection against the full-prompt baseline (all examples).
+
+The requests are built from the examples themselves: every example input of a topic (and of the quiz evaluator)
+is used as the user input, and that example is left out of the pool of both variants, so the selection cannot
+simply pick the answer. For every request, both prompts are sent to ALLaM; the script reports the prompt tokens,
+the latency and the similarity of the two outputs (cosine similarity of their e5 embeddings).
+
+Run from the backend folder:
+    python testing/few_shot_selection_ab.py [--tokens-only]
+Needs ALLAM_WATSONX_KEY and ALLAM_PROJECT_ID, unless --tokens-only only compares the prompt sizes.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+from langchain.embeddings import SentenceTransformerEmbeddings
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from dynamic_system_prompts.topic_registry import TopicRegistry
+from dynamic_system_prompts.example_selector import ExampleSelector, get_example_input
+from dynamic_system_prompts.embedding_topic_classifier import _normalize
+from prompts_with_examples import get_quiz_evaluator_instructions, get_quiz_evaluator_examples
+from prompt_templates import PromptTemplate, SlotPolicy, DROP_EXAMPLES
+from token_counting import count_tokens
+
+BASE_FOLDER = './dynamic_system_prompts'
+
+# same prompts as /simplify/ (topic branch, without history) and /evaluate-text-quiz/
+TOPIC_TEMPLATE = PromptTemplate(
+    'ab_simplify_topic',
+    "<s>[INST] <<INSTRUCTIONS>>\n<<EXAMPLES>>Now, follow the style of paraphrasing and simplification you learned from the given examples and then answer the following question accordingly!<s> [INST] <<QUESTION>> [/INST]User interest: Football[/INST]",
+    slot_policies={'EXAMPLES': SlotPolicy(DROP_EXAMPLES, separator='')}
+)
+EVALUATION_TEMPLATE = PromptTemplate('ab_quiz_evaluation', get_quiz_evaluator_instructions() + """<<EXAMPLES>>
+Now, evaluate the given Answer and Ground Truth accordingly!
+Follow the example you learned and give the 'التقدير' and the 'تفسير التقدير'. Answer in Arabic. Here are the Answer and Ground Truth:
+<<QUESTION>>
+[/INST]""", slot_policies={'EXAMPLES': SlotPolicy(DROP_EXAMPLES, separator='')})
+
+
+def build_requests(embedding_model):
+    """Returns (name, baseline prompt, selected prompt) for every left-out example."""
+    registry = TopicRegistry(base_folder=BASE_FOLDER)
+    example_sets = [(topic, registry.get_examples(topic), TOPIC_TEMPLATE, {'INSTRUCTIONS': registry.get_instructions(topic)})
+                    for topic in registry.get_topics()]
+    example_sets.append(('quiz_evaluation', get_quiz_evaluator_examples(), EVALUATION_TEMPLATE, {}))
+
+    requests = []
+    for name, examples, template, slots in example_sets:
+        for index, example in enumerate(examples):
+            pool = examples[:index] + examples[index + 1:]
+            if not pool:
+                continue
+            query = get_example_input(example)
+            selector = ExampleSelector(embedding_model, get_examples=lambda key: pool, enabled=True)
+            selected = selector.select(name, query)
+            baseline_prompt = template.render(EXAMPLES=pool, QUESTION=query, **slots)
+            selected_prompt = template.render(EXAMPLES=selected, QUESTION=query, **slots)
+            requests.append((f"{name}[{index}]", baseline_prompt, selected_prompt))
+    return requests
+
+
+def generate(model, prompt):
+    start = time.perf_counter()
+    output = model.generate(prompt=prompt)['results'][0]['generated_text'].strip()
+    return output, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tokens-only', action='store_true')
+    args = parser.parse_args()
+
+    embedding_model = SentenceTransformerEmbeddings(model_name="intfloat/multilingual-e5-large")
+    requests = build_requests(embedding_model)
+    print(f"{len(requests)} requests")
+
+    baseline_tokens = [count_tokens(baseline_prompt) for _, baseline_prompt, _ in requests]
+    selected_tokens = [count_tokens(selected_prompt) for _, _, selected_prompt in requests]
+    print(f"prompt tokens   baseline mean {np.mean(baseline_tokens):7.1f}   selected mean {np.mean(selected_tokens):7.1f}   "
+          f"({1 - np.sum(selected_tokens) / np.sum(baseline_tokens):.1%} fewer)")
+    if args.tokens_only:
+        return
+
+    from ibm_watsonx_ai.foundation_models import Model
+    model = Model(
+        model_id='sdaia/allam-1-13b-instruct',
+        params={'decoding_method': 'greedy', 'max_new_tokens': 1536, 'repetition_penalty': 1.05},
+        credentials={'url': 'https://eu-de.ml.cloud.ibm.com', 'apikey': str(os.environ.get('ALLAM_WATSONX_KEY'))},
+        project_id=str(os.environ.get('ALLAM_PROJECT_ID'))
+    )
+
+    similarities = []
+    baseline_durations = []
+    selected_durations = []
+    for name, baseline_prompt, selected_prompt in requests:
+        baseline_output, baseline_duration = generate(model, baseline_prompt)
+        selected_output, selected_duration = generate(model, selected_prompt)
+        vectors = _normalize(embedding_model.embed_documents([baseline_output, selected_output]))
+        similarity = float(vectors[0] @ vectors[1])
+        similarities.append(similarity)
+        baseline_durations.append(baseline_duration)
+        selected_durations.append(selected_duration)
+        print(f"{name:24s} similarity {similarity:.3f}   latency baseline {baseline_duration:6.2f} s   selected {selected_duration:6.2f} s")
+
+    print(f"output similarity mean {np.mean(similarities):.3f}   min {np.min(similarities):.3f}")
+    print(f"latency baseline mean {np.mean(baseline_durations):6.2f} s  p95 {np.percentile(baseline_durations, 95):6.2f} s   "
+          f"selected mean {np.mean(selected_durations):6.2f} s  p95 {np.percentile(selected_durations, 95):6.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Tail latency of the ALLaM requests with and without the request policy (retries and hedging), against the mock backend.
+
+The mock has a latency tail (a share of the requests waits TAIL_FACTOR times longer for the first token) and fails
+a share of the requests. Every variant sends the same requests: streams of the simplify profile, measured to the
+first token. The script reports p50/p95/p99, the failed requests and the extra requests (retries and hedges).
+
+Run from the backend folder:
+    python testing/llm_hedging_benchmark.py [--requests 400] [--tail 0.03] [--failures 0.01]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from llm.mock_client import MockLLMClient
+from llm.resilience import ResilientLLMClient, ExtraRequestBudget
+from llm.generation_profiles import SIMPLIFY_PROFILE
+from metrics import Metrics, _percentile
+import llm.resilience
+
+
+def percentiles(values):
+    values = sorted(values)
+    return {f'p{p}': round(_percentile(values, p), 3) for p in (50, 95, 99)}
+
+
+async def run_variant(name, client, requests, concurrency, metrics):
+    latencies = []
+    failures = 0
+    semaphore = asyncio.Semaphore(concurrency)
+    # the bare backend has no request policy
+    options = {'profile': SIMPLIFY_PROFILE} if isinstance(client, ResilientLLMClient) else {}
+
+    async def run_one(index):
+        nonlocal failures
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                stream = client.stream(f'request {index}', params=SIMPLIFY_PROFILE.params, **options)
+                async for _ in stream:
+                    latencies.append(time.perf_counter() - start)
+                    break
+                await stream.aclose()
+            except Exception:
+                failures += 1
+
+    await asyncio.gather(*(run_one(index) for index in range(requests)))
+    counters = metrics.snapshot()['counters']
+    extra = {key.rsplit('.', 1)[-1]: value for key, value in counters.items()
+             if key.rsplit('.', 1)[-1] in ('retries', 'hedges', 'hedge_wins', 'timeouts', 'budget_exhausted')}
+    print(f'{name:<22} ttft {percentiles(latencies)}  failed {failures}  {extra}')
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--ttft', type=float, default=0.1)
+    parser.add_argument('--tail', type=float, default=0.03, help='share of the requests in the latency tail')
+    parser.add_argument('--tail-factor', type=float, default=20.0)
+    parser.add_argument('--failures', type=float, default=0.01, help='share of the failing requests')
+    args = parser.parse_args()
+
+    def make_backend():
+        # enough server capacity for the hedges, the same seed for every variant
+        return MockLLMClient(ttft=args.ttft, token_delay=0.001, output_tokens=5, concurrency=64,
+                             tail_probability=args.tail, tail_factor=args.tail_factor,
+                             failure_rate=args.failures, seed=42)
+
+    variants = [
+        ('no policy', lambda: make_backend()),
+        ('retries', lambda: ResilientLLMClient(make_backend(), 'benchmark', hedging=False)),
+        ('retries + hedging', lambda: ResilientLLMClient(make_backend(), 'benchmark', hedging=True,
+                                                         budget=ExtraRequestBudget())),
+    ]
+    for name, make_client in variants:
+        # fresh metrics per variant, so the hedge delay is learned from this variant only
+        metrics = Metrics()
+        llm.resilience.metrics = metrics
+        await run_variant(name, make_client(), args.requests, args.concurrency, metrics)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
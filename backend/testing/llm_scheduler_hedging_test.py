@@ -0,0 +1,77 @@
+"""
+Retries and hedges never exceed the concurrency limit of the scheduler.
+
+Interactive streams with a latency tail are sent through the client stack of the API (ResilientLLMClient above the
+ScheduledLLMClient) to a mock that counts its running requests. The test fails if more upstream requests run at the
+same time than the scheduler allows, or if no request was hedged (the limit would not be tested).
+
+Run from the backend folder:
+    python testing/llm_scheduler_hedging_test.py
+"""
+import asyncio
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from llm.mock_client import MockLLMClient
+from llm.resilience import ResilientLLMClient, ExtraRequestBudget
+from llm.scheduler import LLMScheduler, ScheduledLLMClient, INTERACTIVE
+from llm.generation_profiles import SIMPLIFY_PROFILE
+from metrics import Metrics
+import llm.resilience
+import llm.scheduler
+
+MAX_CONCURRENCY = 4
+REQUESTS = 60
+
+
+class CountingLLMClient(MockLLMClient):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.running = 0
+        self.max_running = 0
+        self.calls = 0
+
+    async def stream(self, prompt, params=None):
+        self.calls += 1
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            async for chunk in super().stream(prompt, params=params):
+                yield chunk
+        finally:
+            self.running -= 1
+
+
+async def main():
+    metrics = Metrics()
+    llm.resilience.metrics = metrics
+    llm.scheduler.metrics = metrics
+    # every fourth request is slow, the hedge delay is known from the start
+    for _ in range(20):
+        metrics.observe(f'llm_requests.test.{SIMPLIFY_PROFILE.name}.ttft_seconds', 0.05)
+    upstream = CountingLLMClient(ttft=0.05, token_delay=0.001, output_tokens=5, concurrency=100,
+                                 tail_probability=0.25, tail_factor=10, seed=1)
+    client = ResilientLLMClient(ScheduledLLMClient(upstream, LLMScheduler('test', max_concurrency=MAX_CONCURRENCY,
+                                                                          max_per_user=MAX_CONCURRENCY)),
+                                'test', budget=ExtraRequestBudget(ratio=1, burst=REQUESTS), hedge_min_samples=20)
+
+    async def run_one(index):
+        stream = client.stream(f'request {index}', params=SIMPLIFY_PROFILE.params, profile=SIMPLIFY_PROFILE,
+                               user_id=f'user {index % 5}', priority=INTERACTIVE)
+        try:
+            return ''.join([chunk async for chunk in stream])
+        finally:
+            await stream.aclose()
+
+    await asyncio.gather(*(run_one(index) for index in range(REQUESTS)))
+    hedges = metrics.snapshot()['counters'].get(f'llm_requests.test.{SIMPLIFY_PROFILE.name}.hedges', 0)
+    print(f'{REQUESTS} requests, {upstream.calls} upstream calls, {hedges} hedges, '
+          f'at most {upstream.max_running} running (limit {MAX_CONCURRENCY})')
+    assert hedges > 0, 'no request was hedged'
+    assert upstream.max_running <= MAX_CONCURRENCY, 'the hedges exceeded the concurrency limit'
+    print('OK')
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,72 @@
+"""
+Throughput benchmark of the PDF text extraction used for the RAG vectorstores.
+
+Compares the old extraction (whole document concatenated with `text +=`, `extract_text()` called twice per page,
+then split at once) with the streaming extraction of RAG/pdf_text_stream.py on all PDFs in RAG_DB.
+No embedding model is loaded, only extraction and splitting are measured.
+
+Run from the backend folder:
+    python testing/pdf_text_extraction_benchmark.py [--repeat 5] [--folder ./RAG_DB]
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+import tracemalloc
+
+from PyPDF2 import PdfReader
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from RAG.pdf_text_stream import get_text_splitter, iter_pdf_chunks
+
+
+def old_extraction(pdf_path):
+    # the extraction of PDFVectorStore before the shared streaming module
+    text = ""
+    pdf_reader = PdfReader(pdf_path)
+    for page in pdf_reader.pages:
+        text += page.extract_text() if page.extract_text() else ""
+    return get_text_splitter().split_text(text)
+
+
+def streaming_extraction(pdf_path):
+    return [document.page_content for document in iter_pdf_chunks(pdf_path)]
+
+
+def measure(extraction, pdf_paths, repeat):
+    chunk_count = 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for pdf_path in pdf_paths:
+            chunk_count += len(extraction(pdf_path))
+    duration = time.perf_counter() - start
+
+    # peak memory of a single pass, measured separately because tracing slows down the extraction
+    tracemalloc.start()
+    for pdf_path in pdf_paths:
+        extraction(pdf_path)
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return duration, chunk_count, peak_memory
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--folder', default='./RAG_DB')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    pdf_paths = sorted(glob.glob(os.path.join(args.folder, '**', '*.pdf'), recursive=True))
+    page_count = sum(len(PdfReader(pdf_path).pages) for pdf_path in pdf_paths) * args.repeat
+    print(f"{len(pdf_paths)} PDFs, {page_count} pages in total ({args.repeat} repetitions)")
+
+    for name, extraction in [('old (concatenate)', old_extraction), ('streaming', streaming_extraction)]:
+        duration, chunk_count, peak_memory = measure(extraction, pdf_paths, args.repeat)
+        print(f"{name:20s} {duration:7.2f} s  {page_count / duration:8.1f} pages/s  "
+              f"{chunk_count / duration:8.1f} chunks/s  peak memory {peak_memory / 1024:8.1f} KB")
+
+
+if __name__ == "__main__":
+    main()
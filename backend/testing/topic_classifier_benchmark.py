@@ -0,0 +1,198 @@
+"""
+Accuracy and latency comparison of the embedding topic classifier and the ALLaM prompt classifier.
+
+The labeled data is built from the topic folders in dynamic_system_prompts: every input of a topic's Examples.txt
+is a sample of that topic. The embedding classifier is evaluated leave-one-out, i.e. the centroid of the sample's
+topic is built without the sample itself. The PDFs in pdf_inputs are added as whole-document samples.
+Off-topic documents (the general paraphrasing examples, the English papers in testing and a few everyday texts)
+must not be accepted by the embedding classifier, they are left to the LLM classifier (General_Paraphrasing).
+
+Run from the backend folder:
+    python testing/topic_classifier_benchmark.py [--with-llm] [--calibrate]
+--with-llm also runs the ALLaM prompt classifier (needs ALLAM_WATSONX_KEY and ALLAM_PROJECT_ID).
+--calibrate sweeps MIN_SIMILARITY and MIN_CONFIDENCE_MARGIN and records the pair that accepts the most topic samples
+without accepting a wrong topic or an off-topic document in dynamic_system_prompts/topic_classifier_thresholds.json.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+from langchain.embeddings import SentenceTransformerEmbeddings
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from dynamic_system_prompts.dynamic_system_prompts_builder import build_all_system_prompts
+from dynamic_system_prompts.dynamic_classifier_prompt_builder import extract_inputs_between_input_output, \
+    get_dynamic_classifier_prompt
+from dynamic_system_prompts.embedding_topic_classifier import build_topic_centroid, load_reference_vectors, \
+    sample_passages, embed_passages, embed_document, MIN_CONFIDENCE_MARGIN, MIN_SIMILARITY, THRESHOLDS_PATH
+from RAG.pdf_text_stream import iter_pdf_pages
+from prompts_with_examples import get_general_paraphrasing_prompt
+
+BASE_FOLDER = './dynamic_system_prompts'
+# whole documents with a known topic
+PDF_SAMPLES = {
+    './pdf_inputs/Arabic_Grammar_Class5.pdf': 'Arabic',
+    './pdf_inputs/Math_Problems.pdf': 'Math',
+    './pdf_inputs/Science_Class6.pdf': 'Science',
+}
+# whole documents of no topic
+OFF_TOPIC_PDFS = ['./testing/alexnet.pdf', './testing/attention.pdf']
+OFF_TOPIC_TEXTS = [
+    'أعلنت وزارة السياحة عن افتتاح موسم الرياض بفعاليات متنوعة تشمل الحفلات والمعارض والمطاعم العالمية.',
+    'فاز الفريق بالمباراة النهائية بعد ركلات الترجيح وسط حضور جماهيري كبير في الملعب.',
+    'لتحضير الكبسة يغسل الأرز وينقع، ثم يطبخ اللحم مع البصل والبهارات قبل إضافة الأرز والماء.',
+    'يرجى إحضار الهوية الوطنية وصورة شخصية عند مراجعة مكتب الأحوال المدنية لتجديد الجواز.',
+    'ارتفعت أسعار النفط في الأسواق العالمية بعد قرار خفض الإنتاج.',
+]
+# grid of the calibration
+SIMILARITY_GRID = np.round(np.arange(0.70, 0.951, 0.005), 3)
+MARGIN_GRID = np.round(np.arange(0.0, 0.101, 0.0025), 4)
+
+
+def load_samples():
+    """Returns the topic sources and the labeled samples: (text, topic, index of the example or None)."""
+    topic_sources = {}
+    samples = []
+    for topic, definition_instructions_examples_prompt in build_all_system_prompts(base_folder=BASE_FOLDER).items():
+        examples = extract_inputs_between_input_output(definition_instructions_examples_prompt[2])
+        topic_sources[topic] = (definition_instructions_examples_prompt[0], examples)
+        samples += [(example, topic, index) for index, example in enumerate(examples)]
+    for pdf_path, topic in PDF_SAMPLES.items():
+        if os.path.exists(pdf_path) and topic in topic_sources:
+            samples.append((''.join(text for _, text in iter_pdf_pages(pdf_path)), topic, None))
+    return topic_sources, samples
+
+
+def load_off_topic_samples():
+    """The off-topic samples: (text, None, None)."""
+    texts = extract_inputs_between_input_output(get_general_paraphrasing_prompt())
+    texts = [text.replace('Input:', '', 1).strip() for text in texts] + OFF_TOPIC_TEXTS
+    for pdf_path in OFF_TOPIC_PDFS:
+        if os.path.exists(pdf_path):
+            texts.append(''.join(text for _, text in iter_pdf_pages(pdf_path)))
+    return [(text, None, None) for text in texts]
+
+
+def run_embedding_classifier(embedding_model, topic_sources, samples):
+    topic_vectors = {}
+    for topic, (definition, examples) in topic_sources.items():
+        topic_vectors[topic] = (embed_passages(embedding_model, [definition]),
+                                np.asarray(embed_passages(embedding_model, examples)),
+                                load_reference_vectors(os.path.join(BASE_FOLDER, topic)))
+
+    results = []
+    for text, topic, example_index in samples:
+        topic_names = []
+        centroids = []
+        for candidate, (definition_vectors, example_vectors, reference_vectors) in topic_vectors.items():
+            if candidate == topic and example_index is not None:
+                # leave the evaluated example out of its own centroid
+                example_vectors = np.delete(example_vectors, example_index, axis=0)
+            topic_names.append(candidate)
+            centroids.append(build_topic_centroid(definition_vectors, example_vectors, reference_vectors))
+
+        start = time.perf_counter()
+        document_vector = embed_document(embedding_model, sample_passages(text))
+        similarities = np.stack(centroids) @ document_vector
+        duration = time.perf_counter() - start
+
+        ranking = sorted(zip(topic_names, similarities.tolist()), key=lambda x: x[1], reverse=True)
+        margin = ranking[0][1] - ranking[1][1] if len(ranking) > 1 else ranking[0][1]
+        results.append((topic, ranking[0][0], ranking[0][1], margin, duration))
+    return results
+
+
+def is_confident(similarity, margin, min_similarity=MIN_SIMILARITY, min_margin=MIN_CONFIDENCE_MARGIN):
+    return similarity >= min_similarity and margin >= min_margin
+
+
+def calibrate(results):
+    """
+    The thresholds that accept the most topic samples (with the right topic), among those that accept neither a
+    wrong topic nor an off-topic sample; of equal pairs the strictest one.
+    """
+    best = None
+    for min_similarity in SIMILARITY_GRID:
+        for min_margin in MARGIN_GRID:
+            accepted = [(topic, predicted) for topic, predicted, similarity, margin, _ in results
+                        if is_confident(similarity, margin, min_similarity, min_margin)]
+            errors = sum(topic != predicted for topic, predicted in accepted)
+            if errors:
+                continue
+            key = (len(accepted), min_similarity, min_margin)
+            if best is None or key > best:
+                best = key
+    if best is None:
+        return None
+    return {'min_similarity': float(best[1]), 'min_confidence_margin': float(best[2]), 'accepted': best[0]}
+
+
+def run_llm_classifier(samples):
+    from ibm_watsonx_ai.foundation_models import Model
+    model = Model(
+        model_id='sdaia/allam-1-13b-instruct',
+        params={'decoding_method': 'greedy', 'max_new_tokens': 1536, 'repetition_penalty': 1.05},
+        credentials={'url': 'https://eu-de.ml.cloud.ibm.com', 'apikey': str(os.environ.get('ALLAM_WATSONX_KEY'))},
+        project_id=str(os.environ.get('ALLAM_PROJECT_ID'))
+    )
+    results = []
+    for text, topic, _ in samples:
+        system_prompt = get_dynamic_classifier_prompt(base_folder=BASE_FOLDER)
+        prompt = f"""{system_prompt}{"Now, follow the given examples and classify the following content accordingly!"}{text}[/INST]"""
+        start = time.perf_counter()
+        predicted = model.generate(prompt=prompt)['results'][0]['generated_text'].strip().replace(".", "").strip()
+        # the prompt classifier is always confident
+        results.append((topic, predicted, 1.0, 1.0, time.perf_counter() - start))
+    return results
+
+
+def print_results(name, results, min_similarity=MIN_SIMILARITY, min_margin=MIN_CONFIDENCE_MARGIN):
+    durations = [duration for _, _, _, _, duration in results]
+    on_topic = [result for result in results if result[0] is not None]
+    off_topic = [result for result in results if result[0] is None]
+    accuracy = np.mean([topic == predicted for topic, predicted, _, _, _ in on_topic])
+    confident = [(topic, predicted) for topic, predicted, similarity, margin, _ in on_topic
+                 if is_confident(similarity, margin, min_similarity, min_margin)]
+    confident_accuracy = np.mean([topic == predicted for topic, predicted in confident]) if confident else float('nan')
+    false_accepts = sum(is_confident(similarity, margin, min_similarity, min_margin)
+                        for _, _, similarity, margin, _ in off_topic)
+    print(f"{name:12s} accuracy {accuracy:6.1%}  confident {len(confident)}/{len(on_topic)} "
+          f"(accuracy {confident_accuracy:6.1%})  off-topic accepted {false_accepts}/{len(off_topic)}  "
+          f"latency mean {np.mean(durations) * 1000:8.1f} ms  p95 {np.percentile(durations, 95) * 1000:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--with-llm', action='store_true')
+    parser.add_argument('--calibrate', action='store_true')
+    args = parser.parse_args()
+
+    topic_sources, samples = load_samples()
+    off_topic_samples = load_off_topic_samples()
+    print(f"{len(samples)} samples of {len(topic_sources)} topics, {len(off_topic_samples)} off-topic samples")
+
+    embedding_model = SentenceTransformerEmbeddings(model_name="intfloat/multilingual-e5-large")
+    results = run_embedding_classifier(embedding_model, topic_sources, samples + off_topic_samples)
+    print(f"thresholds: similarity {MIN_SIMILARITY}, margin {MIN_CONFIDENCE_MARGIN}")
+    print_results('embedding', results)
+    if args.calibrate:
+        thresholds = calibrate(results)
+        if thresholds is None:
+            print('No thresholds separate the topics from the off-topic samples')
+        else:
+            thresholds.update(samples=len(samples), off_topic_samples=len(off_topic_samples),
+                              embedding_model='intfloat/multilingual-e5-large')
+            with open(THRESHOLDS_PATH, 'w', encoding='utf-8') as f:
+                json.dump(thresholds, f, indent=2)
+            print(f"calibrated: similarity {thresholds['min_similarity']}, "
+                  f"margin {thresholds['min_confidence_margin']} (written to {THRESHOLDS_PATH})")
+            print_results('calibrated', results, thresholds['min_similarity'], thresholds['min_confidence_margin'])
+    if args.with_llm:
+        print_results('ALLaM', run_llm_classifier(samples))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Token counting with the ALLaM tokenizer.
+The tokenizer is loaded from Hugging Face when the server starts (get_tokenizer, in the executor), otherwise with
+the first count. If it cannot be loaded (e.g. offline), the number of tokens is estimated from the number of
+characters.
+"""
+import os
+import threading
+
+# Hugging Face id of the tokenizer, ALLaM-1-13B (on watsonx) shares its tokenizer with the public ALLaM-7B
+ALLAM_TOKENIZER = os.environ.get('ALLAM_TOKENIZER', 'ALLaM-AI/ALLaM-7B-Instruct-preview')
+# Estimation if the tokenizer is not available, ALLaM needs about 3 characters per token for Arabic text
+CHARACTERS_PER_TOKEN = 3
+
+_tokenizer = None
+_tokenizer_loaded = False
+_lock = threading.Lock()
+
+
+def get_tokenizer():
+    global _tokenizer, _tokenizer_loaded
+    if not _tokenizer_loaded:
+        with _lock:
+            if not _tokenizer_loaded:
+                try:
+                    from transformers import AutoTokenizer
+                    _tokenizer = AutoTokenizer.from_pretrained(ALLAM_TOKENIZER)
+                except Exception as e:
+                    print(f"ALLaM tokenizer could not be loaded, token counts are estimated: {e}")
+                    _tokenizer = None
+                _tokenizer_loaded = True
+    return _tokenizer
+
+
+def count_tokens(text: str) -> int:
+    """Returns the number of ALLaM tokens of the text."""
+    if not text:
+        return 0
+    tokenizer = get_tokenizer()
+    if tokenizer is None:
+        return -(-len(text) // CHARACTERS_PER_TOKEN)
+    return len(tokenizer.encode(text, add_special_tokens=False))
+
+
+def truncate_to_tokens(text: str, max_tokens: int, keep: str = 'start') -> str:
+    """
+    Cuts the text to at most `max_tokens` ALLaM tokens.
+    keep='start' keeps the beginning of the text, keep='end' keeps the end (e.g. the latest turns of a conversation).
+    """
+    if max_tokens <= 0 or not text:
+        return ''
+    tokenizer = get_tokenizer()
+    if tokenizer is None:
+        max_characters = max_tokens * CHARACTERS_PER_TOKEN
+        if len(text) <= max_characters:
+            return text
+        return text[:max_characters] if keep == 'start' else text[-max_characters:]
+    token_ids = tokenizer.encode(text, add_special_tokens=False)
+    if len(token_ids) <= max_tokens:
+        return text
+    token_ids = token_ids[:max_tokens] if keep == 'start' else token_ids[-max_tokens:]
+    return tokenizer.decode(token_ids)
@@ -0,0 +1,180 @@
+# General packages
+import asyncio
+import hashlib
+import os
+from dataclasses import dataclass
+
+import aiofiles
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+
+# Size of the chunks read from the upload and written to disk
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Limits for the uploaded files of one request and of one user (the user's folder on disk)
+MAX_UPLOAD_REQUEST_BYTES = int(os.environ.get('MAX_UPLOAD_REQUEST_MB', 50)) * 1024 * 1024
+MAX_UPLOAD_USER_BYTES = int(os.environ.get('MAX_UPLOAD_USER_MB', 500)) * 1024 * 1024
+
+# Bytes written so far per user id and file, of the uploads of this process that are still running
+uploads_in_progress = {}
+
+
+def get_folder_size(folder, exclude=()):
+    """Size of all files in the folder and its subfolders, without the files in `exclude`."""
+    exclude = {os.path.abspath(path) for path in exclude}
+    size = 0
+    for directory, _, file_names in os.walk(folder):
+        for file_name in file_names:
+            path = os.path.abspath(os.path.join(directory, file_name))
+            if path not in exclude:
+                try:
+                    size += os.path.getsize(path)
+                except OSError:
+                    pass  # removed in the meantime
+    return size
+
+
+class UploadTooLargeError(Exception):
+    """Raised when an upload exceeds the request or the user limit."""
+
+
+@dataclass
+class SavedUpload:
+    path: str
+    size: int
+    sha256: str
+
+
+class UploadBudget:
+    def __init__(self, user_id: str, user_folder: str, max_request_bytes: int = MAX_UPLOAD_REQUEST_BYTES,
+                 max_user_bytes: int = MAX_UPLOAD_USER_BYTES):
+        """
+        Tracks the bytes written by one request against the request limit and the user limit.
+
+        The usage of the user is the size of the user's folder on disk (the uploads and the files generated from
+        them), so it survives restarts and is shared by all worker processes, plus the uploads of the user that are
+        still written by this process. Concurrent uploads of the same user in different worker processes can
+        exceed the limit by at most one request limit each.
+
+        Parameters:
+        user_id (str): The user the request belongs to.
+        user_folder (str): The folder with the files of the user.
+        max_request_bytes (int): Maximum size of all files of the request.
+        max_user_bytes (int): Maximum size of all files of the user.
+        """
+        self.user_id = user_id
+        self.user_folder = user_folder
+        self.max_request_bytes = max_request_bytes
+        self.max_user_bytes = max_user_bytes
+        self.request_bytes = 0
+        self.stored_bytes = 0
+
+    async def load_usage(self):
+        """Measures the stored files of the user, in the executor (the folder walk blocks)."""
+        in_progress = uploads_in_progress.get(self.user_id, {})
+        self.stored_bytes = await asyncio.get_running_loop().run_in_executor(
+            None, get_folder_size, self.user_folder, list(in_progress))
+
+    def consume(self, file_location: str, size: int):
+        # no await between the check and the update, so concurrent requests of a user in this process cannot overbook
+        in_progress = uploads_in_progress.setdefault(self.user_id, {})
+        user_bytes = self.stored_bytes + sum(in_progress.values())
+        if self.request_bytes + size > self.max_request_bytes:
+            raise UploadTooLargeError(
+                f"The upload is larger than the limit of {self.max_request_bytes // (1024 * 1024)} MB.")
+        if user_bytes + size > self.max_user_bytes:
+            raise UploadTooLargeError(
+                f"The upload limit of {self.max_user_bytes // (1024 * 1024)} MB per user is reached.")
+        self.request_bytes += size
+        in_progress[file_location] = in_progress.get(file_location, 0) + size
+
+    def finish(self, file_location: str):
+        """The file is written (or removed), from now on it is counted on disk."""
+        in_progress = uploads_in_progress.get(self.user_id, {})
+        in_progress.pop(file_location, None)
+        if not in_progress:
+            uploads_in_progress.pop(self.user_id, None)
+
+
+async def save_upload_file(upload_file: UploadFile, file_location: str, budget: UploadBudget) -> SavedUpload:
+    """
+    Streams the uploaded file to disk in chunks with async file I/O and hashes it on the fly.
+    Neither the file is held in memory nor the event loop is blocked.
+    If a limit of the budget is exceeded, the partial file is removed and UploadTooLargeError is raised.
+
+    Returns:
+    SavedUpload: The path, size and SHA-256 hash of the stored file.
+    """
+    sha256 = hashlib.sha256()
+    size = 0
+    await budget.load_usage()
+    try:
+        async with aiofiles.open(file_location, 'wb') as file_object:
+            while True:
+                chunk = await upload_file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                budget.consume(file_location, len(chunk))
+                size += len(chunk)
+                sha256.update(chunk)
+                await file_object.write(chunk)
+    except Exception:
+        if os.path.exists(file_location):
+            os.remove(file_location)
+        raise
+    finally:
+        budget.finish(file_location)
+
+    return SavedUpload(path=file_location, size=size, sha256=sha256.hexdigest())
+
+
+class RequestSizeLimitMiddleware:
+    def __init__(self, app, max_request_bytes: int = MAX_UPLOAD_REQUEST_BYTES):
+        """
+        ASGI middleware that limits the size of the request bodies, while they are received.
+
+        Starlette receives (and spools) the complete multipart body before the endpoint runs, so the limit of the
+        UploadBudget alone only applies to bodies that were already received. This middleware rejects a request
+        whose Content-Length is above the limit (413) or malformed (400) before its body is read, and stops
+        receiving a body without Content-Length (chunked) as soon as it exceeds the limit (413).
+
+        Parameters:
+        app: The ASGI application.
+        max_request_bytes (int): Maximum size of a request body.
+        """
+        self.app = app
+        self.max_request_bytes = max_request_bytes
+
+    def _get_error(self):
+        return f"The upload is larger than the limit of {self.max_request_bytes // (1024 * 1024)} MB."
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        content_length = dict(scope['headers']).get(b'content-length')
+        if content_length is not None:
+            try:
+                content_length = int(content_length)
+                if content_length < 0:
+                    raise ValueError(content_length)
+            except ValueError:
+                await JSONResponse({'detail': 'Invalid Content-Length header.'}, status_code=400)(scope, receive, send)
+                return
+            if content_length > self.max_request_bytes:
+                await JSONResponse({'detail': self._get_error()}, status_code=413)(scope, receive, send)
+                return
+
+        received_bytes = 0
+
+        async def receive_limited():
+            nonlocal received_bytes
+            message = await receive()
+            if message['type'] == 'http.request':
+                received_bytes += len(message.get('body', b''))
+                if received_bytes > self.max_request_bytes:
+                    # raised while the endpoint parses the body, FastAPI passes HTTPExceptions on as they are
+                    raise HTTPException(status_code=413, detail=self._get_error())
+            return message
+
+        await self.app(scope, receive_limited, send)
@@ -14,12 +14,17 @@ const FreeTextQuizPage = ({ theme }) => {
   const audioChunksRefs = useRef({});
   const canceledRefs = useRef({}); // Added to track cancellations
   const isRecording = useRef({}); // Added to track recording state
+  const [quizComplete, setQuizComplete] = useState(false); // To track if all questions are generated
 
   useEffect(() => {
-    // Fetch the free-text quiz data
+    // The questions are generated after the learning plan: poll the questions generated so far until the quiz is
+    // complete, the list only grows, so the new questions are appended (the answers typed so far are kept)
+    let pollTimeout = null;
+    let stopped = false;
     const fetchQuiz = async () => {
+      let complete = false;
       try {
-        const response = await fetch('http://localhost:8000/free-text-quiz/', {
+        const response = await fetch('http://localhost:8000/free-text-quiz/?wait=false', {
           method: 'GET',
           credentials: 'include',
         });
@@ -27,22 +32,32 @@ const FreeTextQuizPage = ({ theme }) => {
           throw new Error(`HTTP error! status: ${response.status}`);
         }
         const data = await response.json();
+        if (stopped) {
+          return;
+        }
 
-        if (data.quiz && data.quiz.length > 0) {
-          const parsedQuizData = data.quiz.map((quizString) =>
-            parseQuizString(quizString)
-          );
-          setQuizData(parsedQuizData);
-        } else {
+        setQuizData((prevQuizData) => [
+          ...prevQuizData,
+          ...data.quiz.slice(prevQuizData.length).map((quizString) => parseQuizString(quizString)),
+        ]);
+        complete = data.complete;
+        setQuizComplete(complete);
+        if (complete && data.quiz.length === 0) {
           console.error('No quiz data found.');
-          setQuizData([]);
         }
       } catch (error) {
         console.error('Error fetching free-text quiz:', error);
       }
+      if (!complete && !stopped) {
+        pollTimeout = setTimeout(fetchQuiz, 2000);
+      }
     };
 
     fetchQuiz();
+    return () => {
+      stopped = true;
+      clearTimeout(pollTimeout);
+    };
   }, []);
 
   // Function to parse the quiz string
@@ -334,7 +349,7 @@ const FreeTextQuizPage = ({ theme }) => {
         Enable Microphone {/* "Enable Microphone" in Arabic */}
       </button>
       {quizData.length === 0 ? (
-        <p>Loading quiz...</p>
+        <p>{quizComplete ? 'No quiz questions could be generated.' : 'Loading quiz...'}</p>
       ) : (
         <form className="w-full max-w-2xl" onSubmit={handleSubmit}>
           {quizData.map((question, index) => (
@@ -427,6 +442,7 @@ const FreeTextQuizPage = ({ theme }) => {
               )}
             </div>
           ))}
+          {!quizComplete && <p className="mb-4 text-center">More questions are being generated...</p>}
           <div className="flex justify-between mt-8">
             <button
               type="button"
@@ -438,7 +454,7 @@ const FreeTextQuizPage = ({ theme }) => {
             <button
               type="submit"
               className="bg-green-600 text-white px-6 py-2 rounded-md hover:bg-green-700 transition-colors duration-300"
-              disabled={isSubmitted}
+              disabled={isSubmitted || !quizComplete}
             >
               Submit Quiz
             </button>
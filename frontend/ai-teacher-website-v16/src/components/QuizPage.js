@@ -7,12 +7,17 @@ const QuizPage = ({ theme }) => {
   const history = useHistory();
   const [userAnswers, setUserAnswers] = useState([]); // To store user's selected answers
   const [quizSubmitted, setQuizSubmitted] = useState(false); // To track if the quiz is submitted
+  const [quizComplete, setQuizComplete] = useState(false); // To track if all questions are generated
 
   useEffect(() => {
-    // Fetch the quiz data
+    // The questions are generated after the learning plan: poll the questions generated so far until the quiz is
+    // complete, the list only grows, so the new questions are appended
+    let pollTimeout = null;
+    let stopped = false;
     const fetchQuiz = async () => {
+      let complete = false;
       try {
-        const response = await fetch('http://localhost:8000/multiple-choice-quiz/', {
+        const response = await fetch('http://localhost:8000/multiple-choice-quiz/?wait=false', {
           method: 'GET',
           credentials: 'include',
         });
@@ -20,19 +25,34 @@ const QuizPage = ({ theme }) => {
           throw new Error(`HTTP error! status: ${response.status}`);
         }
         const data = await response.json();
+        if (stopped) {
+          return;
+        }
         // data.quiz is an array of quiz questions
-        const parsedQuizData = data.quiz.map((quizString) =>
-          parseQuizString(quizString)
-        );
-        setQuizData(parsedQuizData);
-        // Initialize userAnswers with empty arrays for each question
-        setUserAnswers(parsedQuizData.map(() => []));
+        setQuizData((prevQuizData) => [
+          ...prevQuizData,
+          ...data.quiz.slice(prevQuizData.length).map((quizString) => parseQuizString(quizString)),
+        ]);
+        // Initialize userAnswers with empty arrays for each new question
+        setUserAnswers((prevUserAnswers) => [
+          ...prevUserAnswers,
+          ...data.quiz.slice(prevUserAnswers.length).map(() => []),
+        ]);
+        complete = data.complete;
+        setQuizComplete(complete);
       } catch (error) {
         console.error('Error fetching quiz:', error);
       }
+      if (!complete && !stopped) {
+        pollTimeout = setTimeout(fetchQuiz, 2000);
+      }
     };
 
     fetchQuiz();
+    return () => {
+      stopped = true;
+      clearTimeout(pollTimeout);
+    };
   }, []);
 
   // Function to parse the quiz string
@@ -153,7 +173,7 @@ const QuizPage = ({ theme }) => {
     >
       <h1 className="text-3xl font-bold mb-8">Quiz</h1>
       {quizData.length === 0 ? (
-        <p>Loading quiz...</p>
+        <p>{quizComplete ? 'No quiz questions could be generated.' : 'Loading quiz...'}</p>
       ) : (
         <form className="w-full max-w-2xl" onSubmit={handleSubmit}>
           {quizData.map((question, index) => (
@@ -212,6 +232,7 @@ const QuizPage = ({ theme }) => {
               )}
             </div>
           ))}
+          {!quizComplete && <p className="mb-4 text-center">More questions are being generated...</p>}
           <div className="flex justify-between mt-8">
             <button
               type="button"
@@ -223,7 +244,7 @@ const QuizPage = ({ theme }) => {
             <button
               type="submit"
               className="bg-green-600 text-white px-6 py-2 rounded-md hover:bg-green-700 transition-colors duration-300"
-              disabled={quizSubmitted}
+              disabled={quizSubmitted || !quizComplete}
             >
               Submit the Quiz
             </button>
@@ -55,12 +55,9 @@ const UploadPage = ({
           throw new Error(`HTTP error! status: ${response.status}`);
         }
 
-        // Get the classified_topic from response headers
-        const classifiedTopicHeader = response.headers.get('X-Classified-Topic');
-        if (classifiedTopicHeader) {
-          setClassifiedTopic(classifiedTopicHeader);
-          setSelectedTopic(classifiedTopicHeader);
-        }
+        // The topic is classified while the learning plan is streamed, fetch it without waiting for it
+        setClassifiedTopic('');
+        fetchClassifiedTopic();
 
         // Get the userId from response headers
         const userIdHeader = response.headers.get('X-User-ID');
@@ -96,6 +93,23 @@ const UploadPage = ({
     }
   };
 
+  const fetchClassifiedTopic = async () => {
+    try {
+      const response = await fetch('http://localhost:8000/classified-topic/', {
+        method: 'GET',
+        credentials: 'include',
+      });
+      if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status}`);
+      }
+      const data = await response.json();
+      setClassifiedTopic(data.topic);
+      setSelectedTopic(data.topic);
+    } catch (error) {
+      console.error('Error fetching classified topic:', error);
+    }
+  };
+
   const fetchTopics = async () => {
     try {
       const response = await fetch('http://localhost:8000/topics/', {
@@ -212,7 +226,9 @@ const UploadPage = ({
                 theme === 'light' ? 'text-gray-800' : 'text-gray-100'
               }`}
             >
-              {classifiedTopic !== 'General_Paraphrasing' ? (
+              {classifiedTopic === '' ? (
+                <>ALLAM is identifying the topic of the PDF you uploaded...</>
+              ) : classifiedTopic !== 'General_Paraphrasing' ? (
                 <>
                   ALLAM has identified the topic{' '}
                   <span className="font-bold">
@@ -406,6 +422,32 @@ const UploadPage = ({
               rehypePlugins={[rehypeKatex]}
               components={{
                 img: ({ node, ...props }) => {
+                  // optimized images are stored once for all users, e.g. /static/images/<hash>.webp?w=<width>
+                  const optimizedImage = /^\/static\/images\/([0-9a-f]+)\.(\w+)(?:\?w=(\d+))?$/.exec(props.src || '');
+                  if (optimizedImage) {
+                    const [, imageHash, imageFormat, imageWidth] = optimizedImage;
+                    const imageBase = 'http://localhost:8000/static/images';
+                    const imageSrc = `${imageBase}/${imageHash}.${imageFormat}`;
+                    if (!imageWidth) {
+                      return <img {...props} src={imageSrc} loading="lazy" />;
+                    }
+                    // thumbnails only exist for the widths below the image width, the original is the largest candidate
+                    const width = Number(imageWidth);
+                    const srcSet = [320, 640]
+                      .filter((thumbnailWidth) => thumbnailWidth < width)
+                      .map((thumbnailWidth) => `${imageBase}/${imageHash}_${thumbnailWidth}.${imageFormat} ${thumbnailWidth}w`)
+                      .concat(`${imageSrc} ${width}w`)
+                      .join(', ');
+                    return (
+                      <img
+                        {...props}
+                        src={imageSrc}
+                        srcSet={srcSet}
+                        sizes="(max-width: 700px) 100vw, 640px"
+                        loading="lazy"
+                      />
+                    );
+                  }
                   const imageSrc = `http://localhost:8000/static/user_images/${userId}/${props.src}`;
                   return <img {...props} src={imageSrc} />;
                 },